@@ -0,0 +1,163 @@
+import heapq
+
+# This file finds alternative routes: the k shortest routes between two locations that never pass the same location twice
+# (Yen's algorithm). Every alternative is found by taking the first part (the "root") of a route found earlier, and searching a
+# new route from its last location (the "spur") to the destination, without the roads the earlier routes took from there.
+#
+# All spur searches go to the same destination, so they share one search tree over the roads in reverse direction
+# ('ReverseTree'), which holds the shortest distance from every location to the destination:
+# - when the tree's own route from the spur avoids the removed roads, it is the shortest one and no search is needed at all;
+# - otherwise the spur search is an A* search that uses these distances as its estimate. Removing roads only makes distances
+#   longer, so the estimate is never too high, and it is exact for most locations, so the search goes almost straight to
+#   the destination.
+
+
+# A Dijkstra search from the destination over the roads in reverse direction. It only runs as far as needed: "distance()" continues
+# the search until the asked location has been reached.
+class ReverseTree:
+    infinity = float("inf")
+
+    def __init__(self, compiled_graph, target):
+        self.graph = compiled_graph
+        self.target = target
+        self.distances = {target: 0}
+        # The next location on the shortest route from a location to the destination.
+        self.next_hop = {}
+        self.visited = set()
+        self.queue = [(0, target)]
+
+    def distance(self, node):
+        if node in self.visited:
+            return self.distances[node]
+        graph = self.graph
+        reverse_offsets, reverse_sources, reverse_edges, weights = (graph.reverse_offsets, graph.reverse_sources, graph.reverse_edges,
+                                                                    graph.weights)
+        distances, next_hop, visited, queue = self.distances, self.next_hop, self.visited, self.queue
+        while queue:
+            distance, min_node = heapq.heappop(queue)
+            if min_node in visited:
+                continue
+            visited.add(min_node)
+            for index in range(reverse_offsets[min_node], reverse_offsets[min_node + 1]):
+                source = reverse_sources[index]
+                new_distance = distance + weights[reverse_edges[index]]
+                if new_distance < distances.get(source, self.infinity):
+                    distances[source] = new_distance
+                    next_hop[source] = min_node
+                    heapq.heappush(queue, (new_distance, source))
+            if min_node == node:
+                return distance
+        return self.infinity
+
+    # Returns the shortest route from a location to the destination as a list of ids, or None if there is none.
+    def route_from(self, node):
+        if self.distance(node) == self.infinity:
+            return None
+        route = [node]
+        while node != self.target:
+            node = self.next_hop[node]
+            route.append(node)
+        return route
+
+
+# The KShortestPaths class finds the alternative routes between one origin and one destination (location ids).
+# "next_route()" can be called again and again to get the next shortest route, so the caller only pays for the routes it uses.
+# 'last_settled' counts the locations visited by the A* spur searches, to show how much work the shared tree saves.
+class KShortestPaths:
+    infinity = float("inf")
+
+    def __init__(self, compiled_graph, source, target):
+        self.graph = compiled_graph
+        self.source = source
+        self.target = target
+        self.tree = ReverseTree(compiled_graph, target)
+        # Routes found so far, as (distance, list of ids), shortest first.
+        self.routes = []
+        # Candidates for the next route: a heap of (distance, tuple of ids), and the candidates seen before, to skip duplicates.
+        self.candidates = []
+        self.seen = set()
+        self.last_settled = 0
+
+    # Returns the next shortest route as (distance, list of ids), or None when there are no more routes.
+    def next_route(self):
+        if not self.routes:
+            route = self.tree.route_from(self.source)
+            if route is None:
+                return None
+            self.routes.append((self.tree.distance(self.source), route))
+            self.seen.add(tuple(route))
+            return self.routes[-1]
+
+        self.add_candidates(self.routes[-1][1])
+        if not self.candidates:
+            return None
+        distance, route = heapq.heappop(self.candidates)
+        self.routes.append((distance, list(route)))
+        return self.routes[-1]
+
+    # Yen's step: every location of the previous route is tried as the spur, keeping the route up to it as the root.
+    def add_candidates(self, previous):
+        graph = self.graph
+        root_distance = 0
+        for position in range(len(previous) - 1):
+            spur = previous[position]
+            root = previous[:position + 1]
+            # The roads the known routes with the same root take from the spur may not be used again,
+            # and neither may the locations of the root, so the new route never passes the same location twice.
+            removed_roads = {(spur, route[position + 1]) for distance, route in self.routes if route[:position + 1] == root}
+            removed_nodes = set(root[:-1])
+            spur_route = self.spur_route(spur, removed_nodes, removed_roads)
+            if spur_route is not None:
+                spur_distance, spur_nodes = spur_route
+                route = tuple(root[:-1]) + tuple(spur_nodes)
+                if route not in self.seen:
+                    self.seen.add(route)
+                    heapq.heappush(self.candidates, (root_distance + spur_distance, route))
+            root_distance += graph.weights[graph.edge_index(spur, previous[position + 1])]
+
+    # Shortest route from 'spur' to the destination that avoids the removed locations and roads, as (distance, list of ids).
+    def spur_route(self, spur, removed_nodes, removed_roads):
+        tree = self.tree
+        route = tree.route_from(spur)
+        if route is None:
+            return None
+        if not any(node in removed_nodes for node in route) and not any(road in removed_roads for road in zip(route, route[1:])):
+            return tree.distance(spur), route
+
+        offsets, targets, weights = self.graph.offsets, self.graph.targets, self.graph.weights
+        distances = {spur: 0}
+        path = {}
+        visited = set()
+        queue = [(tree.distance(spur), 0, spur)]
+        while queue:
+            estimate, distance, min_node = heapq.heappop(queue)
+            if min_node in visited:
+                continue
+            visited.add(min_node)
+            self.last_settled += 1
+            if min_node == self.target:
+                route = [min_node]
+                while route[-1] != spur:
+                    route.append(path[route[-1]])
+                route.reverse()
+                return distance, route
+            for edge in range(offsets[min_node], offsets[min_node + 1]):
+                node = targets[edge]
+                if node in removed_nodes or (min_node, node) in removed_roads:
+                    continue
+                new_distance = distance + weights[edge]
+                if new_distance < distances.get(node, self.infinity):
+                    remaining = tree.distance(node)
+                    if remaining == self.infinity:
+                        continue
+                    distances[node] = new_distance
+                    path[node] = min_node
+                    heapq.heappush(queue, (new_distance + remaining, new_distance, node))
+        return None
+
+    # Returns up to 'k' routes as (distance, list of location names), shortest first.
+    def shortest_routes(self, k):
+        while len(self.routes) < k and self.next_route() is not None:
+            pass
+        names = self.graph.names
+        return [(distance, [names[node] for node in route]) for distance, route in self.routes[:k]]
@@ -0,0 +1,80 @@
+from functools import cached_property
+
+# The AppContext class builds the objects of the car (battery, route planner, monitors, car and user interface) and connects them.
+# Importing a module of this project no longer creates any objects: they are only built when they are first used, so starting a
+# worker process that only needs the routing code is cheap. Every context has its own objects, so nothing is shared by accident
+# between two contexts (e.g. between two simulated cars).
+# The objects that used to be created when a module was imported (e.g. 'route_planner' or 'main_battery') still exist: they are
+# read from the default context, see "default_context()".
+class AppContext:
+    # Parts registered with the MaintenanceMonitor of a new car: (name, condition, max condition, min condition).
+    default_parts = [("Heat Pump", 99.0, 100.0, 50.0),
+                     ("Front Motor", 100.0, 100.0, 60.0),
+                     ("Battery", 100.0, 100.0, 50.0),
+                     ("Rear Motor", 100.0, 100.0, 60.0),
+                     ("Charge Port", 100.0, 100.0, 30.0)]
+
+    # All arguments are optional; by default the map from data.py is used. 'trip_log' can be e.g. TripLog("trips.journal").
+    # With a 'planner', the route planner of this context shares that planner's map (see "RoutePlanner.for_vehicle()"), which is
+    # how many cars on one map are served without building the map again for every car.
+    def __init__(self, roads=None, stations=None, locations=None, trip_log=None, start_location="The Pearl", planner=None):
+        self.roads = roads
+        self.stations = stations
+        self.locations = locations
+        self.trip_log = trip_log
+        self.start_location = start_location
+        self.planner = planner
+
+    @cached_property
+    def graph(self):
+        if self.roads is not None:
+            return self.roads
+        import data
+        return data.graph
+
+    @cached_property
+    def battery(self):
+        from energymonitor import Battery
+        return Battery(Battery.total_capacity)
+
+    @cached_property
+    def energy_monitor(self):
+        from energymonitor import EnergyMonitor
+        return EnergyMonitor()
+
+    @cached_property
+    def route_planner(self):
+        if self.planner is not None:
+            return self.planner.for_vehicle(self.trip_log, self.battery, self.energy_monitor)
+        from routeplanner import RoutePlanner
+        return RoutePlanner(self.graph, stations=self.stations, locations=self.locations, trip_log=self.trip_log,
+                            battery=self.battery, energy_monitor=self.energy_monitor)
+
+    @cached_property
+    def maintenance_monitor(self):
+        from maintenancemonitor import MaintenanceMonitor
+        maintenance_monitor = MaintenanceMonitor(self.route_planner)
+        for part in self.default_parts:
+            maintenance_monitor.add_part(*part)
+        return maintenance_monitor
+
+    @cached_property
+    def car(self):
+        from userinterface import SelfDrivingCar
+        return SelfDrivingCar(145, self.start_location)
+
+    @cached_property
+    def ui(self):
+        from userinterface import UserInterface
+        return UserInterface(self.route_planner, self.energy_monitor, self.maintenance_monitor, self.car)
+
+
+current_context = None
+
+
+# Returns the context used by the old module-level objects, and creates it the first time it is needed.
+def default_context():
+    global current_context
+    if current_context is None:
+        current_context = AppContext()
+    return current_context
@@ -0,0 +1,903 @@
+import argparse
+import asyncio
+import contextlib
+import datetime
+import heapq
+import io
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+
+import instrumentation
+from alternativeroutes import KShortestPaths
+from app import AppContext
+from compiledgraph import CompiledGraph, great_circle_distance
+from contraction import ContractionHierarchy
+from energymonitor import Battery, EnergyMonitor, FleetBattery
+from fleetsimulator import FleetSimulator
+from graphloader import load_edge_csv, load_snapshot, save_snapshot
+from maintenancemonitor import MaintenanceMonitor, PartRegistry
+from maintenancescheduler import MaintenanceScheduler
+from neareststation import NearestStationTable
+from routecache import RouteCache
+from routeplanner import Location, RoutePlanner
+from routingengine import RoutingEngine
+from routingservice import RoutingService, load_test
+from shardedrouting import ShardedRouter
+from triplog import from_epoch_day, to_epoch_day
+
+# This file is used to measure the speed of the route planning code on large, randomly generated road networks.
+# It can be run from the terminal, e.g.: python benchmark.py routing --sizes 10000 100000 1000000
+# To compare the speed of two versions of the project, use benchmarksuite.py instead.
+
+
+# Creates a road network that looks roughly like a city: every location is connected to its neighbours on a grid,
+# and a few extra roads are added at random. Roads work in both directions, just like in data.py.
+def generate_graph(num_nodes, extra_roads=0.1, seed=1):
+    rng = random.Random(seed)
+    width = max(1, int(num_nodes ** 0.5))
+    graph = {}
+    for node in range(num_nodes):
+        graph["N{}".format(node)] = {}
+
+    def add_road(a, b):
+        distance = rng.randint(1, 20)
+        graph["N{}".format(a)]["N{}".format(b)] = distance
+        graph["N{}".format(b)]["N{}".format(a)] = distance
+
+    for node in range(num_nodes):
+        if (node + 1) % width != 0 and node + 1 < num_nodes:
+            add_road(node, node + 1)
+        if node + width < num_nodes:
+            add_road(node, node + width)
+    for _ in range(int(num_nodes * extra_roads)):
+        add_road(rng.randrange(num_nodes), rng.randrange(num_nodes))
+    return graph
+
+
+# Creates a road network with coordinates, starting from 25N 51E. Road distances are the straight-line distance between two places
+# multiplied by a random detour factor, like real roads.
+# "grid" places the locations 1 km apart on a grid, "road" scatters them at random and connects every location to its nearest neighbours.
+# Returns the graph dictionary and a dictionary of Location objects.
+def generate_geo_graph(num_nodes, kind="grid", seed=1):
+    rng = random.Random(seed)
+    width = max(1, int(num_nodes ** 0.5))
+    if kind == "grid":
+        points = [(node // width, node % width) for node in range(num_nodes)]
+    else:
+        points = [(rng.uniform(0, width), rng.uniform(0, width)) for _ in range(num_nodes)]
+
+    locations = {}
+    for node, (north_km, east_km) in enumerate(points):
+        lat = 25.0 + north_km / 111.32
+        long = 51.0 + east_km / (111.32 * math.cos(math.radians(lat)))
+        locations["N{}".format(node)] = Location("N{}".format(node), lat, long)
+
+    graph = {name: {} for name in locations}
+
+    def add_road(a, b):
+        location_a, location_b = locations["N{}".format(a)], locations["N{}".format(b)]
+        straight = great_circle_distance(math.radians(location_a.lat_coord), math.radians(location_a.long_coord),
+                                         math.radians(location_b.lat_coord), math.radians(location_b.long_coord))
+        distance = round(straight * rng.uniform(1.0, 1.4), 3)
+        graph["N{}".format(a)]["N{}".format(b)] = distance
+        graph["N{}".format(b)]["N{}".format(a)] = distance
+
+    if kind == "grid":
+        for node in range(num_nodes):
+            if (node + 1) % width != 0 and node + 1 < num_nodes:
+                add_road(node, node + 1)
+            if node + width < num_nodes:
+                add_road(node, node + width)
+    else:
+        # Locations are sorted into 1 km cells, so that the nearest neighbours are found by only looking at the surrounding cells.
+        cells = {}
+        for node, (north_km, east_km) in enumerate(points):
+            cells.setdefault((int(north_km), int(east_km)), []).append(node)
+        for node, (north_km, east_km) in enumerate(points):
+            cell_north, cell_east = int(north_km), int(east_km)
+            candidates = []
+            for north in range(cell_north - 1, cell_north + 2):
+                for east in range(cell_east - 1, cell_east + 2):
+                    for other in cells.get((north, east), []):
+                        if other != node:
+                            candidates.append(((points[other][0] - north_km) ** 2 + (points[other][1] - east_km) ** 2, other))
+            for _, other in sorted(candidates)[:3]:
+                add_road(node, other)
+        # Connect consecutive cells, so the whole network can be reached.
+        previous = None
+        for key in sorted(cells):
+            if previous is not None:
+                add_road(cells[previous][0], cells[key][0])
+            previous = key
+    return graph, locations
+
+
+# Picks random origin/destination pairs from the graph, so every implementation is timed on the same queries.
+def generate_queries(graph, count, seed=2):
+    rng = random.Random(seed)
+    nodes = list(graph)
+    return [(rng.choice(nodes), rng.choice(nodes)) for _ in range(count)]
+
+
+# This is the search that RoutePlanner.calculate_route used before the RoutingEngine was introduced.
+# It is kept here so that the new implementation can be compared against it.
+def legacy_shortest_path(graph, origin, destination):
+    unvisited_nodes = graph.copy()
+    infinity = float("inf")
+    distances = {}
+    path = {}
+
+    for nodes in unvisited_nodes:
+        distances[nodes] = infinity
+    distances[origin] = 0
+
+    while unvisited_nodes:
+        min_node = min(unvisited_nodes, key=distances.get)
+        for node, value in unvisited_nodes[min_node].items():
+            if value + distances[min_node] < distances[node]:
+                distances[node] = value + distances[min_node]
+                path[node] = min_node
+        unvisited_nodes.pop(min_node)
+    return distances[destination]
+
+
+# Yen's algorithm with a separate Dijkstra search for every spur, like it is usually written. It is kept here so that
+# alternativeroutes.py, which shares one reverse search tree between the spur searches, can be compared against it.
+def plain_k_shortest_paths(compiled_graph, source, target, k):
+    offsets, targets, weights = compiled_graph.offsets, compiled_graph.targets, compiled_graph.weights
+
+    def search(spur, removed_nodes, removed_roads):
+        distances = {spur: 0}
+        path = {}
+        visited = set()
+        queue = [(0, spur)]
+        while queue:
+            distance, node = heapq.heappop(queue)
+            if node in visited:
+                continue
+            visited.add(node)
+            if node == target:
+                route = [node]
+                while route[-1] != spur:
+                    route.append(path[route[-1]])
+                return distance, route[::-1]
+            for edge in range(offsets[node], offsets[node + 1]):
+                neighbour = targets[edge]
+                if neighbour in removed_nodes or (node, neighbour) in removed_roads:
+                    continue
+                if distance + weights[edge] < distances.get(neighbour, float("inf")):
+                    distances[neighbour] = distance + weights[edge]
+                    path[neighbour] = node
+                    heapq.heappush(queue, (distance + weights[edge], neighbour))
+        return None
+
+    first = search(source, set(), set())
+    if first is None:
+        return []
+    routes = [first]
+    candidates = []
+    seen = {tuple(first[1])}
+    while len(routes) < k:
+        previous = routes[-1][1]
+        root_distance = 0
+        for position in range(len(previous) - 1):
+            root = previous[:position + 1]
+            removed_roads = {(previous[position], route[position + 1]) for distance, route in routes if route[:position + 1] == root}
+            spur_route = search(previous[position], set(root[:-1]), removed_roads)
+            if spur_route is not None and tuple(root[:-1] + spur_route[1]) not in seen:
+                seen.add(tuple(root[:-1] + spur_route[1]))
+                heapq.heappush(candidates, (root_distance + spur_route[0], root[:-1] + spur_route[1]))
+            root_distance += weights[compiled_graph.edge_index(previous[position], previous[position + 1])]
+        if not candidates:
+            break
+        routes.append(heapq.heappop(candidates))
+    return routes
+
+
+# Picks random locations to act as charging stations.
+def generate_stations(graph, count, seed=3):
+    rng = random.Random(seed)
+    return rng.sample(list(graph), min(count, len(graph)))
+
+
+# Runs every query once and returns the average time per query in milliseconds.
+def time_queries(function, queries):
+    start = time.perf_counter()
+    for origin, destination in queries:
+        function(origin, destination)
+    return (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def benchmark_routing(sizes, queries, legacy_limit):
+    print("{:>10} {:>15} {:>15} {:>10}".format("nodes", "legacy (ms)", "engine (ms)", "speed-up"))
+    for size in sizes:
+        graph = generate_graph(size)
+        engine = RoutingEngine(CompiledGraph(graph))
+        query_list = generate_queries(graph, queries)
+
+        for origin, destination in query_list[:3]:
+            if size <= legacy_limit:
+                assert engine.shortest_path(origin, destination)[0] == legacy_shortest_path(graph, origin, destination)
+
+        engine_ms = time_queries(engine.shortest_path, query_list)
+        if size <= legacy_limit:
+            # The old implementation is O(V^2), so it is only timed on a few queries.
+            legacy_ms = time_queries(lambda origin, destination: legacy_shortest_path(graph, origin, destination), query_list[:3])
+            print("{:>10} {:>15.2f} {:>15.2f} {:>9.1f}x".format(size, legacy_ms, engine_ms, legacy_ms / engine_ms))
+        else:
+            print("{:>10} {:>15} {:>15.2f} {:>10}".format(size, "skipped", engine_ms, "-"))
+
+
+# Compares finding the nearest charging station with one search per station (the old suggest_charging)
+# against a single search that stops at the first station, for a growing number of stations.
+def benchmark_stations(size, station_counts, queries):
+    graph = generate_graph(size)
+    engine = RoutingEngine(CompiledGraph(graph))
+    origins = [origin for origin, destination in generate_queries(graph, queries)]
+
+    def per_station(origin, stations):
+        return min(engine.shortest_path(origin, station)[0] for station in stations)
+
+    print("{:>10} {:>18} {:>18}".format("stations", "per station (ms)", "single (ms)"))
+    for count in station_counts:
+        stations = generate_stations(graph, count)
+        station_set = set(stations)
+        for origin in origins[:3]:
+            assert per_station(origin, stations) == engine.nearest(origin, station_set)[0]
+
+        single_ms = time_queries(lambda origin, destination: engine.nearest(origin, station_set), [(origin, None) for origin in origins])
+        # One search per station gets very slow with many stations, so it is only timed on a few origins.
+        per_station_ms = time_queries(lambda origin, destination: per_station(origin, stations), [(origin, None) for origin in origins[:3]])
+        print("{:>10} {:>18.2f} {:>18.2f}".format(count, per_station_ms, single_ms))
+
+
+# Replays a workload where vehicles keep asking for routes from a small set of depots, with and without the route cache.
+def benchmark_cache(size, origins, queries, cache_size):
+    graph = generate_graph(size)
+    compiled = CompiledGraph(graph)
+    engine = RoutingEngine(compiled)
+    cache = RouteCache(compiled, cache_size)
+    rng = random.Random(4)
+    depots = generate_stations(graph, origins)
+    nodes = list(graph)
+    query_list = [(rng.choice(depots), rng.choice(nodes)) for _ in range(queries)]
+
+    engine_ms = time_queries(engine.shortest_path, query_list)
+    cache_ms = time_queries(cache.shortest_path, query_list)
+    print("{:>15} {:>15} {:>15}".format("origins", "engine (ms)", "cache (ms)"))
+    print("{:>15} {:>15.2f} {:>15.2f}".format(origins, engine_ms, cache_ms))
+    print(cache.stats())
+
+
+# Simulates a live traffic feed: every update changes the distance of a random road (slower or faster, sometimes closed), and is
+# followed by 'queries_per_update' route requests from a fixed set of depots. "repair" uses RoutePlanner.update_road, which repairs
+# the cached search trees and the nearest station table; "rebuild" changes the road and then recomputes everything from scratch.
+def benchmark_traffic(size, origins, updates, queries_per_update):
+    graph = generate_graph(size)
+    stations = generate_stations(graph, max(1, size // 100))
+    depots = generate_stations(graph, origins, seed=4)
+    nodes = list(graph)
+    roads = [(origin, destination) for origin in graph for destination in graph[origin]]
+    rng = random.Random(5)
+    changes = []
+    for _ in range(updates):
+        origin, destination = rng.choice(roads)
+        factor = float("inf") if rng.random() < 0.05 else rng.uniform(0.5, 2.0)
+        queries = [(rng.choice(depots), rng.choice(nodes)) for _ in range(queries_per_update)]
+        changes.append((origin, destination, factor, queries))
+
+    print("{:>10} {:>12} {:>18} {:>15}".format("mode", "updates", "ms per update", "queries/s"))
+    for mode in ("repair", "rebuild"):
+        planner = RoutePlanner(graph, stations=stations, locations={}, cache_size=2 * origins)
+        for depot in depots:
+            planner.find_route(depot, rng.choice(nodes))
+        update_seconds = 0
+        query_seconds = 0
+        for origin, destination, factor, queries in changes:
+            start = time.perf_counter()
+            if mode == "repair":
+                planner.update_road(origin, destination, graph[origin][destination] * factor)
+            else:
+                planner.compiled_graph.set_weight(origin, destination, graph[origin][destination] * factor)
+                planner.station_table = NearestStationTable(planner.compiled_graph, stations)
+            update_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            for query in queries:
+                planner.find_route(*query)
+            query_seconds += time.perf_counter() - start
+        print("{:>10} {:>12} {:>18.2f} {:>15.0f}".format(mode, updates, update_seconds / updates * 1000,
+                                                         updates * queries_per_update / query_seconds))
+
+
+# Compares A* with Dijkstra's algorithm on networks with coordinates: the number of locations visited per query and the time per query.
+def benchmark_astar(sizes, queries):
+    print("{:>6} {:>10} {:>18} {:>18} {:>15} {:>15}".format("kind", "nodes", "dijkstra visited", "astar visited", "dijkstra (ms)", "astar (ms)"))
+    for kind in ("grid", "road"):
+        for size in sizes:
+            graph, locations = generate_geo_graph(size, kind)
+            compiled = CompiledGraph(graph)
+            compiled.set_coordinates(locations)
+            engine = RoutingEngine(compiled)
+            query_list = generate_queries(graph, queries)
+
+            dijkstra_visited = astar_visited = 0
+            for origin, destination in query_list:
+                distance = engine.shortest_path(origin, destination)[0]
+                dijkstra_visited += engine.last_settled
+                assert abs(engine.astar_path(origin, destination)[0] - distance) < 1e-6
+                astar_visited += engine.last_settled
+
+            dijkstra_ms = time_queries(engine.shortest_path, query_list)
+            astar_ms = time_queries(engine.astar_path, query_list)
+            print("{:>6} {:>10} {:>18} {:>18} {:>15.2f} {:>15.2f}".format(kind, size, dijkstra_visited // len(query_list),
+                                                                          astar_visited // len(query_list), dijkstra_ms, astar_ms))
+
+
+# Measures building, saving and querying a contraction hierarchy, compared with Dijkstra's algorithm on the same graph.
+def benchmark_hierarchy(sizes, queries):
+    print("{:>10} {:>12} {:>12} {:>12} {:>12} {:>12} {:>12} {:>15} {:>12}".format(
+        "nodes", "build (s)", "shortcuts", "graph (MB)", "ch (MB)", "file (MB)", "ch visited", "dijkstra (ms)", "ch (ms)"))
+    for size in sizes:
+        graph, locations = generate_geo_graph(size, "road")
+        compiled = CompiledGraph(graph)
+        engine = RoutingEngine(compiled)
+        graph_mb = sum(part.itemsize * len(part) for part in (compiled.offsets, compiled.targets, compiled.weights)) / 1e6
+
+        start = time.perf_counter()
+        hierarchy = ContractionHierarchy.build(compiled)
+        build_s = time.perf_counter() - start
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "hierarchy.bin")
+            hierarchy.save(path)
+            file_mb = os.path.getsize(path) / 1e6
+            hierarchy = ContractionHierarchy.load(path, compiled)
+
+        query_list = generate_queries(graph, queries)
+        visited = 0
+        for origin, destination in query_list:
+            assert abs(hierarchy.shortest_path(origin, destination)[0] - engine.shortest_path(origin, destination)[0]) < 1e-6
+            visited += hierarchy.last_settled
+        dijkstra_ms = time_queries(engine.shortest_path, query_list)
+        hierarchy_ms = time_queries(hierarchy.shortest_path, query_list)
+        print("{:>10} {:>12.1f} {:>12} {:>12.2f} {:>12.2f} {:>12.2f} {:>12} {:>15.2f} {:>12.3f}".format(
+            size, build_s, hierarchy.shortcut_count(), graph_mb, hierarchy.memory_bytes() / 1e6, file_mb,
+            visited // len(query_list), dijkstra_ms, hierarchy_ms))
+
+
+# Times RoutePlanner.distance_matrix for N origins x M destinations with a growing number of worker processes. The pool is
+# always used here, also for small matrices, to show where it starts to pay off (see RoutePlanner.matrix_pool_min_work); the
+# number of processes is still limited to the number of cores.
+def benchmark_matrix(size, origins, destinations, process_counts):
+    graph = generate_graph(size)
+    planner = RoutePlanner(graph, stations=[])
+    rng = random.Random(5)
+    nodes = list(graph)
+    origin_list = [rng.choice(nodes) for _ in range(origins)]
+    destination_list = [rng.choice(nodes) for _ in range(destinations)]
+
+    planner.matrix_pool_min_work = 0
+    print("{} cores; distance_matrix uses worker processes for this matrix: {}".format(
+        os.cpu_count() or 1, (os.cpu_count() or 1) > 1 and origins * size >= RoutePlanner.matrix_pool_min_work))
+    print("{:>10} {:>12} {:>15} {:>10}".format("processes", "time (s)", "origins/s", "speedup"))
+    expected = None
+    for processes in process_counts:
+        start = time.perf_counter()
+        matrix = planner.distance_matrix(origin_list, destination_list, processes)
+        elapsed = time.perf_counter() - start
+        if expected is None:
+            expected, first_elapsed = matrix, elapsed
+        assert matrix == expected
+        print("{:>10} {:>12.2f} {:>15.1f} {:>9.2f}x".format(processes, elapsed, origins / elapsed, first_elapsed / elapsed))
+
+
+# Compares approving one trip for every vehicle of a fleet with Battery objects and "route_approval()", against
+# FleetBattery and "route_approval_batch()". Both must give the same approvals and battery levels.
+# Both are Python loops (there is no NumPy); the batch only saves the Battery objects and the method calls, which measured about
+# 1.5-2.5x more trips per second on 10,000 to 1,000,000 vehicles.
+def benchmark_fleet(sizes):
+    monitor = EnergyMonitor()
+    print("{:>10} {:>18} {:>18} {:>10}".format("vehicles", "scalar (trips/s)", "batch (trips/s)", "speedup"))
+    for size in sizes:
+        rng = random.Random(6)
+        start_levels = [rng.uniform(0, 75) for _ in range(size)]
+        distances = [rng.uniform(0, 200) for _ in range(size)]
+
+        batteries = [Battery(level) for level in start_levels]
+        start = time.perf_counter()
+        # The scalar method prints a message for every rejected trip, which is not part of the measurement.
+        with contextlib.redirect_stdout(io.StringIO()):
+            scalar = [monitor.route_approval(battery, distance) for battery, distance in zip(batteries, distances)]
+        scalar_s = time.perf_counter() - start
+
+        fleet = FleetBattery(size)
+        fleet.levels[:] = array("d", start_levels)
+        start = time.perf_counter()
+        batch = monitor.route_approval_batch(fleet, distances)
+        batch_s = time.perf_counter() - start
+
+        assert [bool(approved) for approved in scalar] == [bool(approved) for approved in batch]
+        assert [battery.get_current_level() for battery in batteries] == list(fleet.levels)
+        print("{:>10} {:>18.0f} {:>18.0f} {:>9.1f}x".format(size, size / scalar_s, size / batch_s, scalar_s / batch_s))
+
+
+# Compares the maintenance forecast of a fleet with one MaintenanceMonitor per car (calc_maintenance for every car) against one
+# PartRegistry for the whole fleet, and the memory of the parts in the old dictionary format against the registry.
+def benchmark_parts(sizes):
+    planner = RoutePlanner(generate_graph(100), stations=["N1"], locations={})
+    for day in range(30):
+        planner.trips_taken.append(10, "N1", "N2", datetime.date(2023, 1, 1) + datetime.timedelta(days=day))
+    print("{:>10} {:>18} {:>18} {:>12} {:>15}".format("vehicles", "per car (cars/s)", "fleet (cars/s)", "dicts (MB)", "registry (MB)"))
+    for size in sizes:
+        rng = random.Random(8)
+        conditions = [[rng.uniform(min_condition + 1, max_condition) for name, condition, max_condition, min_condition
+                       in AppContext.default_parts] for _ in range(size)]
+
+        monitors = []
+        for car in range(size):
+            monitor = MaintenanceMonitor(planner)
+            for (name, condition, max_condition, min_condition), current in zip(AppContext.default_parts, conditions[car]):
+                monitor.add_part(name, current, max_condition, min_condition)
+            monitors.append(monitor)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            per_car = [monitor.calc_maintenance() for monitor in monitors]
+        per_car_s = time.perf_counter() - start
+
+        tracemalloc.start()
+        registry = PartRegistry(size)
+        for part, (name, condition, max_condition, min_condition) in enumerate(AppContext.default_parts):
+            registry.add_part(name, condition, max_condition, min_condition)
+            registry.conditions[part][:] = array("d", [car_conditions[part] for car_conditions in conditions])
+        registry_mb = tracemalloc.get_traced_memory()[0] / 1000000
+        tracemalloc.stop()
+        start = time.perf_counter()
+        forecast = registry.forecast(monitors[0].get_total_days())
+        fleet_s = time.perf_counter() - start
+        for car in range(0, size, max(1, size // 100)):
+            assert per_car[car] == [(name, "today" if days[car] == 0 else "in {} days".format(int(days[car])))
+                                    for name, days in zip(registry.names, forecast["days"])]
+
+        tracemalloc.start()
+        dictionaries = [{name: dict(part) for name, part in monitor.parts.items()} for monitor in monitors]
+        dictionaries_mb = tracemalloc.get_traced_memory()[0] / 1000000
+        tracemalloc.stop()
+        del dictionaries
+        print("{:>10} {:>18.0f} {:>18.0f} {:>12.1f} {:>15.1f}".format(size, size / per_car_s, size / fleet_s, dictionaries_mb, registry_mb))
+
+
+# Compares the memory used by the graph dictionary with the memory used by the CompiledGraph built from it.
+def benchmark_graph(sizes):
+    print("{:>10} {:>15} {:>15} {:>15}".format("nodes", "dict (MB)", "compiled (MB)", "compile (ms)"))
+    for size in sizes:
+        tracemalloc.start()
+        graph = generate_graph(size)
+        dict_mb = tracemalloc.get_traced_memory()[0] / 1e6
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        CompiledGraph(graph)
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        tracemalloc.start()
+        compiled = CompiledGraph(graph)
+        # The name index is shared with the dictionary keys, so only the arrays and the id lookup count towards the total.
+        compiled_mb = tracemalloc.get_traced_memory()[0] / 1e6
+        tracemalloc.stop()
+        print("{:>10} {:>15.1f} {:>15.1f} {:>15.1f}".format(size, dict_mb, compiled_mb, compile_ms))
+
+
+# Compares reading a map from a CSV edge list (and compiling it) with loading a binary snapshot of the same map.
+def benchmark_loader(sizes):
+    print("{:>10} {:>12} {:>14} {:>12} {:>16} {:>20}".format("nodes", "CSV (MB)", "CSV load (ms)", "save (ms)", "snapshot (ms)", "snapshot+names (ms)"))
+    with tempfile.TemporaryDirectory() as folder:
+        csv_path = os.path.join(folder, "roads.csv")
+        snapshot_path = os.path.join(folder, "roads.graph")
+        for size in sizes:
+            graph = generate_graph(size)
+            with open(csv_path, "w", encoding="utf-8") as file:
+                file.write("origin,destination,km\n")
+                for origin, roads in graph.items():
+                    for destination, distance in roads.items():
+                        file.write("{},{},{}\n".format(origin, destination, distance))
+            del graph
+
+            start = time.perf_counter()
+            compiled = CompiledGraph(load_edge_csv(csv_path, validate=False))
+            csv_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            save_snapshot(compiled, snapshot_path)
+            save_ms = (time.perf_counter() - start) * 1000
+            del compiled
+
+            start = time.perf_counter()
+            snapshot = load_snapshot(snapshot_path)
+            snapshot_ms = (time.perf_counter() - start) * 1000
+            snapshot.node_id("N0")
+            names_ms = (time.perf_counter() - start) * 1000
+            del snapshot
+            print("{:>10} {:>12.1f} {:>14.1f} {:>12.1f} {:>16.2f} {:>20.1f}".format(
+                size, os.path.getsize(csv_path) / 1e6, csv_ms, save_ms, snapshot_ms, names_ms))
+
+
+# Measures the import time of every module with "python -X importtime", in a new interpreter each time. Python prints the
+# cumulative time of every top-level import; the imports of an empty interpreter (e.g. 'site') are subtracted.
+# "+ context" also builds the default AppContext (route planner, monitors, car and UI), i.e. the cost that used to be paid on import.
+# The fastest of 'repeat' runs is shown.
+def measure_import_time(code, repeat):
+    folder = os.path.dirname(os.path.abspath(__file__))
+    best = float("inf")
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=folder, capture_output=True, text=True)
+        total = 0
+        for line in result.stderr.splitlines():
+            columns = line.split("|")
+            if line.startswith("import time:") and columns[1].strip().isdigit() and not columns[2].startswith("  "):
+                total += int(columns[1])
+        best = min(best, total / 1000)
+    return best
+
+
+def benchmark_imports(modules, repeat):
+    empty = measure_import_time("pass", repeat)
+    print("{:>20} {:>15} {:>22}".format("module", "import (ms)", "import + context (ms)"))
+    for module in modules:
+        import_ms = measure_import_time("import {}".format(module), repeat) - empty
+        context_ms = measure_import_time("import {}; import app; app.default_context().ui".format(module), repeat) - empty
+        print("{:>20} {:>15.1f} {:>22.1f}".format(module, import_ms, context_ms))
+
+# Starts a RoutingService on a free port and runs the load test client against it, once for every batch size.
+# The client runs in the same process as the service, so its own work is included in the latency.
+def benchmark_service(batch_sizes, processes, connections, requests, window):
+    async def run(batch_size):
+        service = RoutingService(processes=processes, batch_size=batch_size)
+        port = await service.start("127.0.0.1", 0)
+        try:
+            return await load_test(port=port, connections=connections, requests=requests, window=window), service.batches
+        finally:
+            await service.close()
+
+    print("{:>12} {:>10} {:>16} {:>10} {:>10} {:>8}".format("batch size", "batches", "requests/s", "p50 (ms)", "p99 (ms)", "errors"))
+    for batch_size in batch_sizes:
+        report, batches = asyncio.run(run(batch_size))
+        print("{:>12} {:>10} {:>16.0f} {:>10.2f} {:>10.2f} {:>8}".format(
+            batch_size, batches, report["throughput"], report["p50_ms"], report["p99_ms"], report["errors"]))
+
+
+# Simulated trips per second of the FleetSimulator for different fleet sizes and numbers of processes, on a generated road network
+# where the cars drive between 'hotspots' popular destinations. Trip logs are not kept, so that one process and several processes
+# do the same work.
+def benchmark_simulator(car_counts, process_counts, size, days, hotspots):
+    graph, locations = generate_geo_graph(size, "road")
+    stations = generate_stations(graph, max(1, size // 100))
+    destinations = generate_stations(graph, hotspots, seed=4)
+    compiled = CompiledGraph(graph)
+    print("{:>10} {:>10} {:>12} {:>12} {:>15}".format("cars", "processes", "trips", "seconds", "trips/s"))
+    for car_count in car_counts:
+        for processes in process_counts:
+            report = FleetSimulator(compiled, stations, car_count, processes, destinations=destinations, keep_trip_logs=False).run(days)
+            print("{:>10} {:>10} {:>12} {:>12.2f} {:>15.0f}".format(
+                car_count, processes, report["trips"], report["seconds"], report["trips_per_second"]))
+
+
+# Times k = 1..max_k alternative routes per query, with the shared reverse search tree (alternativeroutes.py) and with a
+# separate Dijkstra search per spur (only on graphs up to 'plain_limit' locations, as it gets very slow).
+def benchmark_alternatives(sizes, queries, max_k, plain_limit):
+    print("{:>10} {:>4} {:>15} {:>15} {:>18}".format("nodes", "k", "shared (ms)", "plain (ms)", "spur visited"))
+    for size in sizes:
+        compiled = CompiledGraph(generate_graph(size))
+        query_list = [(compiled.node_id(origin), compiled.node_id(destination)) for origin, destination in
+                      generate_queries(compiled.names, queries) if origin != destination]
+        for k in range(1, max_k + 1):
+            settled = 0
+            start = time.perf_counter()
+            results = []
+            for source, target in query_list:
+                search = KShortestPaths(compiled, source, target)
+                search.shortest_routes(k)
+                results.append([distance for distance, route in search.routes[:k]])
+                settled += search.last_settled
+            shared_ms = (time.perf_counter() - start) * 1000 / len(query_list)
+            plain_ms = "skipped"
+            if size <= plain_limit:
+                start = time.perf_counter()
+                plain = [[distance for distance, route in plain_k_shortest_paths(compiled, source, target, k)]
+                         for source, target in query_list]
+                plain_ms = "{:.2f}".format((time.perf_counter() - start) * 1000 / len(query_list))
+                assert all(all(abs(a - b) < 1e-9 for a, b in zip(x, y)) and len(x) == len(y) for x, y in zip(results, plain))
+            print("{:>10} {:>4} {:>15.2f} {:>15} {:>18}".format(size, k, shared_ms, plain_ms, settled // len(query_list)))
+
+
+# Compares finding every location a car can reach by calling calculate_route for every destination (the only way before
+# "reachable_locations()") with one bounded search, and times the batch version for a fleet of vehicles at a few depots.
+def benchmark_reachable(size, destinations, vehicles):
+    graph = generate_graph(size)
+    stations = generate_stations(graph, max(1, size // 100))
+    planner = RoutePlanner(graph, stations=stations, locations={}, cache_size=0)
+    origin = next(iter(graph))
+    battery_level = Battery.total_capacity / 2
+    targets = generate_stations(graph, destinations, seed=5)
+
+    def per_destination():
+        reachable = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            for destination in targets:
+                planner.battery.set_current_level(battery_level)
+                result = planner.calculate_route(graph, origin, destination)
+                if result is not None and result[2]:
+                    reachable[destination] = result[0]
+        return reachable
+
+    start = time.perf_counter()
+    reachable = per_destination()
+    per_destination_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    isochrone = planner.reachable_locations(origin, battery_level)
+    isochrone_seconds = time.perf_counter() - start
+    assert all(isochrone[name][0] == distance for name, distance in reachable.items())
+    assert len(reachable) == len([name for name in targets if name in isochrone])
+    print("{} of {} destinations reachable: calculate_route per destination {:.1f} ms, one bounded search {:.1f} ms "
+          "({} locations in range).".format(len(reachable), destinations, per_destination_seconds * 1000, isochrone_seconds * 1000,
+                                            len(isochrone)))
+
+    rng = random.Random(6)
+    depots = generate_stations(graph, 10, seed=7)
+    origins = [rng.choice(depots) for _ in range(vehicles)]
+    levels = [rng.uniform(10, Battery.total_capacity) for _ in range(vehicles)]
+    start = time.perf_counter()
+    planner.reachable_locations_batch(origins, levels)
+    print("Batch for {} vehicles at {} depots: {:.1f} ms.".format(vehicles, len(depots), (time.perf_counter() - start) * 1000))
+
+
+# Measures what the instrumentation costs on route queries: switched off (the original methods), switched on, and with cProfile
+# or the sampling profiler running as well.
+def benchmark_instrumentation(size, queries):
+    graph = generate_graph(size)
+    planner = RoutePlanner(graph, stations=generate_stations(graph, max(1, size // 100)), locations={}, cache_size=0)
+    query_list = generate_queries(graph, queries)
+
+    def run_queries(origin, destination):
+        planner.battery.set_current_level(Battery.total_capacity)
+        planner.calculate_route(graph, origin, destination)
+        planner.suggest_charging(graph, origin)
+
+    print("{:>12} {:>15} {:>10}".format("mode", "ms per query", "overhead"))
+    baseline = None
+    for mode in ("off", "on", "sample", "profile"):
+        if mode != "off":
+            instrumentation.enable(profile=mode == "profile", sample=mode == "sample")
+        with contextlib.redirect_stdout(io.StringIO()):
+            query_ms = time_queries(run_queries, query_list)
+        instrumentation.disable()
+        instrumentation.reset()
+        baseline = query_ms if baseline is None else baseline
+        print("{:>12} {:>15.2f} {:>9.1f}%".format(mode, query_ms, (query_ms / baseline - 1) * 100))
+
+
+# Compares keeping the next services of a fleet up to date in the MaintenanceScheduler with calculating the forecast of the whole
+# fleet again for every question ("on demand"), after every trip. Then the vehicles due within a week are sent to their nearest
+# service location.
+def benchmark_scheduler(sizes, trips, on_demand_limit, map_size, service_locations):
+    today = to_epoch_day(datetime.date(2023, 3, 1))
+    graph = generate_graph(map_size)
+    planner = RoutePlanner(graph, stations=["N1"], locations={})
+    services = generate_stations(graph, service_locations, seed=9)
+    print("{:>10} {:>11} {:>20} {:>20} {:>12} {:>12} {:>12}".format("vehicles", "build (ms)", "scheduler (us/trip)",
+                                                                    "on demand (us/trip)", "emergencies", "due in week", "assign (ms)"))
+    for size in sizes:
+        rng = random.Random(8)
+        registry = PartRegistry(size)
+        for part, (name, condition, max_condition, min_condition) in enumerate(AppContext.default_parts):
+            registry.add_part(name, condition, max_condition, min_condition)
+            registry.conditions[part][:] = array("d", [rng.uniform(min_condition + 1, max_condition) for _ in range(size)])
+        active_days = [rng.randint(1, 60) for _ in range(size)]
+        start = time.perf_counter()
+        scheduler = MaintenanceScheduler(registry, active_days, [today] * size)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        # Every trip is on the next day of a random vehicle, so its forecast changes, and is followed by both questions.
+        trip_vehicles = [rng.randrange(size) for _ in range(trips)]
+        start = time.perf_counter()
+        for trip, vehicle in enumerate(trip_vehicles):
+            scheduler.record_trip(vehicle, 10, from_epoch_day(today + 1 + trip))
+            scheduler.next_due(10)
+            scheduler.emergencies()
+        scheduler_us = (time.perf_counter() - start) * 1000000 / trips
+
+        on_demand = "-"
+        if size <= on_demand_limit:
+            active_days = array("q", scheduler.active_days)
+            start = time.perf_counter()
+            for trip, vehicle in enumerate(trip_vehicles[:10]):
+                active_days[vehicle] += 1
+                forecast = registry.forecast(active_days)
+                heapq.nsmallest(10, ((days, vehicle, part) for part, part_days in enumerate(forecast["days"])
+                                     for vehicle, days in enumerate(part_days)))
+                [vehicle for vehicle, urgent in enumerate(forecast["emergency"]) if urgent]
+            on_demand = "{:.0f}".format((time.perf_counter() - start) * 1000000 / min(10, trips))
+
+        locations = ["N{}".format(rng.randrange(map_size)) for _ in range(size)]
+        start = time.perf_counter()
+        assignments = scheduler.assign_service_locations(planner, locations, services, from_epoch_day(today + 7),
+                                                         capacity=size // service_locations + 1)
+        assign_ms = (time.perf_counter() - start) * 1000
+        print("{:>10} {:>11.1f} {:>20.1f} {:>20} {:>12} {:>12} {:>12.1f}".format(size, build_ms, scheduler_us, on_demand,
+                                                                                 len(scheduler.emergency_parts), len(assignments), assign_ms))
+
+
+# Compares the ShardedRouter (one worker process per region) with a single RoutePlanner on the same road-like map: the time to
+# divide the map and build the overlay, the size of the overlay, and the time per route for a batch of queries.
+def benchmark_shards(size, shard_counts, queries):
+    graph, locations = generate_geo_graph(size, "road")
+    compiled_graph = CompiledGraph(graph)
+    query_list = generate_queries(graph, queries)
+    # Different queries for single routes, so that they do not reuse the search trees the workers kept from the batch.
+    single_queries = generate_queries(graph, queries, seed=5)
+    engine = RoutingEngine(compiled_graph)
+    start = time.perf_counter()
+    expected = engine.shortest_paths(query_list)
+    single_ms = (time.perf_counter() - start) * 1000 / queries
+    print("Single process: {:.2f} ms per route.".format(single_ms))
+    print("{:>8} {:>11} {:>18} {:>18} {:>17} {:>17}".format("shards", "setup (s)", "boundary locations", "overlay roads",
+                                                            "batch (ms/route)", "single (ms/route)"))
+    for shard_count in shard_counts:
+        start = time.perf_counter()
+        with ShardedRouter(compiled_graph, shard_count) as router:
+            setup_s = time.perf_counter() - start
+            start = time.perf_counter()
+            results = router.shortest_paths(query_list)
+            batch_ms = (time.perf_counter() - start) * 1000 / queries
+            start = time.perf_counter()
+            for origin, destination in single_queries:
+                router.shortest_path(origin, destination)
+            one_ms = (time.perf_counter() - start) * 1000 / queries
+            boundary, overlay = router.overlay_size()
+        for (distance, route), (expected_distance, expected_route) in zip(results, expected):
+            assert abs(distance - expected_distance) < 1e-6
+        print("{:>8} {:>11.2f} {:>18} {:>18} {:>17.2f} {:>17.2f}".format(shard_count, setup_s, boundary, overlay, batch_ms, one_ms))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the route planner.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    routing_parser = subparsers.add_parser("routing", help="Compare the routing engine with the original Dijkstra implementation.")
+    routing_parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    routing_parser.add_argument("--queries", type=int, default=20)
+    routing_parser.add_argument("--legacy-limit", type=int, default=20000, help="Largest graph the O(V^2) implementation is run on.")
+
+    stations_parser = subparsers.add_parser("stations", help="Compare nearest charging station searches for a growing number of stations.")
+    stations_parser.add_argument("--size", type=int, default=10000)
+    stations_parser.add_argument("--stations", type=int, nargs="+", default=[10, 100, 1000])
+    stations_parser.add_argument("--queries", type=int, default=20)
+
+    cache_parser = subparsers.add_parser("cache", help="Measure the route cache on repeated origins.")
+    cache_parser.add_argument("--size", type=int, default=100000)
+    cache_parser.add_argument("--origins", type=int, default=10)
+    cache_parser.add_argument("--queries", type=int, default=200)
+    cache_parser.add_argument("--cache-size", type=int, default=128)
+
+    astar_parser = subparsers.add_parser("astar", help="Compare A* with Dijkstra's algorithm on grid and road-like networks.")
+    astar_parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    astar_parser.add_argument("--queries", type=int, default=20)
+
+    hierarchy_parser = subparsers.add_parser("ch", help="Measure contraction hierarchy build time, memory and query time.")
+    hierarchy_parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000])
+    hierarchy_parser.add_argument("--queries", type=int, default=100)
+
+    matrix_parser = subparsers.add_parser("matrix", help="Time distance matrices with a growing number of worker processes.")
+    matrix_parser.add_argument("--size", type=int, default=100000)
+    matrix_parser.add_argument("--origins", type=int, default=200)
+    matrix_parser.add_argument("--destinations", type=int, default=200)
+    matrix_parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+
+    fleet_parser = subparsers.add_parser("fleet", help="Compare scalar and batch battery approval for a fleet.")
+    fleet_parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+
+    parts_parser = subparsers.add_parser("parts", help="Compare per-car maintenance forecasts with one forecast for the fleet.")
+    parts_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+
+    graph_parser = subparsers.add_parser("graph", help="Compare the memory used by the graph dictionary and the CompiledGraph.")
+    graph_parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+
+    loader_parser = subparsers.add_parser("loader", help="Compare loading a map from CSV with loading a binary snapshot.")
+    loader_parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+
+    imports_parser = subparsers.add_parser("imports", help="Measure the import time of the modules with python -X importtime.")
+    imports_parser.add_argument("--modules", nargs="+", default=["routingengine", "routeplanner", "maintenancemonitor", "userinterface"])
+    imports_parser.add_argument("--repeat", type=int, default=5)
+
+    service_parser = subparsers.add_parser("service", help="Load test the asyncio routing service with different batch sizes.")
+    service_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16, 64])
+    service_parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    service_parser.add_argument("--connections", type=int, default=50)
+    service_parser.add_argument("--requests", type=int, default=5000)
+    service_parser.add_argument("--window", type=int, default=4)
+
+    simulator_parser = subparsers.add_parser("simulator", help="Measure simulated trips per second of the fleet simulator.")
+    simulator_parser.add_argument("--cars", type=int, nargs="+", default=[1000, 10000])
+    simulator_parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    simulator_parser.add_argument("--size", type=int, default=10000)
+    simulator_parser.add_argument("--days", type=int, default=5)
+    simulator_parser.add_argument("--hotspots", type=int, default=100)
+
+    alternatives_parser = subparsers.add_parser("alternatives", help="Time k shortest alternative routes for k = 1 to 10.")
+    alternatives_parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    alternatives_parser.add_argument("--queries", type=int, default=10)
+    alternatives_parser.add_argument("--max-k", type=int, default=10)
+    alternatives_parser.add_argument("--plain-limit", type=int, default=10000, help="Largest graph the plain version is run on.")
+
+    reachable_parser = subparsers.add_parser("reachable", help="Compare reachability with one search against a route per destination.")
+    reachable_parser.add_argument("--size", type=int, default=20000)
+    reachable_parser.add_argument("--destinations", type=int, default=200)
+    reachable_parser.add_argument("--vehicles", type=int, default=1000)
+
+    instrumentation_parser = subparsers.add_parser("instrumentation", help="Measure the cost of the instrumentation and profilers.")
+    instrumentation_parser.add_argument("--size", type=int, default=20000)
+    instrumentation_parser.add_argument("--queries", type=int, default=50)
+
+    scheduler_parser = subparsers.add_parser("scheduler", help="Compare the maintenance scheduler with an on-demand fleet forecast.")
+    scheduler_parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    scheduler_parser.add_argument("--trips", type=int, default=10000)
+    scheduler_parser.add_argument("--on-demand-limit", type=int, default=100000, help="Largest fleet the on-demand forecast is run on.")
+    scheduler_parser.add_argument("--map-size", type=int, default=10000)
+    scheduler_parser.add_argument("--service-locations", type=int, default=20)
+
+    shards_parser = subparsers.add_parser("shards", help="Compare routing on a sharded map with a single process.")
+    shards_parser.add_argument("--size", type=int, default=50000)
+    shards_parser.add_argument("--shards", type=int, nargs="+", default=[2, 4, 8])
+    shards_parser.add_argument("--queries", type=int, default=200)
+
+    traffic_parser = subparsers.add_parser("traffic", help="Compare repairing and rebuilding after live road updates.")
+    traffic_parser.add_argument("--size", type=int, default=20000)
+    traffic_parser.add_argument("--origins", type=int, default=20)
+    traffic_parser.add_argument("--updates", type=int, default=200)
+    traffic_parser.add_argument("--queries-per-update", type=int, default=5)
+
+    args = parser.parse_args()
+    if args.benchmark == "routing":
+        benchmark_routing(args.sizes, args.queries, args.legacy_limit)
+    elif args.benchmark == "stations":
+        benchmark_stations(args.size, args.stations, args.queries)
+    elif args.benchmark == "cache":
+        benchmark_cache(args.size, args.origins, args.queries, args.cache_size)
+    elif args.benchmark == "astar":
+        benchmark_astar(args.sizes, args.queries)
+    elif args.benchmark == "ch":
+        benchmark_hierarchy(args.sizes, args.queries)
+    elif args.benchmark == "matrix":
+        benchmark_matrix(args.size, args.origins, args.destinations, args.processes)
+    elif args.benchmark == "fleet":
+        benchmark_fleet(args.sizes)
+    elif args.benchmark == "parts":
+        benchmark_parts(args.sizes)
+    elif args.benchmark == "graph":
+        benchmark_graph(args.sizes)
+    elif args.benchmark == "loader":
+        benchmark_loader(args.sizes)
+    elif args.benchmark == "imports":
+        benchmark_imports(args.modules, args.repeat)
+    elif args.benchmark == "service":
+        benchmark_service(args.batch_sizes, args.processes, args.connections, args.requests, args.window)
+    elif args.benchmark == "traffic":
+        benchmark_traffic(args.size, args.origins, args.updates, args.queries_per_update)
+    elif args.benchmark == "alternatives":
+        benchmark_alternatives(args.sizes, args.queries, args.max_k, args.plain_limit)
+    elif args.benchmark == "reachable":
+        benchmark_reachable(args.size, args.destinations, args.vehicles)
+    elif args.benchmark == "instrumentation":
+        benchmark_instrumentation(args.size, args.queries)
+    elif args.benchmark == "scheduler":
+        benchmark_scheduler(args.sizes, args.trips, args.on_demand_limit, args.map_size, args.service_locations)
+    elif args.benchmark == "shards":
+        benchmark_shards(args.size, args.shards, args.queries)
+    elif args.benchmark == "simulator":
+        benchmark_simulator(args.cars, args.processes, args.size, args.days, args.hotspots)
@@ -0,0 +1,210 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmark import generate_graph, generate_queries, generate_stations
+from compiledgraph import CompiledGraph
+from energymonitor import Battery, EnergyMonitor
+from maintenancemonitor import MaintenanceMonitor
+from routeplanner import RoutePlanner
+from triplog import TripLog
+
+# This file times the methods the user interface calls most often (calculate_route, suggest_charging, route_approval,
+# calc_maintenance and get_total_km) on generated maps and trip histories, and writes the results to a JSON file.
+# Two result files, e.g. from before and after a change, can then be compared:
+#   python benchmarksuite.py run --output before.json
+#   python benchmarksuite.py run --output after.json
+#   python benchmarksuite.py compare before.json after.json
+# Unlike benchmark.py, which compares implementations, this suite always measures the code as it is, so every version of the
+# project can be measured in the same way.
+
+SUITE_VERSION = 1
+
+
+# Adds 'count' random trips between the given locations to a TripLog, spread over 'days' days in date order.
+def generate_trip_history(trip_log, locations, count, days=365, seed=6, start_date=datetime.date(2023, 1, 1)):
+    rng = random.Random(seed)
+    for trip in range(count):
+        date = start_date + datetime.timedelta(days=trip * days // max(1, count))
+        trip_log.append(rng.randint(1, 50), rng.choice(locations), rng.choice(locations), date)
+    return trip_log
+
+
+# Returns 'repeat' timings of 'function' in microseconds per operation ('operations' is the number of operations one call
+# performs). Like the timeit module, fast functions are called several times in a row for every timing, so that every timing
+# takes at least 'min_seconds'; otherwise the timer and the noise of the machine would be measured instead.
+# Output printed by the code under test is thrown away, so it does not end up in the timings.
+def measure(function, operations, repeat, min_seconds=0.02):
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        function()
+        loops = max(1, int(min_seconds / max(time.perf_counter() - start, 1e-9)))
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(loops):
+                function()
+            times.append((time.perf_counter() - start) * 1000000 / (operations * loops))
+    return times
+
+
+# Creates the planner and maintenance monitor for one map, and returns a list of (case name, function, operations) to time.
+# Every case resets the battery before each operation, so that every trip is approved and does the same amount of work.
+def build_cases(graph, station_count, trip_count, queries):
+    stations = generate_stations(graph, station_count)
+    query_list = generate_queries(graph, queries)
+    origins = [origin for origin, destination in query_list]
+    rng = random.Random(7)
+    distances = [rng.uniform(1, 300) for _ in range(queries)]
+    compiled_graph = CompiledGraph(graph)
+
+    trip_log = generate_trip_history(TripLog(), list(graph), trip_count)
+    planner = RoutePlanner(compiled_graph, stations=stations, locations={}, trip_log=trip_log)
+    # A second planner without a route cache, so that every route is searched from the start.
+    uncached_planner = RoutePlanner(compiled_graph, stations=stations, locations={}, cache_size=0)
+    monitor = MaintenanceMonitor(planner)
+    for index in range(5):
+        monitor.add_part("Part{}".format(index), 90.0 - index, 100.0, 30.0)
+    energy_monitor = EnergyMonitor()
+    battery = Battery(Battery.total_capacity)
+
+    def calculate_route(planner):
+        for origin, destination in query_list:
+            planner.battery.set_current_level(Battery.total_capacity)
+            planner.calculate_route(graph, origin, destination)
+
+    def suggest_charging():
+        for origin in origins:
+            planner.battery.set_current_level(Battery.total_capacity)
+            planner.suggest_charging(graph, origin)
+
+    def route_approval():
+        for distance in distances:
+            battery.set_current_level(Battery.total_capacity)
+            energy_monitor.route_approval(battery, distance)
+
+    def calc_maintenance():
+        for _ in range(queries):
+            monitor.calc_maintenance()
+
+    def get_total_km():
+        for _ in range(queries):
+            monitor.get_total_km()
+
+    # The totals of the MaintenanceMonitor are read from the whole history once, when it is created.
+    def maintenance_startup():
+        MaintenanceMonitor(planner)
+
+    return [("calculate_route", lambda: calculate_route(uncached_planner), queries),
+            ("calculate_route_cached", lambda: calculate_route(planner), queries),
+            ("suggest_charging", suggest_charging, queries),
+            ("route_approval", route_approval, queries),
+            ("calc_maintenance", calc_maintenance, queries),
+            ("get_total_km", get_total_km, queries),
+            ("maintenance_startup", maintenance_startup, 1)]
+
+
+# Returns the commit the suite was run on, or None outside of a git repository.
+def git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Runs every case on every combination of map size and density (extra roads per location), and returns the results
+# as a dictionary that can be written to JSON. Every result has a 'name' that is the same across runs with the same settings.
+def run_suite(sizes, densities, stations, trips, queries, repeat):
+    results = []
+    for size in sizes:
+        for density in densities:
+            graph = generate_graph(size, density)
+            for case, function, operations in build_cases(graph, stations, trips, queries):
+                times = measure(function, operations, repeat)
+                result = {"name": "{}[nodes={},density={}]".format(case, size, density), "case": case, "nodes": size,
+                          "density": density, "stations": stations, "trips": trips, "operations": operations,
+                          "best_us": min(times), "median_us": statistics.median(times), "mean_us": statistics.mean(times),
+                          "stdev_us": statistics.stdev(times) if len(times) > 1 else 0.0}
+                results.append(result)
+                print("{:<45} {:>12.2f} us".format(result["name"], result["best_us"]))
+    return {"suite_version": SUITE_VERSION, "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+            "settings": {"sizes": sizes, "densities": densities, "stations": stations, "trips": trips, "queries": queries,
+                         "repeat": repeat},
+            "results": results}
+
+
+# Compares two result files by their best time ('statistic' can also be "median_us" or "mean_us"; the best time is the least
+# affected by other programs running at the same time). A case is a regression when it got slower by more than 'threshold'
+# (0.1 = 10%). Returns the list of regressions; cases that only appear in one of the files are listed but not compared.
+# Results are only comparable when they were measured on the same machine with the same settings.
+def compare_results(old, new, threshold=0.1, statistic="best_us"):
+    old_results = {result["name"]: result for result in old["results"]}
+    new_results = {result["name"]: result for result in new["results"]}
+    regressions = []
+    print("{:<45} {:>12} {:>12} {:>8}".format("case", "old (us)", "new (us)", "change"))
+    for name, result in new_results.items():
+        if name not in old_results:
+            print("{:<45} {:>12} {:>12.2f} {:>8}".format(name, "-", result[statistic], "new"))
+            continue
+        old_time, new_time = old_results[name][statistic], result[statistic]
+        change = new_time / old_time - 1 if old_time else 0.0
+        label = ""
+        if change > threshold:
+            label = "slower"
+            regressions.append(name)
+        elif change < -threshold:
+            label = "faster"
+        print("{:<45} {:>12.2f} {:>12.2f} {:>+7.1f}% {}".format(name, old_time, new_time, change * 100, label))
+    for name in old_results:
+        if name not in new_results:
+            print("{:<45} {:>12.2f} {:>12} {:>8}".format(name, old_results[name][statistic], "-", "removed"))
+    return regressions
+
+
+def load_results(path):
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark suite for the route planner, energy monitor and maintenance monitor.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Time every case and write the results to a JSON file.")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    run_parser.add_argument("--densities", type=float, nargs="+", default=[0.1, 0.5], help="Extra roads per location.")
+    run_parser.add_argument("--stations", type=int, default=50)
+    run_parser.add_argument("--trips", type=int, default=100000, help="Number of trips in the generated history.")
+    run_parser.add_argument("--queries", type=int, default=50)
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--output", default="benchmark_results.json")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two result files and report regressions.")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="Allowed slowdown before a case counts as a regression.")
+    compare_parser.add_argument("--statistic", choices=["best_us", "median_us", "mean_us"], default="best_us")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        report = run_suite(args.sizes, args.densities, args.stations, args.trips, args.queries, args.repeat)
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        print("Results written to {}.".format(args.output))
+    else:
+        regressions = compare_results(load_results(args.old), load_results(args.new), args.threshold, args.statistic)
+        if regressions:
+            print("{} case(s) got slower by more than {:.0f}%.".format(len(regressions), args.threshold * 100))
+            sys.exit(1)
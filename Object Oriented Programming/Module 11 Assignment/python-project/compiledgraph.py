@@ -0,0 +1,203 @@
+import math
+from array import array
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+# Great-circle (haversine) distance in kilometres between two points given in radians.
+def great_circle_distance(lat_a, long_a, lat_b, long_b):
+    h = math.sin((lat_b - lat_a) / 2) ** 2 + math.cos(lat_a) * math.cos(lat_b) * math.sin((long_b - long_a) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+# True for a distance with a fraction, e.g. 12.5; whole numbers (also 13.0) and closed roads (infinity) are not.
+def is_fractional(distance):
+    return distance != math.inf and distance != int(distance)
+
+
+# The CompiledGraph class is a compact version of the 'graph' dictionary from data.py. It is built once, and the RoutePlanner
+# searches it directly, without copying anything per query.
+# Every location is given a number (id) and all roads are stored in three contiguous arrays (compressed sparse row format):
+# the roads leaving location 'n' are found at positions offsets[n] to offsets[n + 1] of the 'targets' and 'weights' arrays.
+class CompiledGraph:
+
+    def __init__(self, roads):
+        self.names = []
+        self.ids = {}
+        for name in roads:
+            self.add_name(name)
+            for neighbour in roads[name]:
+                self.add_name(neighbour)
+
+        # Distances are stored as whole numbers when possible, so that results look the same as with the dictionary.
+        all_integers = all(isinstance(distance, int) for neighbours in roads.values() for distance in neighbours.values())
+        # A closed road (infinite distance) needs an array of floats, but the distances of such a map are still whole numbers,
+        # so 'whole_numbers' remembers how the map was loaded, and 'fractional_roads' counts the roads that have since been given a
+        # distance with a fraction (see "set_weight()"). While there are none, results are shown as integers (see "present_distance()").
+        self.whole_numbers = all_integers
+        self.fractional_roads = 0
+        self.offsets = array("q", [0])
+        self.targets = array("q")
+        self.weights = array("q" if all_integers else "d")
+        for name in self.names:
+            for neighbour, distance in roads.get(name, {}).items():
+                self.targets.append(self.ids[neighbour])
+                self.weights.append(distance)
+            self.offsets.append(len(self.targets))
+        self.build_reverse()
+        # The version is increased every time a distance changes, so that anything derived from the graph knows it is out of date.
+        self.version = 0
+        self.latitudes = None
+        self.longitudes = None
+        self.heuristic_scale = 0.0
+
+    # Builds a graph from arrays that already exist, e.g. the memory-mapped arrays of a snapshot (see graphloader.py).
+    # 'parts' are the offsets, targets, weights, reverse_offsets, reverse_sources and reverse_edges, optionally followed by the
+    # latitudes and longitudes. 'names' holds the location names separated by newlines; they are only decoded when first needed.
+    @classmethod
+    def from_arrays(cls, parts, heuristic_scale, names):
+        compiled_graph = cls.__new__(cls)
+        (compiled_graph.offsets, compiled_graph.targets, compiled_graph.weights, compiled_graph.reverse_offsets,
+         compiled_graph.reverse_sources, compiled_graph.reverse_edges) = parts[:6]
+        compiled_graph.latitudes, compiled_graph.longitudes = parts[6:8] if len(parts) == 8 else (None, None)
+        compiled_graph.heuristic_scale = heuristic_scale
+        compiled_graph.whole_numbers = compiled_graph.weight_typecode() == "q"
+        compiled_graph.fractional_roads = 0
+        compiled_graph.version = 0
+        compiled_graph.packed_names = names
+        return compiled_graph
+
+    # Only called for attributes that are missing, i.e. the names and ids of a graph loaded from a snapshot before first use.
+    def __getattr__(self, attribute):
+        packed_names = self.__dict__.get("packed_names")
+        if attribute not in ("names", "ids") or packed_names is None:
+            raise AttributeError(attribute)
+        self.names = bytes(packed_names).decode("utf-8").split("\n") if len(packed_names) else []
+        self.ids = {name: node for node, name in enumerate(self.names)}
+        self.packed_names = None
+        return getattr(self, attribute)
+
+    # Arrays of a snapshot are memoryviews of the file, which cannot be sent to other processes, so they are copied into arrays.
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for attribute, value in state.items():
+            if isinstance(value, memoryview):
+                state[attribute] = array(value.format, value.tobytes())
+        return state
+
+    # Weights are either an array or a memoryview, which name their type differently.
+    def weight_typecode(self):
+        return getattr(self.weights, "typecode", None) or self.weights.format
+
+    # The reverse arrays list the roads arriving at every location. 'reverse_edges' points at the position of each road
+    # in the forward arrays, so that a changed distance only needs to be stored once.
+    def build_reverse(self):
+        counts = [0] * (len(self.names) + 1)
+        for target in self.targets:
+            counts[target + 1] += 1
+        for node in range(len(self.names)):
+            counts[node + 1] += counts[node]
+        self.reverse_offsets = array("q", counts)
+        self.reverse_sources = array("q", bytes(8 * len(self.targets)))
+        self.reverse_edges = array("q", bytes(8 * len(self.targets)))
+        position = counts[:-1]
+        for node in range(len(self.names)):
+            for edge in range(self.offsets[node], self.offsets[node + 1]):
+                target = self.targets[edge]
+                self.reverse_sources[position[target]] = node
+                self.reverse_edges[position[target]] = edge
+                position[target] += 1
+
+    # Attaches Location objects to the locations of the graph. Coordinates are stored in radians, ready for the A* search.
+    # Road distances in the map are not always longer than the straight line between two places, so the straight-line distance is
+    # multiplied by 'heuristic_scale', the smallest ratio between a road and its straight line. This keeps the A* estimate from
+    # ever being larger than the real remaining distance. A* can only be used when every location has coordinates.
+    # When a location is missing, nothing is changed (e.g. the coordinates of a snapshot are kept) and False is returned.
+    def set_coordinates(self, locations):
+        if any(name not in locations for name in self.names):
+            return False
+        self.latitudes = array("d", (math.radians(locations[name].lat_coord) for name in self.names))
+        self.longitudes = array("d", (math.radians(locations[name].long_coord) for name in self.names))
+        self.heuristic_scale = 1.0
+        for node in range(len(self.names)):
+            for edge in range(self.offsets[node], self.offsets[node + 1]):
+                self.lower_heuristic_scale(node, self.targets[edge], self.weights[edge])
+        return True
+
+    def has_coordinates(self):
+        return self.latitudes is not None
+
+    # True when every road has a whole-number distance (closed roads do not count), so every route distance is one as well.
+    def whole_distances(self):
+        return self.whole_numbers and self.fractional_roads == 0
+
+    # Returns a distance found on this map as an integer if the map has whole-number distances, like the original dictionary would.
+    def present_distance(self, distance):
+        if distance != math.inf and self.whole_distances():
+            return int(distance)
+        return distance
+
+    def straight_distance(self, source, target):
+        return great_circle_distance(self.latitudes[source], self.longitudes[source], self.latitudes[target], self.longitudes[target])
+
+    def lower_heuristic_scale(self, source, target, distance):
+        straight = self.straight_distance(source, target)
+        if straight > 0 and distance < self.heuristic_scale * straight:
+            self.heuristic_scale = distance / straight
+
+    def add_name(self, name):
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def node_id(self, name):
+        return self.ids[name]
+
+    def node_name(self, node_id):
+        return self.names[node_id]
+
+    # Returns (neighbour id, distance) pairs for all roads leaving the given location.
+    def neighbours(self, node_id):
+        start, end = self.offsets[node_id], self.offsets[node_id + 1]
+        return zip(self.targets[start:end], self.weights[start:end])
+
+    # Returns (neighbour id, distance) pairs for all roads arriving at the given location.
+    def incoming(self, node_id):
+        start, end = self.reverse_offsets[node_id], self.reverse_offsets[node_id + 1]
+        return [(self.reverse_sources[index], self.weights[self.reverse_edges[index]]) for index in range(start, end)]
+
+    def edge_count(self):
+        return len(self.targets)
+
+    # Returns the position of the road between two location ids in the 'targets' and 'weights' arrays.
+    def edge_index(self, source, target):
+        for edge in range(self.offsets[source], self.offsets[source + 1]):
+            if self.targets[edge] == target:
+                return edge
+        raise KeyError("There is no road from {} to {}.".format(self.names[source], self.names[target]))
+
+    def get_weight(self, origin, destination):
+        return self.weights[self.edge_index(self.ids[origin], self.ids[destination])]
+
+    # Changes the distance of an existing road and returns the old distance. New roads cannot be added to a compiled graph.
+    def set_weight(self, origin, destination, distance):
+        edge = self.edge_index(self.ids[origin], self.ids[destination])
+        old_distance = self.weights[edge]
+        if self.weight_typecode() == "q" and not isinstance(distance, int):
+            self.weights = array("d", self.weights)
+        self.weights[edge] = distance
+        if self.whole_numbers:
+            self.fractional_roads += is_fractional(distance) - is_fractional(old_distance)
+        if self.has_coordinates():
+            self.lower_heuristic_scale(self.ids[origin], self.targets[edge], distance)
+        self.version += 1
+        return old_distance
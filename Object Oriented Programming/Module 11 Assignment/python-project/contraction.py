@@ -0,0 +1,269 @@
+import heapq
+import struct
+from array import array
+
+# The ContractionHierarchy class is an optional preprocessing step for very large road networks.
+# While it is built, the locations are removed ("contracted") one by one, starting with the least important ones. Whenever removing
+# a location would make a shortest route longer, a shortcut road is added between its neighbours. Every location ends up with a rank,
+# and a route can then be found by searching only "upwards" (towards higher ranks) from both the origin and the destination,
+# which visits a tiny part of the graph. Shortcuts remember the location they skip, so the full route can be rebuilt ("unpacked").
+# Building is slow and is meant to be done offline; the result can be saved to disk and loaded again by the RoutePlanner.
+class ContractionHierarchy:
+    infinity = float("inf")
+    file_header = b"CHV1"
+
+    def __init__(self, compiled_graph, rank, forward, backward):
+        self.graph = compiled_graph
+        # A hierarchy is only valid for the distances it was built with, see "is_current()".
+        self.version = compiled_graph.version
+        self.rank = rank
+        # 'forward' holds the upward roads leaving every location, 'backward' the upward roads arriving at every location.
+        # Both are (offsets, targets, weights, middles) arrays, where 'middles' is the skipped location of a shortcut, or -1.
+        self.forward = forward
+        self.backward = backward
+        self.last_settled = 0
+
+    # Builds the hierarchy. 'witness_limit' is the number of locations a witness search may visit when checking whether
+    # a shortcut is needed; higher values give fewer shortcuts but a slower build.
+    @classmethod
+    def build(cls, compiled_graph, witness_limit=100):
+        size = len(compiled_graph)
+        out_roads = [{} for _ in range(size)]
+        in_roads = [{} for _ in range(size)]
+        for source in range(size):
+            for target, distance in compiled_graph.neighbours(source):
+                if target != source and distance < out_roads[source].get(target, (cls.infinity, -1))[0]:
+                    out_roads[source][target] = (distance, -1)
+                    in_roads[target][source] = (distance, -1)
+
+        contractor = _Contractor(out_roads, in_roads, witness_limit)
+        deleted_neighbours = [0] * size
+        rank = array("q", [0]) * size
+        upward_out = [None] * size
+        upward_in = [None] * size
+
+        queue = [(contractor.edge_difference(node), node) for node in range(size)]
+        heapq.heapify(queue)
+        order = 0
+        while queue:
+            priority, node = heapq.heappop(queue)
+            # Priorities change as neighbours are contracted, so they are only recomputed when a location reaches the front.
+            shortcuts = contractor.find_shortcuts(node)
+            new_priority = len(shortcuts) - len(in_roads[node]) - len(out_roads[node]) + deleted_neighbours[node]
+            if queue and new_priority > queue[0][0]:
+                heapq.heappush(queue, (new_priority, node))
+                continue
+
+            upward_out[node] = list(out_roads[node].items())
+            upward_in[node] = list(in_roads[node].items())
+            for source in in_roads[node]:
+                del out_roads[source][node]
+                deleted_neighbours[source] += 1
+            for target in out_roads[node]:
+                del in_roads[target][node]
+                deleted_neighbours[target] += 1
+            for source, target, distance in shortcuts:
+                if distance < out_roads[source].get(target, (cls.infinity, -1))[0]:
+                    out_roads[source][target] = (distance, node)
+                    in_roads[target][source] = (distance, node)
+            out_roads[node] = {}
+            in_roads[node] = {}
+            rank[node] = order
+            order += 1
+
+        typecode = compiled_graph.weight_typecode()
+        return cls(compiled_graph, rank, cls.to_arrays(upward_out, typecode), cls.to_arrays(upward_in, typecode))
+
+    @staticmethod
+    def to_arrays(roads, typecode):
+        offsets, targets, weights, middles = array("q", [0]), array("q"), array(typecode), array("q")
+        for node_roads in roads:
+            for target, (distance, middle) in node_roads:
+                targets.append(target)
+                weights.append(distance)
+                middles.append(middle)
+            offsets.append(len(targets))
+        return offsets, targets, weights, middles
+
+    # The hierarchy is out of date as soon as a distance in the compiled graph has changed.
+    def is_current(self):
+        return self.version == self.graph.version
+
+    def shortcut_count(self):
+        return sum(1 for middle in self.forward[3] if middle != -1) + sum(1 for middle in self.backward[3] if middle != -1)
+
+    def memory_bytes(self):
+        return sum(part.itemsize * len(part) for part in (self.rank,) + self.forward + self.backward)
+
+    # Same result as RoutingEngine.shortest_path: the distance and the full route, or infinity and None.
+    def shortest_path(self, origin, destination):
+        source = self.graph.ids.get(origin)
+        target = self.graph.ids.get(destination)
+        if source is None or target is None:
+            return self.infinity, None
+        distance, nodes = self.query(source, target)
+        if nodes is None:
+            return distance, None
+        return distance, [self.graph.names[node] for node in nodes]
+
+    # Bidirectional upward search. Returns the distance and the list of location ids of the route.
+    def query(self, source, target):
+        searches = [_UpwardSearch(self.forward, source), _UpwardSearch(self.backward, target)]
+        best = self.infinity
+        meeting = None
+        while True:
+            active = [search for search in searches if search.queue and search.queue[0][0] < best]
+            if not active:
+                break
+            for side, search in enumerate(searches):
+                if search not in active:
+                    continue
+                node = search.step()
+                if node is None:
+                    continue
+                other = searches[1 - side]
+                if node in other.distances and search.distances[node] + other.distances[node] < best:
+                    best = search.distances[node] + other.distances[node]
+                    meeting = node
+        self.last_settled = len(searches[0].settled) + len(searches[1].settled)
+        if meeting is None:
+            return self.infinity, None
+
+        nodes = []
+        node = meeting
+        while node != source:
+            previous, middle = searches[0].parents[node]
+            nodes.append((previous, node, middle))
+            node = previous
+        nodes.reverse()
+        node = meeting
+        while node != target:
+            following, middle = searches[1].parents[node]
+            nodes.append((node, following, middle))
+            node = following
+
+        route = [source]
+        for start, end, middle in nodes:
+            route.extend(self.unpack(start, end, middle))
+        return best, route
+
+    # Replaces a (shortcut) road by the original roads it stands for. Returns the locations after 'start', up to and including 'end'.
+    def unpack(self, start, end, middle):
+        route = []
+        stack = [(start, end, middle)]
+        while stack:
+            start, end, middle = stack.pop()
+            if middle == -1:
+                route.append(end)
+            else:
+                stack.append((middle, end, self.find_middle(middle, end)))
+                stack.append((start, middle, self.find_middle(start, middle)))
+        return route
+
+    # Every road between two locations is stored at the location with the lower rank, in 'forward' or 'backward' depending on its direction.
+    def find_middle(self, start, end):
+        if self.rank[start] < self.rank[end]:
+            offsets, targets, weights, middles = self.forward
+            node, other = start, end
+        else:
+            offsets, targets, weights, middles = self.backward
+            node, other = end, start
+        for index in range(offsets[node], offsets[node + 1]):
+            if targets[index] == other:
+                return middles[index]
+        raise KeyError("The hierarchy has no road from {} to {}.".format(start, end))
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(self.file_header)
+            for part in (self.rank,) + self.forward + self.backward:
+                file.write(struct.pack("<cq", part.typecode.encode(), len(part)))
+                part.tofile(file)
+
+    # Loads a hierarchy saved with "save()". It must have been built from the same graph.
+    @classmethod
+    def load(cls, path, compiled_graph):
+        with open(path, "rb") as file:
+            if file.read(4) != cls.file_header:
+                raise ValueError("{} is not a contraction hierarchy file.".format(path))
+            parts = []
+            for _ in range(9):
+                typecode, length = struct.unpack("<cq", file.read(9))
+                part = array(typecode.decode())
+                part.fromfile(file, length)
+                parts.append(part)
+        if len(parts[0]) != len(compiled_graph):
+            raise ValueError("The hierarchy in {} was built for a different graph.".format(path))
+        return cls(compiled_graph, parts[0], tuple(parts[1:5]), tuple(parts[5:9]))
+
+
+# Removes locations from the working graph of a ContractionHierarchy build and decides which shortcuts are needed.
+class _Contractor:
+    infinity = float("inf")
+
+    def __init__(self, out_roads, in_roads, witness_limit):
+        self.out_roads = out_roads
+        self.in_roads = in_roads
+        self.witness_limit = witness_limit
+
+    def edge_difference(self, node):
+        return len(self.find_shortcuts(node)) - len(self.in_roads[node]) - len(self.out_roads[node])
+
+    # A shortcut from 'source' to 'target' is needed unless a witness route that avoids 'node' is at most as long.
+    def find_shortcuts(self, node):
+        out_roads = self.out_roads[node]
+        if not out_roads:
+            return []
+        longest_out = max(distance for distance, middle in out_roads.values())
+        shortcuts = []
+        for source, (in_distance, _) in self.in_roads[node].items():
+            witness = self.witness_search(source, node, in_distance + longest_out)
+            for target, (out_distance, _) in out_roads.items():
+                if target != source and witness.get(target, self.infinity) > in_distance + out_distance:
+                    shortcuts.append((source, target, in_distance + out_distance))
+        return shortcuts
+
+    def witness_search(self, source, avoid, max_distance):
+        distances = {source: 0}
+        queue = [(0, source)]
+        settled = 0
+        while queue and settled < self.witness_limit:
+            distance, node = heapq.heappop(queue)
+            if distance > distances[node]:
+                continue
+            if distance > max_distance:
+                break
+            settled += 1
+            for target, (road, _) in self.out_roads[node].items():
+                new_distance = distance + road
+                if target != avoid and new_distance < distances.get(target, self.infinity):
+                    distances[target] = new_distance
+                    heapq.heappush(queue, (new_distance, target))
+        return distances
+
+
+# One direction of the bidirectional ContractionHierarchy query.
+class _UpwardSearch:
+    infinity = float("inf")
+
+    def __init__(self, roads, source):
+        self.offsets, self.targets, self.weights, self.middles = roads
+        self.distances = {source: 0}
+        self.parents = {}
+        self.settled = set()
+        self.queue = [(0, source)]
+
+    # Visits the next location and returns it, or returns None if the queue only held an outdated entry.
+    def step(self):
+        distance, node = heapq.heappop(self.queue)
+        if node in self.settled:
+            return None
+        self.settled.add(node)
+        for index in range(self.offsets[node], self.offsets[node + 1]):
+            target = self.targets[index]
+            new_distance = distance + self.weights[index]
+            if new_distance < self.distances.get(target, self.infinity):
+                self.distances[target] = new_distance
+                self.parents[target] = (node, self.middles[index])
+                heapq.heappush(self.queue, (new_distance, target))
+        return node
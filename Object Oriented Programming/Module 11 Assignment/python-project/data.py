@@ -1,52 +1,27 @@
-# This file includes all navigational data used by the path finding algorithm deployed in the routeplanner.py file.
-
-# Charging Stations
-charging_stations = ["The Pearl", "Doha Festival City", "Mall of Qatar", "Aspire"]
-
-
-# Locations and how they are connected to each other, i.e. the distances between them:
-graph = {}
-
-graph["The Pearl"] = {}
-graph["The Pearl"]["Landmark Mall"] = 13
-graph["The Pearl"]["Doha Festival City"] = 17
-graph["The Pearl"]["City Center"] = 9
-
-graph["Landmark Mall"] = {}
-graph["Landmark Mall"]["The Pearl"] = 13
-graph["Landmark Mall"]["Doha Festival City"] = 8
-graph["Landmark Mall"]["Souq Waqif"] = 11
-graph["Landmark Mall"]["City Center"] = 10
-graph["Landmark Mall"]["Aspire"] = 13
+import os
 
-graph["Doha Festival City"] = {}
-graph["Doha Festival City"]["The Pearl"] = 17
-graph["Doha Festival City"]["Landmark Mall"] = 8
-graph["Doha Festival City"]["Mall of Qatar"] = 20
+from graphloader import load_coordinates, load_edge_csv, load_names
 
-graph["Mall of Qatar"] = {}
-graph["Mall of Qatar"]["Doha Festival City"] = 20
-graph["Mall of Qatar"]["Aspire"] = 19
-
-graph["Corniche"] = {}
-graph["Corniche"]["Souq Waqif"] = 5
-graph["Corniche"]["Doha Exhibition Center"] = 3
-
-graph["Souq Waqif"] = {}
-graph["Souq Waqif"]["Landmark Mall"] = 11
-graph["Souq Waqif"]["Corniche"] = 5
-graph["Souq Waqif"]["Aspire"] = 11
-
-graph["City Center"] = {}
-graph["City Center"]["The Pearl"] = 9
-graph["City Center"]["Landmark Mall"] = 10
-graph["City Center"]["Doha Exhibition Center"] = 1
-
-graph["Doha Exhibition Center"] = {}
-graph["Doha Exhibition Center"]["Corniche"] = 3
-graph["Doha Exhibition Center"]["City Center"] = 1
-
-graph["Aspire"] = {}
-graph["Aspire"]["Landmark Mall"] = 13
-graph["Aspire"]["Mall of Qatar"] = 19
-graph["Aspire"]["Souq Waqif"] = 11
+# This file includes all navigational data used by the path finding algorithm deployed in the routeplanner.py file.
+# The data itself is kept in the CSV files of the 'maps' folder and read with the loaders of graphloader.py, so a bigger map
+# only needs new files, not new code. For very large maps, see the binary snapshots in graphloader.py.
+# Each file is only read the first time its data is used (e.g. "from data import graph"), so importing this module is free.
+MAPS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "maps")
+
+LOADERS = {
+    # Charging Stations
+    "charging_stations": lambda: load_names(os.path.join(MAPS_FOLDER, "charging_stations.csv")),
+    # Coordinates (latitude, longitude) of every location. The RoutePlanner turns these into Location objects,
+    # which are used by the A* search to estimate the remaining distance to the destination.
+    "coordinates": lambda: load_coordinates(os.path.join(MAPS_FOLDER, "locations.csv")),
+    # Locations and how they are connected to each other, i.e. the distances between them, e.g. graph["The Pearl"]["Landmark Mall"] = 13
+    "graph": lambda: load_edge_csv(os.path.join(MAPS_FOLDER, "roads.csv")),
+}
+
+
+# Only called for names that are not defined yet. The loaded data is stored in the module, so every file is read once.
+def __getattr__(name):
+    if name not in LOADERS:
+        raise AttributeError("module 'data' has no attribute '{}'".format(name))
+    globals()[name] = LOADERS[name]()
+    return globals()[name]
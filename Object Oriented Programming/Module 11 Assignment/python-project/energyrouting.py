@@ -0,0 +1,79 @@
+import heapq
+import math
+
+# The EnergyRouter class finds the shortest route that the car can actually drive, including any charging stops, in one search.
+# Instead of only locations, the search moves between (location, battery level) states. Battery levels are rounded into buckets
+# of 'bucket_size' kWh: the starting level is rounded down and the energy used on every road is rounded up, so a route found here
+# is always approved by the EnergyMonitor. At a charging station the car can charge to full capacity, which counts as one stop.
+# A state is skipped when the same location has already been reached with a shorter distance and at least as much battery left.
+class EnergyRouter:
+    infinity = float("inf")
+
+    def __init__(self, compiled_graph, stations, usage_per_kilometer, min_battery, capacity, bucket_size=0.1, charging_penalty=0):
+        self.graph = compiled_graph
+        # 'stations' is a set of location ids, which is shared with the planner's NearestStationTable and so stays up to date.
+        self.stations = stations
+        self.usage_per_kilometer = usage_per_kilometer
+        self.bucket_size = bucket_size
+        self.min_bucket = math.ceil(min_battery / bucket_size - 1e-9)
+        self.full_bucket = math.floor(capacity / bucket_size + 1e-9)
+        # Extra distance (km) added for every charging stop, so that routes with fewer stops are preferred.
+        self.charging_penalty = charging_penalty
+
+    def energy_buckets(self, distance):
+        return math.ceil(distance * self.usage_per_kilometer / self.bucket_size - 1e-9)
+
+    # Returns the distance, the route and the list of charging stations to stop at, or infinity, None and [] if the
+    # destination cannot be reached even with charging.
+    def plan(self, origin, destination, battery_level):
+        graph = self.graph
+        source = graph.ids.get(origin)
+        target = graph.ids.get(destination)
+        if source is None or target is None:
+            return self.infinity, None, []
+
+        offsets, targets, weights = graph.offsets, graph.targets, graph.weights
+        # Every label is (location, battery bucket, distance, previous label, charged here).
+        labels = [(source, math.floor(battery_level / self.bucket_size + 1e-9), 0, -1, False)]
+        # Queue entries are (cost, charging stops, label index).
+        queue = [(0, 0, 0)]
+        best_level = {}
+
+        while queue:
+            cost, stops, index = heapq.heappop(queue)
+            node, level, distance, previous, charged = labels[index]
+            if best_level.get(node, -1) >= level:
+                continue
+            best_level[node] = level
+            if node == target:
+                route, charging_stops = self.build_route(labels, index)
+                return distance, route, charging_stops
+
+            if node in self.stations and level < self.full_bucket:
+                labels.append((node, self.full_bucket, distance, index, True))
+                heapq.heappush(queue, (cost + self.charging_penalty, stops + 1, len(labels) - 1))
+            for edge in range(offsets[node], offsets[node + 1]):
+                # Closed roads have an infinite distance.
+                if weights[edge] == self.infinity:
+                    continue
+                new_level = level - self.energy_buckets(weights[edge])
+                neighbour = targets[edge]
+                if new_level >= self.min_bucket and best_level.get(neighbour, -1) < new_level:
+                    labels.append((neighbour, new_level, distance + weights[edge], index, False))
+                    heapq.heappush(queue, (cost + weights[edge], stops, len(labels) - 1))
+        return self.infinity, None, []
+
+    def build_route(self, labels, index):
+        names = self.graph.names
+        route = []
+        charging_stops = []
+        while index != -1:
+            node, level, distance, previous, charged = labels[index]
+            if charged:
+                charging_stops.append(names[node])
+            else:
+                route.append(names[node])
+            index = previous
+        route.reverse()
+        charging_stops.reverse()
+        return route, charging_stops
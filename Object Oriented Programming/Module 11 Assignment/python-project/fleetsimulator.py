@@ -0,0 +1,229 @@
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+from array import array
+from collections import Counter
+
+import data
+from app import AppContext
+from compiledgraph import CompiledGraph
+from energymonitor import Battery, EnergyMonitor, FleetBattery
+from graphloader import load_snapshot, save_snapshot
+from maintenancemonitor import PartRegistry
+from neareststation import NearestStationTable
+from routecache import RouteCache
+from triplog import TripLog
+
+# The FleetShard class simulates a group of cars driving around the map, day by day. Every car has its own battery level,
+# location, TripLog and part conditions, stored like the FleetBattery: one array per value, with one entry per car.
+# Every simulated day each car is given 'trips_per_day' random destinations, out of all locations or out of a list of popular
+# 'destinations'. The distances come from the shard's RouteCache, so the search from a popular origin is only run once (on a large
+# map, a short list of destinations keeps the number of origins small as well), and the battery of all cars is checked at once with
+# EnergyMonitor.route_approval_batch. A car that cannot make its trip first drives to its nearest charging station (from the
+# NearestStationTable) and charges to full; a car that cannot even reach the station is towed there ('stranded').
+# Parts wear with every kilometre (each car at its own random rate) and are replaced as soon as they reach their minimum
+# condition, which counts as one visit to a maintenance bay. The parts of all cars are kept in one PartRegistry, so the maintenance
+# forecast of the whole shard is calculated at once (see "forecast()").
+class FleetShard:
+
+    def __init__(self, compiled_graph, stations, car_count, seed=1, destinations=None, parts=AppContext.default_parts,
+                 wear_per_km=(0.005, 0.05), start_date=datetime.date(2023, 1, 1), cache_size=1024, keep_trip_logs=True):
+        self.graph = compiled_graph
+        if destinations is None:
+            self.destinations = range(len(compiled_graph))
+        else:
+            self.destinations = [compiled_graph.node_id(name) for name in destinations]
+        self.rng = random.Random(seed)
+        self.route_cache = RouteCache(compiled_graph, cache_size)
+        self.station_table = NearestStationTable(compiled_graph, stations)
+        self.energy_monitor = EnergyMonitor()
+        self.start_date = start_date
+        self.car_count = car_count
+
+        # Cars start at one of the destinations, e.g. the depots of the fleet.
+        self.locations = array("q", (self.rng.choice(self.destinations) for _ in range(car_count)))
+        self.battery = FleetBattery(car_count)
+        self.trip_logs = [TripLog() for _ in range(car_count)] if keep_trip_logs else None
+        self.km = array("d", [0]) * car_count
+        self.parts = PartRegistry(car_count)
+        for part in parts:
+            self.parts.add_part(*part)
+        # Days on which every car drove, for the maintenance forecast.
+        self.active_days = array("q", [0]) * car_count
+        self.last_day = array("q", [-1]) * car_count
+        self.wear = [array("d", (self.rng.uniform(*wear_per_km) for _ in range(car_count))) for _ in parts]
+
+        self.trips = 0
+        self.rejected = 0
+        self.stranded = 0
+        # Counted per (date, station) and per (date, part), so that the busiest day can be found for capacity planning.
+        self.charging_stops = Counter()
+        self.maintenance_visits = Counter()
+
+    def distance(self, source, target):
+        tree = self.route_cache.get_tree(source)
+        if target in tree.visited:
+            return tree.distances[target]
+        return tree.distances_to([target])[0]
+
+    def run(self, days, trips_per_day=3):
+        for day in range(days):
+            date = self.start_date + datetime.timedelta(days=day)
+            for _ in range(trips_per_day):
+                self.run_round(date)
+
+    # Gives every car one random destination and drives all approved trips.
+    def run_round(self, date):
+        names = self.graph.names
+        cars = []
+        destinations = []
+        distances = []
+        for car in range(self.car_count):
+            destination = self.rng.choice(self.destinations)
+            if destination == self.locations[car]:
+                continue
+            distance = self.distance(self.locations[car], destination)
+            if distance != float("inf"):
+                cars.append(car)
+                destinations.append(destination)
+                distances.append(distance)
+
+        approvals = self.energy_monitor.route_approval_batch(self.battery, distances, cars)
+        date_text = date.strftime(TripLog.date_format)
+        for car, destination, distance, approved in zip(cars, destinations, distances, approvals):
+            if not approved:
+                self.rejected += 1
+                self.charge(car, date_text)
+                continue
+            if self.trip_logs is not None:
+                self.trip_logs[car].append(distance, names[self.locations[car]], names[destination], date)
+            self.locations[car] = destination
+            self.drive(car, distance, date_text)
+            self.trips += 1
+            if self.last_day[car] != date.toordinal():
+                self.last_day[car] = date.toordinal()
+                self.active_days[car] += 1
+
+    # Drives a car to its nearest charging station and charges it to full.
+    def charge(self, car, date_text):
+        entry = self.station_table.lookup(self.graph.names[self.locations[car]])
+        if entry is None:
+            return
+        station, distance, next_hop = entry
+        energy = self.energy_monitor.calculate_energy(distance)
+        if energy >= self.battery.get_current_level(car):
+            self.stranded += 1
+        self.locations[car] = self.graph.node_id(station)
+        self.drive(car, distance, date_text)
+        self.battery.set_current_level(car, Battery.total_capacity)
+        self.charging_stops[(date_text, station)] += 1
+
+    def drive(self, car, distance, date_text):
+        self.km[car] += distance
+        parts = self.parts
+        for part in range(len(parts)):
+            conditions = parts.conditions[part]
+            conditions[car] -= self.wear[part][car] * distance
+            if conditions[car] <= parts.min_conditions[part][car]:
+                conditions[car] = parts.max_conditions[part][car]
+                self.maintenance_visits[(date_text, parts.names[part])] += 1
+
+    # Returns the number of cars that need maintenance within 'days' days, according to the MaintenanceMonitor's forecast.
+    def forecast(self, days=7):
+        forecast = self.parts.forecast(self.active_days)
+        due = bytearray(self.car_count)
+        for part_days in forecast["days"]:
+            due = bytearray([car_due or part_due <= days for car_due, part_due in zip(due, part_days)])
+        return sum(due)
+
+    def summary(self):
+        return {"cars": self.car_count, "trips": self.trips, "km": sum(self.km), "rejected": self.rejected, "stranded": self.stranded,
+                "charging_stops": self.charging_stops, "maintenance_visits": self.maintenance_visits,
+                "maintenance_due_in_week": self.forecast(7)}
+
+
+# Runs one shard inside a worker process. The graph is read from a snapshot file, which every worker maps into memory,
+# so all workers share the same read-only copy of the map.
+def simulate_shard(snapshot_path, stations, destinations, car_count, seed, days, trips_per_day):
+    shard = FleetShard(load_snapshot(snapshot_path), stations, car_count, seed, destinations, keep_trip_logs=False)
+    shard.run(days, trips_per_day)
+    return shard.summary()
+
+
+# The FleetSimulator divides 'car_count' cars into one shard per process and adds up the results.
+# With 1 process the shard is kept in 'shards', so every car's TripLog ('keep_trip_logs'), battery and parts can be inspected
+# afterwards; with more processes only the totals are sent back.
+class FleetSimulator:
+
+    def __init__(self, roads=None, stations=None, car_count=1000, processes=1, seed=1, destinations=None, keep_trip_logs=True):
+        roads = data.graph if roads is None else roads
+        self.compiled_graph = roads if isinstance(roads, CompiledGraph) else CompiledGraph(roads)
+        self.stations = data.charging_stations if stations is None else stations
+        self.car_count = car_count
+        self.processes = processes
+        self.seed = seed
+        self.destinations = destinations
+        self.keep_trip_logs = keep_trip_logs
+        self.shards = []
+
+    # Returns the totals of all shards, the simulated trips per second of real time, and the busiest day for every charging
+    # station and for the maintenance bays.
+    def run(self, days, trips_per_day=3):
+        processes = max(1, min(self.processes, self.car_count))
+        counts = [self.car_count // processes + (1 if shard < self.car_count % processes else 0) for shard in range(processes)]
+        start = time.perf_counter()
+        if processes == 1:
+            self.shards = [FleetShard(self.compiled_graph, self.stations, self.car_count, self.seed, self.destinations,
+                                      keep_trip_logs=self.keep_trip_logs)]
+            self.shards[0].run(days, trips_per_day)
+            summaries = [self.shards[0].summary()]
+        else:
+            # Imported here, like in RoutePlanner.distance_matrix, as the multiprocessing modules are slow to load.
+            from concurrent.futures import ProcessPoolExecutor
+            with tempfile.TemporaryDirectory() as folder:
+                snapshot_path = os.path.join(folder, "fleet.graph")
+                save_snapshot(self.compiled_graph, snapshot_path)
+                with ProcessPoolExecutor(processes) as pool:
+                    futures = [pool.submit(simulate_shard, snapshot_path, self.stations, self.destinations, count, self.seed + shard, days, trips_per_day)
+                               for shard, count in enumerate(counts)]
+                    summaries = [future.result() for future in futures]
+        seconds = time.perf_counter() - start
+
+        report = {"cars": self.car_count, "days": days, "processes": processes, "seconds": seconds}
+        for key in ("trips", "km", "rejected", "stranded", "maintenance_due_in_week"):
+            report[key] = sum(summary[key] for summary in summaries)
+        report["trips_per_second"] = report["trips"] / seconds
+        charging_stops = sum((summary["charging_stops"] for summary in summaries), Counter())
+        maintenance_visits = sum((summary["maintenance_visits"] for summary in summaries), Counter())
+        report["charging_stops"] = sum(charging_stops.values())
+        report["peak_charging_per_station"] = {}
+        for (date, station), count in charging_stops.items():
+            report["peak_charging_per_station"][station] = max(count, report["peak_charging_per_station"].get(station, 0))
+        visits_per_day = Counter()
+        for (date, part), count in maintenance_visits.items():
+            visits_per_day[date] += count
+        report["maintenance_visits"] = sum(visits_per_day.values())
+        report["peak_maintenance_per_day"] = max(visits_per_day.values(), default=0)
+        return report
+
+
+# python fleetsimulator.py --cars 10000 --days 30 --processes 4
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a fleet of cars driving around the map.")
+    parser.add_argument("--cars", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--trips-per-day", type=int, default=3)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    report = FleetSimulator(car_count=args.cars, processes=args.processes, seed=args.seed).run(args.days, args.trips_per_day)
+    print("{trips} trips ({km:.0f} km) by {cars} cars in {days} days, simulated in {seconds:.2f} s: "
+          "{trips_per_second:.0f} trips per second.".format(**report))
+    print("Charging stops: {}, busiest day per station: {}".format(report["charging_stops"], report["peak_charging_per_station"]))
+    print("Maintenance visits: {}, busiest day: {}, cars due within a week: {}".format(
+        report["maintenance_visits"], report["peak_maintenance_per_day"], report["maintenance_due_in_week"]))
+    print("Trips rejected for charging: {}, cars towed to a station: {}".format(report["rejected"], report["stranded"]))
@@ -0,0 +1,196 @@
+import csv
+import mmap
+import struct
+import sys
+from collections import deque
+
+from compiledgraph import CompiledGraph
+
+# This file loads road networks from files, instead of writing them into data.py by hand.
+# Edge lists are read as CSV, one road per line, e.g. exported from OpenStreetMap. A compiled graph can also be saved as a binary
+# snapshot, which is memory-mapped when it is loaded, so even very large maps are ready to use in milliseconds.
+
+ORIGIN_COLUMNS = ("origin", "from", "source", "u")
+DESTINATION_COLUMNS = ("destination", "to", "target", "v")
+DISTANCE_COLUMNS = ("km", "distance", "length", "weight")
+ONEWAY_VALUES = ("yes", "true", "1")
+
+
+def parse_number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def find_column(header, names, path):
+    for name in names:
+        if name in header:
+            return header.index(name)
+    raise ValueError("{} has no column called {}.".format(path, " or ".join(names)))
+
+
+# Reads a CSV edge list into the graph dictionary format of data.py, one line at a time. The first line must name the columns
+# (see the *_COLUMNS lists above). If there is a 'oneway' column, roads that are not one-way are added in both directions.
+# 'distance_scale' converts the distance column to kilometres, e.g. 0.001 for OpenStreetMap lengths in metres.
+# One-way roads are not expected to have a road back, so "validate_graph()" does not check them for one.
+def load_edge_csv(path, distance_scale=1, validate=True):
+    graph = {}
+    destinations = []
+    oneway_roads = set()
+    with open(path, newline="", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        header = [column.strip().lower() for column in next(reader)]
+        origin_column = find_column(header, ORIGIN_COLUMNS, path)
+        destination_column = find_column(header, DESTINATION_COLUMNS, path)
+        distance_column = find_column(header, DISTANCE_COLUMNS, path)
+        oneway_column = header.index("oneway") if "oneway" in header else None
+
+        for row in reader:
+            if not row:
+                continue
+            origin, destination = row[origin_column], row[destination_column]
+            distance = parse_number(row[distance_column])
+            if distance_scale != 1:
+                distance *= distance_scale
+            graph.setdefault(origin, {})[destination] = distance
+            if oneway_column is not None and row[oneway_column].strip().lower() not in ONEWAY_VALUES:
+                graph.setdefault(destination, {})[origin] = distance
+            else:
+                destinations.append(destination)
+                if oneway_column is not None:
+                    oneway_roads.add((origin, destination))
+    # Locations that no road leaves from are added last, so the locations keep the order in which they appear as origins.
+    for destination in destinations:
+        graph.setdefault(destination, {})
+
+    if validate:
+        problems = validate_graph(graph, oneway_roads)
+        if problems:
+            raise ValueError("{} is not a valid road network: {}".format(path, "; ".join(problems)))
+    return graph
+
+
+# Reads a list of names (e.g. charging stations) from the first column of a CSV file with a header line.
+def load_names(path):
+    with open(path, newline="", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        next(reader)
+        return [row[0] for row in reader if row]
+
+
+# Reads 'name,lat,long' lines into a dictionary of (latitude, longitude) tuples, like data.coordinates.
+def load_coordinates(path):
+    with open(path, newline="", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        next(reader)
+        return {row[0]: (float(row[1]), float(row[2])) for row in reader if row}
+
+
+# Returns the set of locations that can be reached from 'start', following the roads in 'graph' ({origin: [destinations]}).
+def reachable_from(graph, start):
+    reached = {start}
+    queue = deque([start])
+    while queue:
+        node = queue.popleft()
+        for neighbour in graph.get(node, ()):
+            if neighbour not in reached:
+                reached.add(neighbour)
+                queue.append(neighbour)
+    return reached
+
+
+# Checks that every road can be driven in both directions with the same distance, and that every location can be reached
+# from every other one. Returns a list of problems, which is empty for a valid network.
+# The roads in 'oneway_roads', as (origin, destination) pairs, do not need a road back. Because of them, reaching every location
+# from the first one is not enough: every location must also be able to get back to it, which is checked by following the
+# roads backwards from the same location.
+def validate_graph(graph, oneway_roads=()):
+    problems = []
+    asymmetric = [(origin, destination) for origin, roads in graph.items() for destination, distance in roads.items()
+                  if (origin, destination) not in oneway_roads and graph.get(destination, {}).get(origin) != distance]
+    if asymmetric:
+        problems.append("{} roads have no matching road back, e.g. {} -> {}".format(len(asymmetric), *asymmetric[0]))
+
+    if graph:
+        start = next(iter(graph))
+        reached = reachable_from(graph, start)
+        if len(reached) != len(graph):
+            problems.append("{} of {} locations cannot be reached from {}".format(len(graph) - len(reached), len(graph), start))
+        reverse = {}
+        for origin, roads in graph.items():
+            for destination in roads:
+                reverse.setdefault(destination, []).append(origin)
+        returned = reachable_from(reverse, start)
+        if len(returned) != len(graph):
+            stuck = next(name for name in graph if name not in returned)
+            problems.append("{} of {} locations cannot reach {}, e.g. {}".format(len(graph) - len(returned), len(graph), start, stuck))
+    return problems
+
+
+# --- Binary snapshots ---
+# A snapshot starts with a header, followed by the arrays of a CompiledGraph, each padded to a multiple of 8 bytes,
+# and finally the location names separated by newlines.
+SNAPSHOT_MAGIC = b"GRAPHSNP"
+SNAPSHOT_HEADER = struct.Struct("<8sIcc2xqqq")
+SNAPSHOT_VERSION = 1
+
+
+def save_snapshot(compiled_graph, path):
+    has_coordinates = compiled_graph.has_coordinates()
+    names = "\n".join(compiled_graph.names).encode("utf-8")
+    with open(path, "wb") as file:
+        file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, compiled_graph.weight_typecode().encode(),
+                                        b"1" if has_coordinates else b"0", len(compiled_graph), compiled_graph.edge_count(), len(names)))
+        parts = [compiled_graph.offsets, compiled_graph.targets, compiled_graph.weights, compiled_graph.reverse_offsets,
+                 compiled_graph.reverse_sources, compiled_graph.reverse_edges]
+        if has_coordinates:
+            parts += [compiled_graph.latitudes, compiled_graph.longitudes]
+        for part in parts:
+            file.write(memoryview(part).cast("B"))
+        file.write(struct.pack("<d", compiled_graph.heuristic_scale))
+        file.write(names)
+
+
+# Loads a snapshot saved with "save_snapshot()". The arrays are memoryviews of the mapped file, so nothing is copied; the file is
+# mapped copy-on-write, so changing a distance (e.g. because of traffic) never changes the file.
+def load_snapshot(path):
+    with open(path, "rb") as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    magic, version, weight_typecode, has_coordinates, node_count, edge_count, names_length = SNAPSHOT_HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError("{} is not a graph snapshot.".format(path))
+
+    view = memoryview(data)
+    position = SNAPSHOT_HEADER.size
+    parts = []
+    sizes = [node_count + 1, edge_count, edge_count, node_count + 1, edge_count, edge_count]
+    typecodes = ["q", "q", weight_typecode.decode(), "q", "q", "q"]
+    if has_coordinates == b"1":
+        sizes += [node_count, node_count]
+        typecodes += ["d", "d"]
+    for size, typecode in zip(sizes, typecodes):
+        parts.append(view[position:position + 8 * size].cast(typecode))
+        position += 8 * size
+    heuristic_scale = struct.unpack_from("<d", data, position)[0]
+    position += 8
+    names = view[position:position + names_length]
+    return CompiledGraph.from_arrays(parts, heuristic_scale, names)
+
+
+# Converts a CSV edge list into a binary snapshot from the terminal: python graphloader.py roads.csv roads.graph
+if __name__ == "__main__":
+    compiled_graph = CompiledGraph(load_edge_csv(sys.argv[1]))
+    save_snapshot(compiled_graph, sys.argv[2])
+    print("Saved {} locations and {} roads to {}.".format(len(compiled_graph), compiled_graph.edge_count(), sys.argv[2]))
+
+
+# --- TESTS ---
+# The below code was used to test loading maps.
+
+# graph = load_edge_csv("maps/oneway_roads.csv")
+# assert graph["Landmark Mall"] == {"The Pearl": 13, "City Center": 11} # PASSED
+# assert graph["City Center"] == {"The Pearl": 9} # PASSED
+# assert validate_graph(graph) != [] # PASSED
+# assert validate_graph(graph, {("Landmark Mall", "City Center"), ("City Center", "The Pearl")}) == [] # PASSED
+# assert len(validate_graph({"A": {"B": 1}, "B": {}}, {("A", "B")})) == 1 # PASSED
@@ -0,0 +1,304 @@
+import cProfile
+import functools
+import heapq
+import io
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+import routingengine
+from energymonitor import EnergyMonitor
+from maintenancemonitor import MaintenanceMonitor
+from routecache import RouteCache
+from routeplanner import RoutePlanner
+from routingengine import RoutingEngine, SearchTree
+
+# This file measures what the route planner and the monitors are doing while the program runs: how long every call takes
+# (as a histogram), how many locations the searches visit, how often the route cache is used and how many trips the battery
+# approves. Nothing in this file runs until "enable()" is called: it then replaces the methods below with versions that time
+# and count every call, and "disable()" puts the original methods back. When it is switched off the classes are exactly the
+# same as before, so leaving it in the program costs nothing.
+#   import instrumentation
+#   instrumentation.enable()
+#   ... use the route planner ...
+#   print(instrumentation.snapshot())
+
+
+# A histogram of call times. Bucket i counts the calls that took less than 2**i microseconds (and at least 2**(i-1)), so adding
+# a call is a few operations and the histogram never grows, however many calls are added.
+class LatencyHistogram:
+    bucket_count = 40
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.counts = [0] * self.bucket_count
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def add(self, seconds):
+        microseconds = seconds * 1000000
+        self.counts[min(int(microseconds).bit_length(), self.bucket_count - 1)] += 1
+        self.count += 1
+        self.total += microseconds
+        if microseconds < self.min:
+            self.min = microseconds
+        if microseconds > self.max:
+            self.max = microseconds
+
+    # Returns an upper limit for the given percentile (e.g. 0.99), in microseconds: the top of the bucket it falls into.
+    def percentile(self, fraction):
+        if self.count == 0:
+            return 0.0
+        needed = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= needed:
+                return min(float(2 ** bucket), self.max)
+        return self.max
+
+    def snapshot(self):
+        return {"count": self.count, "mean_us": self.total / self.count if self.count else 0.0,
+                "min_us": self.min if self.count else 0.0, "max_us": self.max, "p50_us": self.percentile(0.5),
+                "p90_us": self.percentile(0.9), "p99_us": self.percentile(0.99)}
+
+
+# Stands in for the heapq module inside routingengine.py while the instrumentation is on. Every push onto the priority queue of a
+# search is a road that gave a location a shorter distance (an "edge relaxation"), so counting the pushes counts the relaxations
+# without changing the search code.
+class CountingHeapq:
+
+    def __init__(self, counters):
+        self.counters = counters
+
+    heappop = staticmethod(heapq.heappop)
+
+    def heappush(self, queue, item):
+        self.counters["search.edges_relaxed"] += 1
+        heapq.heappush(queue, item)
+
+
+# A simple sampling profiler: a background thread looks at what the main thread is doing every 'interval' seconds and counts
+# the functions it finds. Unlike cProfile, the program itself is not slowed down, so it can be left running on a busy service.
+class Sampler:
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = threading.main_thread().ident if thread_id is None else thread_id
+        self.samples = Counter()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                code = frame.f_code
+                self.samples["{}:{} ({})".format(code.co_filename.rsplit("/", 1)[-1], frame.f_lineno, code.co_name)] += 1
+            time.sleep(self.interval)
+
+    # Returns the 'limit' most common lines with the share of samples they were found in.
+    def top(self, limit=10):
+        total = sum(self.samples.values())
+        return [(place, count / total) for place, count in self.samples.most_common(limit)]
+
+
+# The Instrumentation class holds the histograms and counters, and switches the timed methods on and off.
+class Instrumentation:
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = Counter()
+        self.originals = {}
+        self.profiler = None
+        self.sampler = None
+
+    def is_enabled(self):
+        return bool(self.originals)
+
+    # Replaces the hot methods with timed versions. With 'profile', every call in the program is also recorded by cProfile
+    # (which makes it several times slower); with 'sample', a Sampler is started instead.
+    def enable(self, profile=False, sample=False):
+        if not self.is_enabled():
+            self.patch(RoutePlanner, "calculate_route", self.count_route)
+            self.patch(RoutePlanner, "calculate_route_with_charging", self.count_route)
+            self.patch(RoutePlanner, "suggest_charging")
+            self.patch(RoutePlanner, "find_route")
+            self.patch(RoutePlanner, "distance_matrix")
+            self.patch(EnergyMonitor, "route_approval", self.count_approval)
+            self.patch(EnergyMonitor, "route_approval_batch", self.count_batch_approval)
+            self.patch(MaintenanceMonitor, "calc_maintenance")
+            self.patch(MaintenanceMonitor, "count_trip")
+            self.patch(RoutingEngine, "astar_path", self.count_astar)
+            # Every way a search tree visits locations is counted: searches, reachability (expand_within) and repairs (settle).
+            self.patch(SearchTree, "expand", wrap=self.wrap_expand)
+            self.patch(SearchTree, "expand_within", wrap=self.wrap_expand)
+            self.patch(SearchTree, "settle", self.count_settle)
+            self.patch(RouteCache, "get_tree", wrap=self.wrap_get_tree)
+            self.originals[(routingengine, "heapq")] = routingengine.heapq
+            routingengine.heapq = CountingHeapq(self.counters)
+        # A profiler that was stopped by "disable()" continues where it left off.
+        if profile:
+            if self.profiler is None:
+                self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        if sample:
+            if self.sampler is None:
+                self.sampler = Sampler()
+            self.sampler.start()
+
+    # Puts the original methods back and stops the profilers. The numbers collected so far are kept until "reset()".
+    def disable(self):
+        for (owner, name), original in self.originals.items():
+            setattr(owner, name, original)
+        self.originals.clear()
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+
+    # Throws away the numbers collected so far. The profilers are stopped and their results are thrown away as well.
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.clear()
+        self.counters.clear()
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler = None
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler = None
+
+    # Replaces 'owner.name' with a version that adds the time of every call to the histogram "Owner.name", and then calls
+    # 'after(instance, result)' to count what the call did. 'wrap' can build a different replacement instead.
+    def patch(self, owner, name, after=None, wrap=None):
+        original = owner.__dict__[name]
+        self.originals[(owner, name)] = original
+        histogram = self.histograms.setdefault("{}.{}".format(owner.__name__, name), LatencyHistogram())
+        if wrap is not None:
+            setattr(owner, name, wrap(original, histogram))
+            return
+
+        @functools.wraps(original)
+        def timed(instance, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = original(instance, *args, **kwargs)
+            finally:
+                histogram.add(time.perf_counter() - start)
+            if after is not None:
+                after(instance, result)
+            return result
+        setattr(owner, name, timed)
+
+    def count_route(self, planner, result):
+        self.counters["route_planner.routes" if result is not None else "route_planner.unreachable"] += 1
+
+    def count_approval(self, energy_monitor, approved):
+        self.counters["energy_monitor.approved" if approved else "energy_monitor.rejected"] += 1
+
+    def count_batch_approval(self, energy_monitor, approvals):
+        approved = sum(approvals)
+        self.counters["energy_monitor.approved"] += approved
+        self.counters["energy_monitor.rejected"] += len(approvals) - approved
+
+    def count_astar(self, engine, result):
+        self.counters["search.nodes_settled"] += engine.last_settled
+
+    # Counts the locations a search visits from the size of the visited set before and after the search. This works for "expand()"
+    # and "expand_within()", which only add locations to the set.
+    def wrap_expand(self, original, histogram):
+        counters = self.counters
+
+        @functools.wraps(original)
+        def expand(tree, argument):
+            start = time.perf_counter()
+            visited = len(tree.visited)
+            try:
+                return original(tree, argument)
+            finally:
+                counters["search.nodes_settled"] += len(tree.visited) - visited
+                histogram.add(time.perf_counter() - start)
+        return expand
+
+    # A repair can visit a location again, so "settle()" returns the number of locations it visited itself.
+    def count_settle(self, tree, settled):
+        self.counters["search.nodes_settled"] += settled
+
+    # The hits and misses are read from the cache's own counters, which also know when a tree was thrown away because the graph
+    # had changed.
+    def wrap_get_tree(self, original, histogram):
+        counters = self.counters
+
+        @functools.wraps(original)
+        def get_tree(cache, source):
+            start = time.perf_counter()
+            hits, misses = cache.hits, cache.misses
+            try:
+                return original(cache, source)
+            finally:
+                counters["route_cache.hits"] += cache.hits - hits
+                counters["route_cache.misses"] += cache.misses - misses
+                histogram.add(time.perf_counter() - start)
+        return get_tree
+
+    # Returns the numbers collected so far as a dictionary of plain values (e.g. to send as JSON). Methods that were never called
+    # are left out.
+    def snapshot(self):
+        report = {"enabled": self.is_enabled(),
+                  "latency": {name: histogram.snapshot() for name, histogram in sorted(self.histograms.items()) if histogram.count},
+                  "counters": dict(sorted(self.counters.items()))}
+        if self.sampler is not None:
+            report["samples"] = self.sampler.top()
+        return report
+
+    # Returns the cProfile report as text, sorted by 'sort' (see the pstats module), or None if profiling was not switched on.
+    def profile_report(self, limit=20, sort="cumulative"):
+        if self.profiler is None:
+            return None
+        output = io.StringIO()
+        pstats.Stats(self.profiler, stream=output).sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+
+instrumentation = Instrumentation()
+
+
+# The functions below use the instrumentation of the whole program.
+def enable(profile=False, sample=False):
+    instrumentation.enable(profile, sample)
+
+
+def disable():
+    instrumentation.disable()
+
+
+def reset():
+    instrumentation.reset()
+
+
+def snapshot():
+    return instrumentation.snapshot()
+
+
+def profile_report(limit=20, sort="cumulative"):
+    return instrumentation.profile_report(limit, sort)
@@ -1,88 +1,290 @@
-from routeplanner import route_planner
+from array import array
+from collections.abc import Mapping
+from types import MappingProxyType
 
-# All parts of the car are instances of this class and stored in the 'parts' dictionary of the MaintenanceMonitor class.
+
+# The PartRegistry stores the parts of one car, or of a whole fleet, like the FleetBattery: instead of one object per part, it keeps
+# one array of conditions, one of maximum and one of minimum conditions per part, with one entry per vehicle. A fleet of
+# 100,000 cars with 5 parts takes 12 MB instead of half a million dictionaries, and the maintenance forecast of the whole fleet
+# is calculated part by part, over all vehicles at once (see "forecast()").
+# Not every vehicle has to have every part: 'fitted' holds one bytearray per part, with 1 for every vehicle that has it. A part
+# added with "add_part()" is fitted to the whole fleet; a new part added with "set_part()" only to that one vehicle, and the
+# entries of the other vehicles are left unused until they get the part as well.
+class PartRegistry:
+
+    def __init__(self, vehicle_count=1):
+        self.vehicle_count = vehicle_count
+        self.names = []
+        self.index = {}
+        self.conditions = []
+        self.max_conditions = []
+        self.min_conditions = []
+        self.fitted = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    # Adds a part to every vehicle with the same conditions, or resets it if it already exists. Returns the part number.
+    def add_part(self, name, condition, max_condition, min_condition):
+        if name not in self.index:
+            self.index[name] = len(self.names)
+            self.names.append(name)
+            self.conditions.append(None)
+            self.max_conditions.append(None)
+            self.min_conditions.append(None)
+            self.fitted.append(None)
+        part = self.index[name]
+        self.conditions[part] = array("d", [condition]) * self.vehicle_count
+        self.max_conditions[part] = array("d", [max_condition]) * self.vehicle_count
+        self.min_conditions[part] = array("d", [min_condition]) * self.vehicle_count
+        self.fitted[part] = bytearray([1]) * self.vehicle_count
+        return part
+
+    # Sets all conditions of one part of one vehicle. A part that is new to the registry is only fitted to this vehicle.
+    def set_part(self, name, condition, max_condition, min_condition, vehicle=0):
+        if name not in self.index:
+            part = self.add_part(name, condition, max_condition, min_condition)
+            self.fitted[part] = bytearray(self.vehicle_count)
+        part = self.index[name]
+        self.conditions[part][vehicle] = condition
+        self.max_conditions[part][vehicle] = max_condition
+        self.min_conditions[part][vehicle] = min_condition
+        self.fitted[part][vehicle] = 1
+
+    def has_part(self, name, vehicle=0):
+        return name in self.index and self.fitted[self.index[name]][vehicle] == 1
+
+    # The names of the parts of one vehicle, in the order they were added to the registry.
+    def part_names(self, vehicle=0):
+        return [name for part, name in enumerate(self.names) if self.fitted[part][vehicle]]
+
+    def get_part(self, name, vehicle=0):
+        return Part.view(self, vehicle, self.index[name])
+
+    def get_condition(self, name, vehicle=0):
+        return self.conditions[self.index[name]][vehicle]
+
+    def set_condition(self, name, new_condition, vehicle=0):
+        self.conditions[self.index[name]][vehicle] = new_condition
+
+    # Average condition of the parts of one vehicle, read from the arrays, so changes made through a Part view or by another
+    # monitor that shares the registry are always included.
+    def average_condition(self, vehicle=0):
+        conditions = [self.conditions[part][vehicle] for part in range(len(self.names)) if self.fitted[part][vehicle]]
+        return sum(conditions) / len(conditions)
+
+    # Forecasts maintenance for every vehicle (or for the vehicle numbers in 'vehicles'), given the number of days with trips of
+    # every vehicle ('total_days': one number for all, or one per vehicle). Returns a dictionary with:
+    # - 'days': one array per part with the days until that part reaches its minimum condition, calculated like the
+    #   MaintenanceMonitor always has, or infinity when it cannot be calculated (the part has not worn, there are no trips yet,
+    #   or the vehicle does not have the part);
+    # - 'replace': one bytearray per part, 1 where the part is already at or below its minimum condition;
+    # - 'emergency': a bytearray with 1 for every vehicle that has a part to replace, or a part that is due today.
+    def forecast(self, total_days, vehicles=None):
+        infinity = float("inf")
+        count = self.vehicle_count if vehicles is None else len(vehicles)
+        if isinstance(total_days, (int, float)):
+            total_days = [total_days] * count
+        days = []
+        replace = []
+        emergency = bytearray(count)
+        for part in range(len(self.names)):
+            conditions, max_conditions, min_conditions = self.conditions[part], self.max_conditions[part], self.min_conditions[part]
+            fitted = self.fitted[part]
+            if vehicles is not None:
+                conditions = [conditions[vehicle] for vehicle in vehicles]
+                max_conditions = [max_conditions[vehicle] for vehicle in vehicles]
+                min_conditions = [min_conditions[vehicle] for vehicle in vehicles]
+                fitted = bytearray([fitted[vehicle] for vehicle in vehicles])
+            # A vehicle without the part is given the same condition as its maximum, so it is never due.
+            if 0 in fitted:
+                conditions = [condition if has_part else max_condition
+                              for condition, max_condition, has_part in zip(conditions, max_conditions, fitted)]
+            part_replace = bytearray([condition <= min_condition and has_part
+                                      for condition, min_condition, has_part in zip(conditions, min_conditions, fitted)])
+            # The same formula as before: days per percent of wear, and the remaining percent divided by it.
+            part_days = array("d", [int((condition - min_condition) / (days_used / (max_condition - condition)))
+                                    if max_condition != condition and days_used != 0 else infinity
+                                    for condition, max_condition, min_condition, days_used
+                                    in zip(conditions, max_conditions, min_conditions, total_days)])
+            emergency = bytearray([urgent or replaced or due == 0
+                                   for urgent, replaced, due in zip(emergency, part_replace, part_days)])
+            days.append(part_days)
+            replace.append(part_replace)
+        return {"days": days, "replace": replace, "emergency": emergency}
+
+
+# A Part is a small view of one part of one vehicle in a PartRegistry: reading or changing its condition reads or changes the
+# registry. A Part created directly, e.g. Part("Heat Pump", 99.0, 100.0, 50.0), gets a registry of its own.
 class Part:
+    __slots__ = ("registry", "vehicle", "part")
+
     def __init__(self, name, condition, max_condition, min_condition):
-        self.name = name
-        self.condition = condition
-        self.max_condition = max_condition
-        self.min_condition = min_condition
-    
+        self.registry = PartRegistry()
+        self.vehicle = 0
+        self.part = self.registry.add_part(name, condition, max_condition, min_condition)
+
+    @classmethod
+    def view(cls, registry, vehicle, part):
+        view = cls.__new__(cls)
+        view.registry = registry
+        view.vehicle = vehicle
+        view.part = part
+        return view
+
+    @property
+    def name(self):
+        return self.registry.names[self.part]
+
+    @property
+    def condition(self):
+        return self.registry.conditions[self.part][self.vehicle]
+
+    @condition.setter
+    def condition(self, new_condition):
+        self.registry.conditions[self.part][self.vehicle] = new_condition
+
+    @property
+    def max_condition(self):
+        return self.registry.max_conditions[self.part][self.vehicle]
+
+    @property
+    def min_condition(self):
+        return self.registry.min_conditions[self.part][self.vehicle]
+
     def get_current(self):
         return self.condition
-    
+
     def set_current(self, new_condition):
         self.condition = new_condition
 
     def get_min(self):
         return self.min_condition
-        
+
+    def __repr__(self):
+        return "Part({!r}, {}, {}, {})".format(self.name, self.condition, self.max_condition, self.min_condition)
+
+
+# The 'parts' of a MaintenanceMonitor: a read-only dictionary {name: {'condition': ..., 'max': ..., 'min': ...}} of the parts of
+# one vehicle, read from the registry when it is used. Changing it raises an error instead of changing a copy that is thrown away.
+class PartsView(Mapping):
+
+    def __init__(self, registry, vehicle):
+        self.registry = registry
+        self.vehicle = vehicle
+
+    def __getitem__(self, name):
+        registry, vehicle = self.registry, self.vehicle
+        if not registry.has_part(name, vehicle):
+            raise KeyError(name)
+        part = registry.index[name]
+        return MappingProxyType({"condition": registry.conditions[part][vehicle], "max": registry.max_conditions[part][vehicle],
+                                 "min": registry.min_conditions[part][vehicle]})
+
+    def __iter__(self):
+        return iter(self.registry.part_names(self.vehicle))
+
+    def __len__(self):
+        return len(self.registry.part_names(self.vehicle))
+
+    def __repr__(self):
+        return repr({name: dict(part) for name, part in self.items()})
 
 # This class controls all car parts and can retrieve data about them. It also calculates how many days are left until maintenance is due,
 # based on degradation of parts and trips taken.
+# The monitor subscribes to the trips of the RoutePlanner and keeps running totals (kilometres driven and trips per day), so that
+# it never has to go through the whole trip history again. The average condition is calculated from the stored conditions when it is
+# asked for, so it is never out of date, however the conditions were changed.
+# Without a 'planner', the monitor follows the 'route_planner' of the default AppContext (see app.py).
+# The parts are stored in a PartRegistry. By default the car has a registry of its own; a car of a fleet can instead use its
+# 'vehicle' number in the 'registry' of the fleet.
+# 'parts' is a read-only view in the format of the old dictionary; the conditions are changed with the methods below.
+# 'car_emergency' belongs to the car of this monitor and is set again by every "calc_maintenance()". For the maintenance of a whole
+# fleet, see the MaintenanceScheduler (maintenancescheduler.py).
 class MaintenanceMonitor:
-    car_emergency = False
 
-    def __init__(self):
-        self.parts = {}
+    def __init__(self, planner=None, registry=None, vehicle=0):
+        if planner is None:
+            from app import default_context
+            planner = default_context().route_planner
+        self.registry = PartRegistry() if registry is None else registry
+        self.vehicle = vehicle
+        self.car_emergency = False
+        self.total_km = planner.trips_taken.total_km()
+        self.trips_per_day = planner.trips_taken.trips_per_day()
+        planner.subscribe_trips(self.add_trip)
+
+    def add_trip(self, trip):
+        self.count_trip(trip.distance, trip.date)
+
+    def count_trip(self, distance, date):
+        self.total_km += distance
+        self.trips_per_day[date] = self.trips_per_day.get(date, 0) + 1
+
+    @property
+    def parts(self):
+        return PartsView(self.registry, self.vehicle)
 
     def add_part(self, part_name, condition, max_condition, min_condition):
-        self.parts[part_name] = {"condition": condition, "max": max_condition, "min": min_condition}
+        self.registry.set_part(part_name, condition, max_condition, min_condition, self.vehicle)
+
+    def get_part(self, part_name):
+        return self.registry.get_part(part_name, self.vehicle)
+
+    def set_current_condition(self, part_name, new_condition):
+        self.registry.set_condition(part_name, new_condition, self.vehicle)
+
+    # Average condition of all parts, in percent.
+    def get_average_condition(self):
+        return self.registry.average_condition(self.vehicle)
 
     def get_current_condition(self, part_name):
-        return self.parts[part_name]["condition"]
+        return self.registry.conditions[self.registry.index[part_name]][self.vehicle]
     
     def get_min_condition(self, part_name):
-        return self.parts[part_name]["min"]
+        return self.registry.min_conditions[self.registry.index[part_name]][self.vehicle]
     
     def get_max_condition(self, part_name):
-        return self.parts[part_name]["max"]
+        return self.registry.max_conditions[self.registry.index[part_name]][self.vehicle]
     
     def list_parts(self):
-        return list(self.parts.keys())
+        return self.registry.part_names(self.vehicle)
 
-    # Need to get info from RoutePlanner
+    # Based on the trips received from the RoutePlanner
     def get_total_km(self):
-        total_km = 0
-        for trip in route_planner.trips_taken.values():
-            total_km += trip["km"]
-        return total_km
+        return self.total_km
 
     def get_total_days(self):
-        days = set()
-        for trip in route_planner.trips_taken.values():
-            days.add(trip['date'])
-        return len(days)
+        return len(self.trips_per_day)
+
+    def get_trips_per_day(self):
+        return self.trips_per_day
 
-    # Based on info from RoutePlanner
+    # Based on info from RoutePlanner. The forecast itself is calculated by the PartRegistry (see "PartRegistry.forecast()").
     def calc_maintenance(self):
-        total_days = self.get_total_days()
+        forecast = self.registry.forecast(self.get_total_days(), [self.vehicle])
+        self.car_emergency = False
 
         maintenance_dates = []
 
-        for part_name, part in self.parts.items():
-            min_condition = self.get_min_condition(part_name)
-            current_condition = self.get_current_condition(part_name)
-            max_condition = self.get_max_condition(part_name)
+        for part, part_name in enumerate(self.registry.names):
+            if not self.registry.fitted[part][self.vehicle]:
+                continue
+            if forecast["replace"][part][0]:
+                self.car_emergency = True
+                return "Warning: The {} of your car needs to be replaced immediately! Current condition: {}%.".format(part_name, self.get_current_condition(part_name))
 
-            if current_condition <= min_condition:
+            days_until_maint = forecast["days"][part][0]
+            if days_until_maint == float("inf"):
+                print("{} remains at {}".format(part_name, self.get_current_condition(part_name)))
+            elif days_until_maint == 0:
                 self.car_emergency = True
-                return "Warning: The {} of your car needs to be replaced immediately! Current condition: {}%.".format(part_name, current_condition)
-            
-            else: 
-                try: 
-                    decline = max_condition - current_condition
-                    per_day = total_days / decline
-                    life_span = current_condition - min_condition
-                    days_until_maint = int(life_span / per_day)
-
-                    if days_until_maint == 0:
-                        self.car_emergency = True
-                        maintenance_dates.append((part_name, "today"))
-                    else:
-                        maintenance_dates.append((part_name, "in {} days".format(days_until_maint)))
-                except ZeroDivisionError:
-                    print("{} remains at {}".format(part_name, current_condition))
+                maintenance_dates.append((part_name, "today"))
+            else:
+                maintenance_dates.append((part_name, "in {} days".format(int(days_until_maint))))
         return maintenance_dates
 
 
@@ -108,3 +310,15 @@ class MaintenanceMonitor:
 # maintenance_monitor.calc_maintenance() # WORKS
 # print(maintenance_monitor.get_total_km()) # WORKS
 # print(maintenance_monitor.get_total_days()) # WORKS
+
+# maintenance_monitor.get_part("Heat Pump").set_current(10)
+# assert maintenance_monitor.get_average_condition() == 82.0 # PASSED
+# fleet = PartRegistry(2)
+# m0 = MaintenanceMonitor(registry=fleet, vehicle=0)
+# m1 = MaintenanceMonitor(registry=fleet, vehicle=1)
+# m0.add_part("Heat Pump", 99.0, 100.0, 50.0)
+# m1.add_part("Battery", 80.0, 100.0, 50.0)
+# assert m0.list_parts() == ["Heat Pump"] and m1.list_parts() == ["Battery"] # PASSED
+# assert m0.get_average_condition() == 99.0 and m1.get_average_condition() == 80.0 # PASSED
+# m1.get_part("Battery").set_current(60.0)
+# assert m0.get_average_condition() == 99.0 and m1.parts["Battery"]["condition"] == 60.0 # PASSED
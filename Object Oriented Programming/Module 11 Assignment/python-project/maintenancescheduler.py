@@ -0,0 +1,290 @@
+import datetime
+import heapq
+from array import array
+
+from neareststation import NearestStationTable
+from triplog import TripLog, from_epoch_day, to_epoch_day
+
+# This file keeps the maintenance of a whole fleet up to date while the cars drive. The MaintenanceMonitor only calculates the
+# maintenance dates of one car when they are asked for; the MaintenanceScheduler instead keeps the date on which every part of
+# every car is due in one priority queue, and moves only the parts of a car whose forecast changed when that car records a trip.
+# "Which services are due next?" and "which cars need a part replaced right now?" are then answered without going through the fleet.
+#   scheduler = MaintenanceScheduler(fleet.parts)
+#   scheduler.record_trip(vehicle, distance, date)
+#   print(scheduler.next_due(10))
+
+
+# A binary heap of (priority, key) that also remembers where every key is in the heap ('positions'), so the priority of a key can
+# be changed, or the key removed, in O(log n), instead of adding a second entry and skipping the old one later.
+class IndexedHeap:
+
+    def __init__(self):
+        self.heap = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def priority(self, key):
+        return self.heap[self.positions[key]][0]
+
+    # Adds a key, or changes its priority if it is already in the heap.
+    def set(self, key, priority):
+        position = self.positions.get(key)
+        if position is None:
+            self.heap.append((priority, key))
+            self.positions[key] = len(self.heap) - 1
+            self.move_up(len(self.heap) - 1)
+            return
+        old_priority = self.heap[position][0]
+        self.heap[position] = (priority, key)
+        if priority < old_priority:
+            self.move_up(position)
+        elif priority > old_priority:
+            self.move_down(position)
+
+    def remove(self, key):
+        position = self.positions.pop(key, None)
+        if position is None:
+            return
+        last = self.heap.pop()
+        if position < len(self.heap):
+            self.heap[position] = last
+            self.positions[last[1]] = position
+            self.move_up(position)
+            self.move_down(self.positions[last[1]])
+
+    # Returns the (priority, key) with the smallest priority, or None when the heap is empty.
+    def peek(self):
+        return self.heap[0] if self.heap else None
+
+    # Returns the entries in order of priority, without changing the heap, and stops after the last entry with a priority of at
+    # most 'limit'. Only the entries that are returned and their children are looked at, so the first k entries take O(k log k).
+    def ordered(self, limit=float("inf")):
+        heap = self.heap
+        if not heap:
+            return
+        candidates = [(heap[0], 0)]
+        while candidates:
+            entry, position = heapq.heappop(candidates)
+            if entry[0] > limit:
+                return
+            yield entry
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < len(heap):
+                    heapq.heappush(candidates, (heap[child], child))
+
+    def move_up(self, position):
+        heap, positions = self.heap, self.positions
+        entry = heap[position]
+        while position > 0:
+            parent = (position - 1) // 2
+            if heap[parent] <= entry:
+                break
+            heap[position] = heap[parent]
+            positions[heap[position][1]] = position
+            position = parent
+        heap[position] = entry
+        positions[entry[1]] = position
+
+    def move_down(self, position):
+        heap, positions = self.heap, self.positions
+        entry = heap[position]
+        size = len(heap)
+        while True:
+            child = 2 * position + 1
+            if child >= size:
+                break
+            if child + 1 < size and heap[child + 1] < heap[child]:
+                child += 1
+            if entry <= heap[child]:
+                break
+            heap[position] = heap[child]
+            positions[heap[position][1]] = position
+            position = child
+        heap[position] = entry
+        positions[entry[1]] = position
+
+
+# The MaintenanceScheduler keeps the due date of every part of every vehicle in a PartRegistry (as a day number, see triplog.py).
+# The date is calculated with the MaintenanceMonitor's formula (see "PartRegistry.forecast()"), counted from the last day the vehicle
+# drove. A part that is already at or below its minimum condition is due on that day, and so is a part the formula gives 0 days:
+# these are the emergencies. Parts without a forecast (no wear or no trips yet), and parts the vehicle does not have, are not in the queue.
+# Only a trip on a new day changes the forecast of a vehicle (the formula uses the number of days with trips), so only then are its
+# parts moved in the queue, unless the parts wear with every kilometre: 'wear_per_km' can give the wear of every part, as one number
+# per part or one array per part with a number per vehicle (like the FleetShard).
+# Trips are expected in date order, like in the TripLog; a trip on a day before the vehicle's last trip day is counted, but does not
+# count as a new day.
+# When the conditions in the registry are changed from outside (e.g. by a MaintenanceMonitor that shares it), "reschedule()" must be
+# called for that vehicle.
+class MaintenanceScheduler:
+    infinity = float("inf")
+
+    def __init__(self, registry, active_days=None, last_days=None, wear_per_km=None):
+        self.registry = registry
+        count = registry.vehicle_count
+        self.active_days = array("q", [0]) * count if active_days is None else array("q", active_days)
+        self.last_day = array("q", [-1]) * count if last_days is None else array("q", last_days)
+        self.wear = wear_per_km
+        self.due = IndexedHeap()
+        # The parts that are emergencies, in the order they became one (a dictionary is used as an ordered set).
+        self.emergency_parts = {}
+        # The NearestStationTable of the service locations, kept for the next assignment: (key, table).
+        self.service_table = None
+        for vehicle in range(count):
+            self.reschedule(vehicle)
+
+    # Follows the trips of a RoutePlanner for one vehicle: the trips it has taken so far are counted, and every new trip is
+    # passed to "record_trip()".
+    def attach(self, vehicle, planner):
+        trip_log = planner.trips_taken
+        days = trip_log.day
+        self.active_days[vehicle] = len(set(days))
+        self.last_day[vehicle] = max(days) if len(days) else -1
+        self.reschedule(vehicle)
+        planner.subscribe_trips(lambda trip: self.record_trip(vehicle, trip.distance, trip.date))
+
+    # Counts a trip of a vehicle; 'date' is a date, or text in the TripLog's "dd/mm/YYYY" format (like Trip.date).
+    def record_trip(self, vehicle, distance, date):
+        if isinstance(date, str):
+            date = datetime.datetime.strptime(date, TripLog.date_format).date()
+        day = to_epoch_day(date)
+        changed = False
+        if day > self.last_day[vehicle]:
+            self.last_day[vehicle] = day
+            self.active_days[vehicle] += 1
+            changed = True
+        if self.wear is not None:
+            for part, wear in enumerate(self.wear):
+                self.registry.conditions[part][vehicle] -= (wear if isinstance(wear, (int, float)) else wear[vehicle]) * distance
+            changed = True
+        if changed:
+            self.reschedule(vehicle)
+
+    def set_condition(self, vehicle, part_name, new_condition):
+        self.registry.set_condition(part_name, new_condition, vehicle)
+        self.reschedule_part(vehicle, self.registry.index[part_name])
+
+    # Replaces a part of a vehicle (or all of its parts): its condition goes back to the maximum.
+    def service(self, vehicle, part_name=None):
+        registry = self.registry
+        parts = range(len(registry)) if part_name is None else [registry.index[part_name]]
+        for part in parts:
+            if not registry.fitted[part][vehicle]:
+                continue
+            registry.conditions[part][vehicle] = registry.max_conditions[part][vehicle]
+            self.reschedule_part(vehicle, part)
+
+    def reschedule(self, vehicle):
+        for part in range(len(self.registry)):
+            self.reschedule_part(vehicle, part)
+
+    # Calculates the due day of one part of one vehicle again and moves it in the queue: O(log n).
+    def reschedule_part(self, vehicle, part):
+        registry = self.registry
+        condition = registry.conditions[part][vehicle]
+        max_condition = registry.max_conditions[part][vehicle]
+        min_condition = registry.min_conditions[part][vehicle]
+        days_used = self.active_days[vehicle]
+        key = (vehicle, part)
+        if not registry.fitted[part][vehicle]:
+            days = self.infinity
+        elif condition <= min_condition:
+            days = 0
+        elif max_condition != condition and days_used != 0:
+            # The same formula as in "PartRegistry.forecast()".
+            days = int((condition - min_condition) / (days_used / (max_condition - condition)))
+        else:
+            days = self.infinity
+        if days == self.infinity:
+            self.due.remove(key)
+            self.emergency_parts.pop(key, None)
+            return
+        self.due.set(key, max(self.last_day[vehicle], 0) + days)
+        if days == 0:
+            self.emergency_parts[key] = True
+        else:
+            self.emergency_parts.pop(key, None)
+
+    # Returns the next 'count' services as (due date, vehicle, part name), the earliest first.
+    def next_due(self, count):
+        names = self.registry.names
+        services = []
+        for day, (vehicle, part) in self.due.ordered():
+            if len(services) == count:
+                break
+            services.append((from_epoch_day(day), vehicle, names[part]))
+        return services
+
+    # Returns every service due on or before 'date' as (due date, vehicle, part name), the earliest first.
+    def due_until(self, date):
+        names = self.registry.names
+        return [(from_epoch_day(day), vehicle, names[part]) for day, (vehicle, part) in self.due.ordered(to_epoch_day(date))]
+
+    # Returns every part that has to be replaced right away (or is due on the vehicle's last trip day) as (vehicle, part name),
+    # in the order they became emergencies.
+    def emergencies(self):
+        names = self.registry.names
+        return [(vehicle, names[part]) for vehicle, part in self.emergency_parts]
+
+    def has_emergency(self, vehicle):
+        return any((vehicle, part) in self.emergency_parts for part in range(len(self.registry)))
+
+    # Returns the vehicles with a service due on or before 'date' as (due date, vehicle), in order of their earliest service.
+    def due_vehicles(self, date):
+        vehicles = []
+        seen = set()
+        for day, (vehicle, part) in self.due.ordered(to_epoch_day(date)):
+            if vehicle not in seen:
+                seen.add(vehicle)
+                vehicles.append((from_epoch_day(day), vehicle))
+        return vehicles
+
+    # Sends every vehicle with a service due on or before 'date' to its nearest service location, using the roads of the
+    # RoutePlanner. 'vehicle_locations' gives the location name of every vehicle number (a list or a dictionary).
+    # The nearest service location of every location is read from a NearestStationTable over the service locations, which is
+    # built once and kept until the locations or the roads change. With a 'capacity', a location takes at most that many
+    # vehicles, and the vehicles that are due first choose first: a location that is full is removed from a table of this
+    # assignment, which only updates the locations that were nearest to it, so every vehicle is still a table read.
+    # Returns (vehicle, due date, service location, distance) in order of due date; the location is None when none can be reached.
+    def assign_service_locations(self, planner, vehicle_locations, service_locations, date, capacity=None):
+        graph = planner.compiled_graph
+        if capacity is None:
+            key = (id(graph), graph.version, frozenset(service_locations))
+            if self.service_table is None or self.service_table[0] != key:
+                self.service_table = (key, NearestStationTable(graph, service_locations))
+            table = self.service_table[1]
+        else:
+            table = NearestStationTable(graph, service_locations)
+
+        load = dict.fromkeys(service_locations, 0)
+        assignments = []
+        for due_date, vehicle in self.due_vehicles(date):
+            entry = table.lookup(vehicle_locations[vehicle])
+            if entry is None:
+                assignments.append((vehicle, due_date, None, self.infinity))
+                continue
+            station, distance, next_hop = entry
+            load[station] += 1
+            if capacity is not None and load[station] >= capacity:
+                table.remove_station(station)
+            assignments.append((vehicle, due_date, station, distance))
+        return assignments
+
+
+# --- TESTS ---
+# The below code was used to test the MaintenanceScheduler class.
+
+# from maintenancemonitor import PartRegistry
+# registry = PartRegistry(3)
+# registry.add_part("Heat Pump", 99.0, 100.0, 50.0)
+# registry.set_condition("Heat Pump", 40.0, 2)
+# scheduler = MaintenanceScheduler(registry)
+# scheduler.record_trip(0, 10, datetime.date(2023, 1, 1))
+# assert scheduler.emergencies() == [(2, "Heat Pump")] # PASSED
+# scheduler.service(2)
+# assert scheduler.emergencies() == [] # PASSED
+# assert scheduler.next_due(1) == [(datetime.date(2023, 1, 1) + datetime.timedelta(days=49), 0, "Heat Pump")] # PASSED
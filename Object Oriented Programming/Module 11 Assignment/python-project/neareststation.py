@@ -0,0 +1,161 @@
+import heapq
+from array import array
+
+# The NearestStationTable class stores, for every location in the graph, the nearest station, the distance to it and the next
+# location to drive to (next hop). It is built with one multi-source search that starts at all stations at once and follows the
+# roads backwards, so looking up the nearest station is a simple O(1) table read.
+# When a road changes or a station is added or removed, only the locations whose answer can change are updated.
+# Like the RouteCache, the table remembers the 'version' of the graph it was built for. The graph can be shared by several planners
+# (see RoutePlanner.for_vehicle), so a road may be changed without this table being told: the table is then built again before
+# it answers the next question.
+class NearestStationTable:
+    infinity = float("inf")
+
+    def __init__(self, compiled_graph, stations):
+        self.graph = compiled_graph
+        # The station ids; the EnergyRouter keeps a reference to this set, so it is only ever changed in place.
+        self.stations = set()
+        self.names = set()
+        self.rebuilds = 0
+        self.build(stations)
+
+    # Runs the multi-source search from all stations at once, for the current version of the graph.
+    def build(self, stations):
+        compiled_graph = self.graph
+        size = len(compiled_graph)
+        self.stations.clear()
+        self.names = set()
+        self.distance = [self.infinity] * size
+        self.station = array("q", [-1]) * size
+        self.next_hop = array("q", [-1]) * size
+        self.version = compiled_graph.version
+
+        queue = []
+        for name in stations:
+            if name in compiled_graph:
+                node = compiled_graph.node_id(name)
+                self.stations.add(node)
+                self.names.add(name)
+                self.distance[node] = 0
+                self.station[node] = node
+                queue.append((0, node))
+        heapq.heapify(queue)
+        self.propagate(queue)
+
+    # Builds the table again if the graph has changed since the table was last updated.
+    def check_version(self):
+        if self.version != self.graph.version:
+            self.build(list(self.names))
+            self.rebuilds += 1
+
+    # Returns the nearest station, the distance to it and the next hop for a location, or None if no station can be reached.
+    def lookup(self, name):
+        self.check_version()
+        node = self.graph.ids.get(name)
+        if node is None or self.station[node] == -1:
+            return None
+        names = self.graph.names
+        next_hop = self.next_hop[node]
+        return names[self.station[node]], self.distance[node], names[next_hop] if next_hop != -1 else None
+
+    # Dijkstra's algorithm over the roads in reverse direction. A location is only updated when a strictly shorter distance is found,
+    # which is what keeps the incremental updates limited to the affected region.
+    def propagate(self, queue):
+        graph = self.graph
+        reverse_offsets, reverse_sources, reverse_edges = graph.reverse_offsets, graph.reverse_sources, graph.reverse_edges
+        distance, station, next_hop = self.distance, self.station, self.next_hop
+        while queue:
+            node_distance, node = heapq.heappop(queue)
+            if node_distance > distance[node]:
+                continue
+            weights = graph.weights
+            for index in range(reverse_offsets[node], reverse_offsets[node + 1]):
+                source = reverse_sources[index]
+                new_distance = node_distance + weights[reverse_edges[index]]
+                if new_distance < distance[source]:
+                    distance[source] = new_distance
+                    station[source] = station[node]
+                    next_hop[source] = node
+                    heapq.heappush(queue, (new_distance, source))
+
+    def add_station(self, name):
+        self.check_version()
+        node = self.graph.node_id(name)
+        if node in self.stations:
+            return
+        self.stations.add(node)
+        self.names.add(name)
+        self.distance[node] = 0
+        self.station[node] = node
+        self.next_hop[node] = -1
+        self.propagate([(0, node)])
+
+    def remove_station(self, name):
+        self.check_version()
+        node = self.graph.node_id(name)
+        if node not in self.stations:
+            return
+        self.stations.remove(node)
+        self.names.remove(name)
+        self.repair(self.subtree(node))
+
+    # Must be called right after the distance of the road from 'origin' to 'destination' has changed in the compiled graph. If the
+    # graph was changed in any other way in between, the table cannot be repaired and is built again by the next "lookup()" instead.
+    def update_road(self, origin, destination, old_distance, new_distance):
+        if self.version != self.graph.version - 1:
+            return
+        self.version = self.graph.version
+        source = self.graph.node_id(origin)
+        target = self.graph.node_id(destination)
+        if new_distance < old_distance:
+            if self.distance[target] + new_distance < self.distance[source]:
+                self.distance[source] = self.distance[target] + new_distance
+                self.station[source] = self.station[target]
+                self.next_hop[source] = target
+                self.propagate([(self.distance[source], source)])
+        elif new_distance > old_distance and self.next_hop[source] == target:
+            self.repair(self.subtree(source))
+
+    # Returns all locations whose route to their nearest station passes through 'root' (including 'root' itself).
+    def subtree(self, root):
+        graph = self.graph
+        affected = {root}
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            for index in range(graph.reverse_offsets[node], graph.reverse_offsets[node + 1]):
+                source = graph.reverse_sources[index]
+                if self.next_hop[source] == node and source not in affected:
+                    affected.add(source)
+                    stack.append(source)
+        return affected
+
+    # Forgets the answers of the affected locations, restarts them from their unaffected neighbours and runs the search again
+    # on that region only.
+    def repair(self, affected):
+        graph = self.graph
+        for node in affected:
+            self.distance[node] = self.infinity
+            self.station[node] = -1
+            self.next_hop[node] = -1
+
+        queue = []
+        for node in affected:
+            if node in self.stations:
+                self.distance[node] = 0
+                self.station[node] = node
+                queue.append((0, node))
+                continue
+            for edge in range(graph.offsets[node], graph.offsets[node + 1]):
+                target = graph.targets[edge]
+                if target in affected:
+                    continue
+                new_distance = self.distance[target] + graph.weights[edge]
+                if new_distance < self.distance[node]:
+                    self.distance[node] = new_distance
+                    self.station[node] = self.station[target]
+                    self.next_hop[node] = target
+            if self.distance[node] != self.infinity:
+                queue.append((self.distance[node], node))
+        heapq.heapify(queue)
+        self.propagate(queue)
@@ -0,0 +1,69 @@
+from collections import OrderedDict
+
+from routingengine import SearchTree
+
+# The RouteCache class keeps the search trees of the most recently used origins, so that repeated trips from the same place
+# (e.g. depot -> mall and depot -> home) do not start the search from scratch. It is a least recently used (LRU) cache:
+# when it is full, the origin that has not been used for the longest time is removed.
+# The cache remembers the version of the graph it was filled with. When it is told about a changed road (see "update_edge()"),
+# the cached trees are repaired; any other change to the graph empties the cache.
+class RouteCache:
+    infinity = float("inf")
+
+    def __init__(self, compiled_graph, size=128):
+        self.graph = compiled_graph
+        self.size = size
+        self.trees = OrderedDict()
+        self.version = compiled_graph.version
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.repairs = 0
+
+    # Returns the search tree for an origin id, creating it if necessary.
+    def get_tree(self, source):
+        if self.version != self.graph.version:
+            self.clear()
+            self.version = self.graph.version
+            self.invalidations += 1
+
+        tree = self.trees.get(source)
+        if tree is not None:
+            self.hits += 1
+            self.trees.move_to_end(source)
+            return tree
+
+        self.misses += 1
+        tree = SearchTree(self.graph, source)
+        if self.size > 0:
+            self.trees[source] = tree
+            if len(self.trees) > self.size:
+                self.trees.popitem(last=False)
+                self.evictions += 1
+        return tree
+
+    # Same result as RoutingEngine.shortest_path, but the search tree of the origin is reused between calls.
+    def shortest_path(self, origin, destination):
+        source = self.graph.ids.get(origin)
+        target = self.graph.ids.get(destination)
+        if source is None or target is None:
+            return self.infinity, None
+        return self.get_tree(source).route_to(target)
+
+    # Must be called right after the distance of a road has changed in the compiled graph. If the graph was changed in any other
+    # way in between, the trees cannot be repaired and the cache is emptied by the next "get_tree()" instead.
+    def update_edge(self, source, target, old_distance, new_distance):
+        if self.version != self.graph.version - 1:
+            return
+        for tree in self.trees.values():
+            tree.update_edge(source, target, old_distance, new_distance)
+        self.version = self.graph.version
+        self.repairs += 1
+
+    def clear(self):
+        self.trees.clear()
+
+    def stats(self):
+        return {"size": self.size, "entries": len(self.trees), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "invalidations": self.invalidations, "repairs": self.repairs}
@@ -1,17 +1,21 @@
-import datetime
-from data import graph
-from energymonitor import energy_monitor, main_battery
-
-# Every trip taken by the car is stored as an instance of the class below.
-class Trip:
-
-    def __init__(self, name, distance, date):
-        self.name = name
-        self.distance = distance
-        self.date = date
-    
-# This class was part of my original design, but I have not made use of it in this code, due to the implementation
-# of Dijkstra's algorithm.
+import bisect
+import copy
+import os
+from array import array
+from collections.abc import Mapping
+import data
+from alternativeroutes import KShortestPaths
+from energymonitor import Battery, EnergyMonitor
+from energyrouting import EnergyRouter
+from compiledgraph import CompiledGraph
+from contraction import ContractionHierarchy
+from neareststation import NearestStationTable
+from routecache import RouteCache
+from routingengine import RoutingEngine, init_worker, worker_distance_rows
+from triplog import Trip, TripLog
+
+# Every location with known coordinates is represented by an instance of this class. The RoutePlanner attaches them to the
+# compiled graph, where the A* search uses them to estimate the remaining distance to the destination.
 class Location:
 
     def __init__(self, name, lat_coord, long_coord):
@@ -28,12 +32,107 @@ class Location:
     
 
 # Besides the UserInterface, the RoutePlanner class is the main operation.
-class RoutePlanner:
-    trips_taken = {}
+# The result of RoutePlanner.reachable_locations: a read-only dictionary {name: (distance, battery level left on arrival)}
+# of the locations a vehicle can reach, closest first. Vehicles at the same origin share one list of the locations found by the
+# search ('distances' and 'nodes', sorted by distance), of which every vehicle can reach the first 'count'. The battery level
+# left is only calculated when it is read, so a batch for many vehicles takes very little time and memory.
+class ReachableLocations(Mapping):
+
+    def __init__(self, compiled_graph, distances, nodes, count, battery_level, energy_monitor):
+        self.graph = compiled_graph
+        self.distances = distances
+        self.nodes = nodes
+        self.count = count
+        self.battery_level = battery_level
+        self.energy_monitor = energy_monitor
+        self.positions = None
+
+    def entry(self, position):
+        distance = self.distances[position]
+        return self.graph.present_distance(distance), self.energy_monitor.remaining_level(self.battery_level, distance)
+
+    def __getitem__(self, name):
+        # The position of every location is only looked up when the first location is read by name.
+        if self.positions is None:
+            self.positions = {node: position for position, node in zip(range(self.count), self.nodes)}
+        position = self.positions.get(self.graph.ids.get(name))
+        if position is None:
+            raise KeyError(name)
+        return self.entry(position)
+
+    def __iter__(self):
+        names = self.graph.names
+        return (names[node] for node in self.nodes[:self.count])
+
+    def __len__(self):
+        return self.count
+
+    def items(self):
+        names = self.graph.names
+        return [(names[self.nodes[position]], self.entry(position)) for position in range(self.count)]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
 
-    # RoutePlanner is initialized with a copy of the graph dictionary, to avoid manipulation of the original.
-    def __init__(self, roads):
-        self.original_graph = roads.copy()
+class RoutePlanner:
+    # "distance_matrix()" only starts worker processes for at least this many searched locations (origins x locations of the map).
+    # Starting the pool costs about 0.2 to 0.7 seconds with a map of 100,000 locations, and one origin takes about 0.8 seconds
+    # on its own (python benchmark.py matrix), so the pool can only win once the work takes several seconds.
+    matrix_pool_min_work = 1000000
+
+    # RoutePlanner is initialized with the graph dictionary, which is compiled once into a CompiledGraph.
+    # The original dictionary is never manipulated, and the RoutingEngine searches the compiled version without copying it.
+    # A CompiledGraph can also be passed in directly, so that several planners can share one compiled graph.
+    # The nearest charging station of every location is precomputed once in the 'station_table', and the search trees of the
+    # most recently used origins are kept in the 'route_cache' ('cache_size' origins at most, 0 turns the cache off).
+    # 'stations' and 'locations' default to the charging stations and coordinates from data.py. A compiled graph that is passed in
+    # may be shared with other planners, so the coordinates are only attached to it when 'locations' is given, or when the graph
+    # has none yet.
+    # Trips are recorded in a new in-memory TripLog, unless a 'trip_log' is given (e.g. TripLog("trips.journal") to keep
+    # the history on disk).
+    # Every planner drives its own 'battery', checked by its own 'energy_monitor', unless they are passed in (see app.py).
+    # 'algorithm' selects the search used for routes: "dijkstra" (default), "astar", which needs coordinates for every location,
+    # "ch", which needs a contraction hierarchy (see "use_hierarchy()"), or "sharded", which sends the searches to the worker
+    # processes of a ShardedRouter (see "use_shards()").
+    def __init__(self, roads, stations=None, cache_size=128, locations=None, algorithm="dijkstra", trip_log=None, battery=None,
+                 energy_monitor=None):
+        if stations is None:
+            stations = data.charging_stations
+        attach_coordinates = locations is not None
+        if locations is None:
+            locations = data.coordinates
+        self.original_graph = roads
+        self.trips_taken = TripLog() if trip_log is None else trip_log
+        self.battery = Battery(Battery.total_capacity) if battery is None else battery
+        self.energy_monitor = EnergyMonitor() if energy_monitor is None else energy_monitor
+        if isinstance(roads, CompiledGraph):
+            self.compiled_graph = roads
+        else:
+            self.compiled_graph = CompiledGraph(roads)
+        self.engine = RoutingEngine(self.compiled_graph)
+        self.station_table = NearestStationTable(self.compiled_graph, stations)
+        self.route_cache = RouteCache(self.compiled_graph, cache_size)
+        self.locations = {name: Location(name, lat, long) for name, (lat, long) in locations.items()}
+        if attach_coordinates or not self.compiled_graph.has_coordinates():
+            self.compiled_graph.set_coordinates(self.locations)
+        self.algorithm = algorithm
+        self.hierarchy = None
+        self.sharded_router = None
+        # Distances of the roads closed with "close_road()", to restore when they are reopened.
+        self.closed_roads = {}
+        self.energy_router = EnergyRouter(self.compiled_graph, self.station_table.stations, self.energy_monitor.usage_per_kilometer,
+                                          self.energy_monitor.min_battery, Battery.total_capacity)
+
+    # Returns a planner for another car on the same map. The graph and everything built from it (the routing engine, station
+    # table, route cache, energy router, hierarchy and shards) are shared with this planner and not built again; only the trips,
+    # battery and energy monitor belong to the new car.
+    def for_vehicle(self, trip_log=None, battery=None, energy_monitor=None):
+        planner = copy.copy(self)
+        planner.trips_taken = TripLog() if trip_log is None else trip_log
+        planner.battery = Battery(Battery.total_capacity) if battery is None else battery
+        planner.energy_monitor = EnergyMonitor() if energy_monitor is None else energy_monitor
+        return planner
 
     def get_destination(self):
         return input("Where would you like to travel?: ")
@@ -41,127 +140,284 @@ class RoutePlanner:
     def get_origin(self, car):
         return car.get_current_location()
 
+    def get_location(self, name):
+        return self.locations.get(name)
+
+    # Loads a contraction hierarchy that was built offline with "build_hierarchy()" and switches to the "ch" algorithm.
+    def use_hierarchy(self, path):
+        self.hierarchy = ContractionHierarchy.load(path, self.compiled_graph)
+        self.algorithm = "ch"
+
+    # Builds a contraction hierarchy for the planner's graph and saves it to disk. This can take a long time on large maps.
+    def build_hierarchy(self, path):
+        self.hierarchy = ContractionHierarchy.build(self.compiled_graph)
+        self.hierarchy.save(path)
+
+    # Divides the map into regions served by worker processes (one per core by default), or by the workers at 'addresses',
+    # and switches to the "sharded" algorithm. See shardedrouting.py.
+    def use_shards(self, shard_count=None, addresses=None, authkey=None):
+        # Imported here, as most planners never start worker processes.
+        from shardedrouting import ShardedRouter
+        if self.sharded_router is not None:
+            self.sharded_router.close()
+        self.sharded_router = ShardedRouter(self.compiled_graph, shard_count, addresses, authkey)
+        self.algorithm = "sharded"
+
+    # Finds the shortest route with the selected algorithm. Dijkstra searches are kept in the 'route_cache', so a later
+    # trip from the same origin can continue where it left off. A contraction hierarchy is no longer correct once a road has
+    # changed, so Dijkstra's algorithm is used until a new one has been built. The same goes for the shards when a road was changed
+    # by another planner that shares the graph, as only this planner passes its changes on to the workers.
+    # On a map with whole-number distances the distance is an integer, also while a road is closed (see CompiledGraph.present_distance).
+    def find_route(self, origin, destination):
+        if self.algorithm == "astar":
+            distance, route = self.engine.astar_path(origin, destination)
+        elif self.algorithm == "ch" and self.hierarchy is not None and self.hierarchy.is_current():
+            distance, route = self.hierarchy.shortest_path(origin, destination)
+        elif (self.algorithm == "sharded" and self.sharded_router is not None
+              and self.sharded_router.version == self.compiled_graph.version):
+            distance, route = self.sharded_router.shortest_path(origin, destination)
+        else:
+            distance, route = self.route_cache.shortest_path(origin, destination)
+        return self.compiled_graph.present_distance(distance), route
+
     # Method based on Dijkstra's algorithm to find the shortest route between origin and destination, based on the 'graph' dictionary.
-    # When the shortest route has been found and the EnergyMonitor has approved the route, the trip is added ot the 'trips_taken' dictionary.
-    # This dictionary is the main source of data for the MaintenanceMonitor class.
+    # The search uses a priority queue and stops once the destination is reached (see "find_route()").
+    # Only the search is cached; the battery is checked on every call.
+    # When the shortest route has been found and the EnergyMonitor has approved the route, the trip is added ot the 'trips_taken' TripLog.
+    # This log is the main source of data for the MaintenanceMonitor class.
     def calculate_route(self, graph, origin, destination):
-        unvisited_nodes = self.original_graph.copy()
-        # Variable representing infinity is created. This is part of Dijkstra's algorithm. The original distance between nodes is represented as infinity.
-        infinity = float("inf")
-        distances = {}
-        route = []
-        path = {}
-
-        for nodes in unvisited_nodes:
-            #print(nodes)
-            distances[nodes] = infinity
-        distances[origin] = 0
-
-        while unvisited_nodes:
-            min_node = min(unvisited_nodes, key=distances.get)
-            for node, value in unvisited_nodes[min_node].items():
-                #print(node)
-                if value + distances[min_node] < distances[node]:
-                    distances[node] = value + distances[min_node]
-                    path[node] = min_node
-            unvisited_nodes.pop(min_node)
-        node = destination
-
-        while node != origin:
-            try:
-                route.insert(0, node)
-                node = path[node]
-            except Exception:
-                print("Cannot reach destination!")
-                break
-        route.insert(0, origin)
-
-        if distances[destination] != infinity:
-            approval = self.check_battery(distances[destination])
-            if approval:
-                trip_num = 1
-                while "Trip{}".format(trip_num) in self.trips_taken:
-                    trip_num += 1
-                trip_name = "Trip{}".format(trip_num)
-                trip_date = datetime.datetime.now().strftime("%d/%m/%Y")
-                trip_distance = distances[destination]
-                trip = Trip(trip_name, trip_distance, trip_date)
-                self.trips_taken[trip_name] = {'km': trip.distance, 'date': trip.date}
-            return distances[destination], route, approval
+        distance, route = self.find_route(origin, destination)
+        return self.complete_route(origin, destination, distance, route)
+
+    # Checks the battery for a route that has already been found (e.g. by a worker process of the RoutingService) and records the trip.
+    def complete_route(self, origin, destination, distance, route):
+        if route is None:
+            print("Cannot reach destination!")
+            return None
+        distance = self.compiled_graph.present_distance(distance)
+
+        approval = self.check_battery(distance)
+        if approval:
+            self.record_trip(distance, origin, destination)
+        return distance, route, approval
+
+    # Adds a trip to the 'trips_taken' log, which passes it on to every subscriber.
+    def record_trip(self, distance, origin, destination):
+        return self.trips_taken.append(distance, origin, destination)
+
+    # Registers a function that is called with every new trip, e.g. by the MaintenanceMonitor to keep its totals up to date.
+    def subscribe_trips(self, subscriber):
+        self.trips_taken.subscribe(subscriber)
     
-    # This method also uses Dijkstra's algorithm to calculate the route to the nearest charging station.
+    # Plans the shortest route the car can complete with its current battery level, including any charging stops, in a single search
+    # (see EnergyRouter). The car then drives every leg between charging stops: the battery is checked for each leg and charged to
+    # full at every stop, and the whole route is recorded as one trip. Returns the distance, the route and the charging stops.
+    def calculate_route_with_charging(self, graph, origin, destination):
+        distance, route, charging_stops = self.energy_router.plan(origin, destination, self.battery.get_current_level())
+        return self.complete_charging_route(origin, destination, distance, route, charging_stops)
+
+    # Drives a route with charging stops that has already been planned, see "calculate_route_with_charging()".
+    # Like in "complete_route()", the trip is only recorded when the battery approves it: if a leg cannot be driven (e.g. the
+    # battery was used for another trip after the route was planned), nothing is recorded, the battery is set back to the level it
+    # had before the first leg, and None is returned.
+    def complete_charging_route(self, origin, destination, distance, route, charging_stops):
+        if route is None:
+            print("Cannot reach destination, even with charging stops!")
+            return None
+        distance = self.compiled_graph.present_distance(distance)
+
+        start_level = self.battery.get_current_level()
+        leg_distance = 0
+        stops = set(charging_stops)
+        if origin in stops:
+            self.battery.set_current_level(Battery.total_capacity)
+        for start, end in zip(route, route[1:]):
+            leg_distance += self.compiled_graph.get_weight(start, end)
+            if end in stops or end == destination:
+                if not self.check_battery(leg_distance):
+                    print("The car cannot drive the leg to {} ({} km). Please contact roadside assistance.".format(end, self.compiled_graph.present_distance(leg_distance)))
+                    self.battery.set_current_level(start_level)
+                    return None
+                leg_distance = 0
+                if end in stops:
+                    self.battery.set_current_level(Battery.total_capacity)
+        self.record_trip(distance, origin, destination)
+        return distance, route, charging_stops
+
+    # This method also uses "find_route()" to calculate the route to a charging station.
     def calculate_charging(self, graph, origin, destination):
-        unvisited_nodes = self.original_graph.copy()
-        infinity = float("inf")
-        distances = {}
-        route = []
-        path = {}
-
-        for nodes in unvisited_nodes:
-            #print(nodes)
-            distances[nodes] = infinity
-        distances[origin] = 0
-
-        while unvisited_nodes:
-            min_node = min(unvisited_nodes, key=distances.get)
-            for node, value in unvisited_nodes[min_node].items():
-                #print(node)
-                if value + distances[min_node] < distances[node]:
-                    distances[node] = value + distances[min_node]
-                    path[node] = min_node
-            unvisited_nodes.pop(min_node)
-        node = destination
-
-        while node != origin:
-            try:
-                route.insert(0, node)
-                node = path[node]
-            except Exception:
-                print("Cannot reach destination!")
-                break
-        route.insert(0, origin)
-
-        return distances[destination], route
-
-    # This method uses the "calculate_route()" and "calculate_charging()" methods to either tell the user to charge the car,
+        distance, route = self.find_route(origin, destination)
+        if route is None:
+            print("Cannot reach destination!")
+        return distance, route
+
+    # This method finds the nearest charging station and then uses the "calculate_route()" method to either tell the user to charge the car,
     # or move the car to the nearest charging station automatically.
-    def suggest_charging(self, graph, origin, charging_stations):
-        nearest_station = None
-        smallest_distance = float("inf")
-        for station in charging_stations:
-            if origin in charging_stations:
-                return "You are next to a charging station. Charge your car before travelling to your desired location!"
-            distance, route = self.calculate_charging(graph, origin, station)
-            if distance < smallest_distance:
-                smallest_distance = distance
-                nearest_station = station
-            else:
-                pass
+    # If no list of stations is given, or the list matches the planner's own stations, the answer is read from the precomputed 'station_table'.
+    # Otherwise a single search from the origin is run, which stops at the first station it reaches.
+    def suggest_charging(self, graph, origin, charging_stations=None):
+        if charging_stations is None:
+            stations = self.station_table.names
+            use_table = True
+        else:
+            stations = set(charging_stations)
+            use_table = stations == self.station_table.names
+        if origin in stations:
+            return "You are next to a charging station. Charge your car before travelling to your desired location!"
+        if use_table:
+            nearest_station, smallest_distance, next_hop = self.station_table.lookup(origin) or (None, float("inf"), None)
+        else:
+            smallest_distance, route, nearest_station = self.engine.nearest(origin, stations)
+        smallest_distance = self.compiled_graph.present_distance(smallest_distance)
         charging_approval = self.check_battery(smallest_distance)
         if charging_approval:
             self.calculate_route(graph, origin, nearest_station)
-            main_battery.set_current_level(75)
+            self.battery.set_current_level(Battery.total_capacity)
             return "Your car needs to be charged and will be travelling to {}, which is {} km away from here.".format(nearest_station, smallest_distance)
         else:
             return "Your car needs to be charged, but no station is reachable at the moment. Please contact roadside assistance."
         
 
     def check_battery(self, distance):
-        if energy_monitor.route_approval(main_battery, distance):
+        if self.energy_monitor.route_approval(self.battery, distance):
             return True
         else:
             return False
     
+    # Returns up to 'k' of the shortest routes from origin to destination that never pass the same location twice, as a list of
+    # (distance, route), shortest first (see alternativeroutes.py). Like "reachable_locations()", nothing is recorded and the
+    # battery is not used, so the caller can offer the next route when the first one is not wanted.
+    def alternative_routes(self, origin, destination, k=3):
+        ids = self.compiled_graph.ids
+        if origin not in ids or destination not in ids:
+            return []
+        routes = KShortestPaths(self.compiled_graph, ids[origin], ids[destination]).shortest_routes(k)
+        return [(self.compiled_graph.present_distance(distance), route) for distance, route in routes]
+
+    # Answers "where can the car get to right now?": returns every location that can be reached from 'origin' without charging,
+    # as a ReachableLocations dictionary {name: (distance, battery level left on arrival)}, closest first. Unlike "calculate_route()",
+    # nothing is recorded and the battery is not used. 'battery_level' defaults to the level of the planner's battery.
+    # A single search is run, which stops at the car's range (see EnergyMonitor.calculate_range), and is kept in the 'route_cache'.
+    def reachable_locations(self, origin, battery_level=None):
+        if battery_level is None:
+            battery_level = self.battery.get_current_level()
+        return self.reachable_locations_batch([origin], [battery_level])[0]
+
+    # Batch version of "reachable_locations()" for a list of vehicles, given as their origins and battery levels (e.g. the levels
+    # of a FleetBattery). Vehicles at the same origin share one search, which runs as far as the vehicle with the longest range.
+    def reachable_locations_batch(self, origins, battery_levels):
+        energy_monitor = self.energy_monitor
+        ranges = {}
+        for origin, battery_level in zip(origins, battery_levels):
+            ranges[origin] = max(ranges.get(origin, -1), energy_monitor.calculate_range(battery_level))
+
+        reachable = {}
+        for origin, max_range in ranges.items():
+            source = self.compiled_graph.ids.get(origin)
+            if source is None or max_range < 0:
+                reachable[origin] = ([], [])
+                continue
+            tree = self.route_cache.get_tree(source)
+            tree.expand_within(max_range)
+            by_distance = tree.visited_by_distance()
+            reachable[origin] = ([distance for distance, node in by_distance], [node for distance, node in by_distance])
+
+        results = []
+        for origin, battery_level in zip(origins, battery_levels):
+            distances, nodes = reachable[origin]
+            count = bisect.bisect_right(distances, energy_monitor.calculate_range(battery_level))
+            # The range is calculated with a division, so the last few locations are checked the same way as "route_approval()".
+            while count > 0 and energy_monitor.remaining_level(battery_level, distances[count - 1]) is None:
+                count -= 1
+            while count < len(distances) and energy_monitor.remaining_level(battery_level, distances[count]) is not None:
+                count += 1
+            results.append(ReachableLocations(self.compiled_graph, distances, nodes, count, battery_level, energy_monitor))
+        return results
+
+    # Returns the distances from every origin to every destination as a matrix (a list of rows), e.g. for dispatching vehicles.
+    # Unlike "calculate_route()", this does not use the battery or record any trips. Every distinct origin is searched only once,
+    # The searches run in this process by default. With 'processes' greater than 1 the origins are divided between several worker
+    # processes, but only when the computer has more than one core and the matrix is large enough (see 'matrix_pool_min_work');
+    # otherwise starting the workers takes longer than they save.
+    def distance_matrix(self, origins, destinations, processes=1):
+        ids = self.compiled_graph.ids
+        unique_origins = list(dict.fromkeys(origins))
+        sources = [ids[origin] for origin in unique_origins]
+        targets = [ids[destination] for destination in destinations]
+
+        processes = min(processes, os.cpu_count() or 1, len(sources))
+        if processes > 1 and len(sources) * len(self.compiled_graph) >= self.matrix_pool_min_work:
+            # Imported here, as loading the multiprocessing modules takes longer than importing the rest of the planner.
+            from concurrent.futures import ProcessPoolExecutor
+            chunk_size = max(1, len(sources) // (processes * 4))
+            chunks = [sources[start:start + chunk_size] for start in range(0, len(sources), chunk_size)]
+            with ProcessPoolExecutor(processes, initializer=init_worker, initargs=(self.compiled_graph,)) as pool:
+                rows = [row for chunk_rows in pool.map(worker_distance_rows, chunks, [targets] * len(chunks)) for row in chunk_rows]
+        else:
+            rows = self.engine.distance_rows(sources, targets)
+
+        # Repeated origins get a copy of the row, so that changing one row never changes another.
+        row_of = dict(zip(unique_origins, rows))
+        matrix = []
+        used = set()
+        for origin in origins:
+            matrix.append(array("d", row_of[origin]) if origin in used else row_of[origin])
+            used.add(origin)
+        return matrix
+
+    # Changes the distance of a road at runtime, e.g. because of traffic or roadworks, and returns the old distance.
+    # Nothing is rebuilt: the cached search trees and the nearest charging stations are repaired for the affected locations only.
+    # Other planners on the same graph notice the change by its version: their route cache and station table (unless they share
+    # this planner's, see "for_vehicle()") start again, and their hierarchy and shards are no longer used.
+    def update_road(self, origin, destination, distance):
+        old_distance = self.compiled_graph.set_weight(origin, destination, distance)
+        self.closed_roads.pop((origin, destination), None)
+        self.route_cache.update_edge(self.compiled_graph.node_id(origin), self.compiled_graph.node_id(destination), old_distance, distance)
+        self.station_table.update_road(origin, destination, old_distance, distance)
+        if self.sharded_router is not None:
+            self.sharded_router.update_road(origin, destination, distance)
+        return old_distance
+
+    # Applies a list of (origin, destination, distance) changes, e.g. one message of a live traffic feed.
+    def update_roads(self, changes):
+        for origin, destination, distance in changes:
+            self.update_road(origin, destination, distance)
+
+    # A closed road is given an infinite distance, so no route uses it until it is reopened with its old distance.
+    def close_road(self, origin, destination):
+        if (origin, destination) not in self.closed_roads:
+            old_distance = self.update_road(origin, destination, float("inf"))
+            self.closed_roads[(origin, destination)] = old_distance
+
+    def reopen_road(self, origin, destination):
+        if (origin, destination) in self.closed_roads:
+            self.update_road(origin, destination, self.closed_roads[(origin, destination)])
+
+    def add_charging_station(self, name):
+        self.station_table.add_station(name)
+
+    def remove_charging_station(self, name):
+        self.station_table.remove_station(name)
+
     def get_trips(self):
         return self.trips_taken
 
-route_planner = RoutePlanner(graph)
+
+# 'route_planner' used to be created here when the module was imported. It now belongs to the default AppContext (see app.py).
+# 'graph', 'charging_stations' and 'coordinates' are passed on from data.py, where they are loaded when first used.
+def __getattr__(name):
+    if name == "route_planner":
+        from app import default_context
+        return default_context().route_planner
+    if name in ("graph", "charging_stations", "coordinates"):
+        return getattr(data, name)
+    raise AttributeError("module 'routeplanner' has no attribute '{}'".format(name))
 
 
 
         
 # ---  GENERAL TESTS ---
-# The below code was used to test the Route Planner class. To avoid circular imports, I have initialized a version of the class to be used in other files.
+# The below code was used to test the Route Planner class. The instance used in other files is 'route_planner' from the default AppContext.
 
 
 
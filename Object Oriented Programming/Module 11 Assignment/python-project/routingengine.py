@@ -0,0 +1,312 @@
+import heapq
+from array import array
+
+
+# Walks back from the target to the source using the 'path' dictionary filled in by a search,
+# and returns the route as a list of location names.
+def build_route(compiled_graph, path, source, target):
+    names = compiled_graph.names
+    route = [names[target]]
+    node = target
+    while node != source:
+        node = path[node]
+        route.append(names[node])
+    route.reverse()
+    return route
+
+
+# A SearchTree holds the state of Dijkstra's algorithm from one origin: the distances found so far, the 'path' dictionary used to
+# rebuild routes, the visited locations and the priority queue. The search only runs as far as it has to, and can be continued
+# later when a location further away is asked for, which is what makes it worth keeping in the RouteCache.
+# When the distance of a road changes, "update_edge()" repairs the tree instead of throwing it away: only the locations whose
+# distance can change are "reopened" (taken out of 'visited' and put back in the queue) and searched again.
+class SearchTree:
+    infinity = float("inf")
+
+    def __init__(self, compiled_graph, source):
+        self.graph = compiled_graph
+        self.source = source
+        self.distances = {source: 0}
+        self.path = {}
+        self.visited = set()
+        self.queue = [(0, source)]
+        self.radius = 0
+
+    # Continues the search until one of the 'goals' (a set of location ids) has been visited, and returns it.
+    # Returns None if none of the goals can be reached.
+    def grow(self, goals):
+        reached = [goal for goal in goals if goal in self.visited]
+        if reached:
+            return min(reached, key=self.distances.get)
+        return self.expand(goals)
+
+    # Runs the search until a location out of 'goals' that has not been visited yet is visited.
+    def expand(self, goals):
+        offsets, targets, weights = self.graph.offsets, self.graph.targets, self.graph.weights
+        distances, path, visited, queue = self.distances, self.path, self.visited, self.queue
+        while queue:
+            distance, min_node = heapq.heappop(queue)
+            # Entries are outdated when a shorter distance was found later, or when the location was reopened by "update_edge()".
+            if min_node in visited or distance != distances.get(min_node):
+                continue
+            visited.add(min_node)
+            self.radius = distance
+            for edge in range(offsets[min_node], offsets[min_node + 1]):
+                node = targets[edge]
+                new_distance = distance + weights[edge]
+                if new_distance < distances.get(node, self.infinity):
+                    distances[node] = new_distance
+                    path[node] = min_node
+                    heapq.heappush(queue, (new_distance, node))
+            if min_node in goals:
+                return min_node
+        return None
+
+    # Continues the search until every location at most 'limit' away has been visited (used for reachability queries).
+    def expand_within(self, limit):
+        offsets, targets, weights = self.graph.offsets, self.graph.targets, self.graph.weights
+        distances, path, visited, queue = self.distances, self.path, self.visited, self.queue
+        while queue and queue[0][0] <= limit:
+            distance, min_node = heapq.heappop(queue)
+            if min_node in visited or distance != distances.get(min_node):
+                continue
+            visited.add(min_node)
+            self.radius = distance
+            for edge in range(offsets[min_node], offsets[min_node + 1]):
+                node = targets[edge]
+                new_distance = distance + weights[edge]
+                if new_distance < distances.get(node, self.infinity):
+                    distances[node] = new_distance
+                    path[node] = min_node
+                    heapq.heappush(queue, (new_distance, node))
+
+    # Returns the visited locations as a list of (distance, id) tuples, sorted by distance.
+    def visited_by_distance(self):
+        distances = self.distances
+        return sorted((distances[node], node) for node in self.visited)
+
+    # Repairs the tree after the distance of the road from 'source' to 'target' (location ids) has changed in the graph.
+    # A road leaving a location that has not been visited yet has not been used, so nothing needs to be done.
+    # - Longer road: only the locations reached through this road (the subtree below 'target') are reopened.
+    # - Shorter road: only 'target' is given its new distance; the locations that get closer through it are found by "settle()".
+    def update_edge(self, source, target, old_distance, new_distance):
+        if source not in self.visited:
+            return
+        if new_distance < old_distance:
+            distance = self.distances[source] + new_distance
+            if distance < self.distances.get(target, self.infinity):
+                self.distances[target] = distance
+                self.path[target] = source
+                self.visited.discard(target)
+                heapq.heappush(self.queue, (distance, target))
+        elif new_distance > old_distance and self.path.get(target) == source:
+            self.reopen(self.subtree(target))
+        self.settle()
+
+    # Returns 'root' and every location whose route in the tree passes through it (visited or not).
+    def subtree(self, root):
+        offsets, targets = self.graph.offsets, self.graph.targets
+        nodes = {root}
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            for edge in range(offsets[node], offsets[node + 1]):
+                child = targets[edge]
+                if self.path.get(child) == node and child not in nodes:
+                    nodes.add(child)
+                    stack.append(child)
+        return nodes
+
+    # Takes the given locations out of the tree and gives them the best distance through the locations that are still visited.
+    def reopen(self, nodes):
+        graph = self.graph
+        distances, path, visited = self.distances, self.path, self.visited
+        visited -= nodes
+        for node in nodes:
+            distances.pop(node, None)
+            path.pop(node, None)
+
+        weights = graph.weights
+        for node in nodes:
+            best = self.infinity
+            for index in range(graph.reverse_offsets[node], graph.reverse_offsets[node + 1]):
+                parent = graph.reverse_sources[index]
+                if parent in visited and distances[parent] + weights[graph.reverse_edges[index]] < best:
+                    best = distances[parent] + weights[graph.reverse_edges[index]]
+                    path[node] = parent
+            if best != self.infinity:
+                distances[node] = best
+                heapq.heappush(self.queue, (best, node))
+
+    # Dijkstra's algorithm visits the locations in order of distance, so every visited location is at most 'radius' away and
+    # every location in the queue at least 'radius'. After a repair, the queue can hold locations that are closer than 'radius':
+    # they are visited again here (a visited location that gets closer is visited once more), until the rule holds again.
+    # Returns the number of locations that were visited.
+    def settle(self):
+        offsets, targets, weights = self.graph.offsets, self.graph.targets, self.graph.weights
+        distances, path, visited, queue = self.distances, self.path, self.visited, self.queue
+        settled = 0
+        while queue and queue[0][0] < self.radius:
+            distance, min_node = heapq.heappop(queue)
+            if min_node in visited or distance != distances.get(min_node):
+                continue
+            visited.add(min_node)
+            settled += 1
+            for edge in range(offsets[min_node], offsets[min_node + 1]):
+                node = targets[edge]
+                new_distance = distance + weights[edge]
+                if new_distance < distances.get(node, self.infinity):
+                    distances[node] = new_distance
+                    path[node] = min_node
+                    visited.discard(node)
+                    heapq.heappush(queue, (new_distance, node))
+        return settled
+
+    # Returns the distances to a list of location ids (infinity for locations that cannot be reached), searching only as far
+    # as the furthest of them.
+    def distances_to(self, targets):
+        remaining = {target for target in targets if target not in self.visited}
+        while remaining:
+            reached = self.expand(remaining)
+            if reached is None:
+                break
+            remaining.discard(reached)
+        return array("d", (self.distances[target] if target in self.visited else self.infinity for target in targets))
+
+    # Returns the distance and the route to a location id, searching further if necessary.
+    def route_to(self, target):
+        if self.grow({target}) is None:
+            return self.infinity, None
+        return self.distances[target], self.build_route(target)
+
+    def build_route(self, target):
+        return build_route(self.graph, self.path, self.source, target)
+
+
+# The RoutingEngine class runs the shortest path searches for the RoutePlanner class.
+# It is still based on Dijkstra's algorithm, but the next location to visit is taken from a binary heap (priority queue) instead of
+# scanning every unvisited location, and the search stops as soon as the destination has been reached.
+# The searches run on a CompiledGraph, so locations are handled as integer ids and only translated back to names for the route.
+# 'last_settled' holds the number of locations visited by the most recent search, which is used to compare the search modes.
+class RoutingEngine:
+    infinity = float("inf")
+
+    def __init__(self, compiled_graph):
+        self.graph = compiled_graph
+        self.last_settled = 0
+
+    # Returns the distance and the route between origin and destination. If the destination cannot be reached,
+    # the distance is infinity and the route is None.
+    def shortest_path(self, origin, destination):
+        target = self.graph.ids.get(destination)
+        if target is None:
+            return self.infinity, None
+        distance, route, reached = self.search(origin, {target})
+        return distance, route
+
+    # Runs a single search from the origin that stops at the first location out of 'destinations' that is reached.
+    # This is used to find the nearest charging station, instead of searching for every station separately.
+    def nearest(self, origin, destinations):
+        ids = self.graph.ids
+        goals = {ids[name] for name in destinations if name in ids}
+        distance, route, reached = self.search(origin, goals)
+        if reached is None:
+            return distance, None, None
+        return distance, route, self.graph.names[reached]
+
+    # Dijkstra's algorithm with a priority queue. 'goals' is a set of location ids. Returns the distance, the route and the id of
+    # the first goal that was reached, or infinity, None and None if none of the goals can be reached.
+    def search(self, origin, goals):
+        source = self.graph.ids.get(origin)
+        if source is None or not goals:
+            return self.infinity, None, None
+        tree = SearchTree(self.graph, source)
+        reached = tree.grow(goals)
+        self.last_settled = len(tree.visited)
+        if reached is None:
+            return self.infinity, None, None
+        return tree.distances[reached], tree.build_route(reached), reached
+
+    # A* search: like Dijkstra's algorithm, but locations are taken from the priority queue in order of the distance travelled plus
+    # the estimated (straight-line) distance to the destination, so the search heads towards the destination instead of spreading
+    # out in every direction. Falls back to Dijkstra's algorithm when the graph has no coordinates.
+    def astar_path(self, origin, destination):
+        graph = self.graph
+        if not graph.has_coordinates():
+            return self.shortest_path(origin, destination)
+        source = graph.ids.get(origin)
+        target = graph.ids.get(destination)
+        if source is None or target is None:
+            return self.infinity, None
+
+        offsets, targets, weights = graph.offsets, graph.targets, graph.weights
+        scale = graph.heuristic_scale
+        estimates = {}
+        distances = {source: 0}
+        path = {}
+        visited = set()
+        queue = [(scale * graph.straight_distance(source, target), 0, source)]
+
+        while queue:
+            estimate, distance, min_node = heapq.heappop(queue)
+            if min_node in visited:
+                continue
+            visited.add(min_node)
+            if min_node == target:
+                self.last_settled = len(visited)
+                return distance, build_route(graph, path, source, target)
+            for edge in range(offsets[min_node], offsets[min_node + 1]):
+                node = targets[edge]
+                new_distance = distance + weights[edge]
+                if new_distance < distances.get(node, self.infinity):
+                    distances[node] = new_distance
+                    path[node] = min_node
+                    if node not in estimates:
+                        estimates[node] = scale * graph.straight_distance(node, target)
+                    heapq.heappush(queue, (new_distance + estimates[node], new_distance, node))
+        self.last_settled = len(visited)
+        return self.infinity, None
+
+    # Returns one row of distances per source id, with one column per target id. Each source is searched only once.
+    def distance_rows(self, sources, targets):
+        return [SearchTree(self.graph, source).distances_to(targets) for source in sources]
+
+    # Batch version of "shortest_path()" for a list of (origin, destination) pairs. Pairs with the same origin share one search tree.
+    def shortest_paths(self, pairs):
+        ids = self.graph.ids
+        trees = {}
+        results = []
+        for origin, destination in pairs:
+            source, target = ids.get(origin), ids.get(destination)
+            if source is None or target is None:
+                results.append((self.infinity, None))
+                continue
+            if source not in trees:
+                trees[source] = SearchTree(self.graph, source)
+            results.append(trees[source].route_to(target))
+        return results
+
+
+# The functions below are run inside worker processes, e.g. by RoutePlanner.distance_matrix and the RoutingService. Every worker
+# receives the compiled graph (and optionally an EnergyRouter for charging plans) once when it starts, instead of once per task.
+_worker_engine = None
+_worker_energy_router = None
+
+
+def init_worker(compiled_graph, energy_router=None):
+    global _worker_engine, _worker_energy_router
+    _worker_engine = RoutingEngine(compiled_graph)
+    _worker_energy_router = energy_router
+
+
+def worker_distance_rows(sources, targets):
+    return _worker_engine.distance_rows(sources, targets)
+
+
+def worker_shortest_paths(pairs):
+    return _worker_engine.shortest_paths(pairs)
+
+
+# 'jobs' is a list of (origin, destination, battery level) tuples.
+def worker_plan_charging(jobs):
+    return [_worker_energy_router.plan(origin, destination, battery_level) for origin, destination, battery_level in jobs]
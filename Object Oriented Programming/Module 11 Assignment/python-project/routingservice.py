@@ -0,0 +1,356 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import data
+import instrumentation
+from app import AppContext
+from compiledgraph import CompiledGraph
+from routeplanner import RoutePlanner
+from routingengine import init_worker, worker_plan_charging, worker_shortest_paths
+
+# The RoutingService serves many vehicles at the same time, instead of the single user of UserInterface.car_ui.
+# It listens on a TCP port on localhost and speaks JSON lines: every request is one line such as
+#   {"id": 1, "vehicle": "car-7", "method": "request_route", "params": {"destination": "Aspire"}}
+# and every response is one line with the same 'id' and either a 'result' or an 'error'. Responses can arrive out of order,
+# so a client can send several requests without waiting. Anything the car would print (e.g. "The car needs to be charged to
+# complete this trip.") is returned in 'messages'.
+# Every vehicle has its own AppContext (battery, trips, maintenance monitor and car), created on its first request. The map and
+# everything built from it (route cache, station table, energy router) are shared by all vehicles through the service's planner.
+# At most 'max_vehicles' vehicles are kept: when there are more, the vehicle that has not sent a request for the longest time is
+# forgotten, and starts again with a full battery and no trips if it comes back.
+# The route searches are collected into batches ('batch_size' at most, waiting 'batch_delay' seconds for more) and run in a pool
+# of 'processes' worker processes, which receive the compiled graph once when they start. With 0 processes they run in the
+# service itself. The workers only have the graph as it was when they started, so when a road is changed on the service's planner
+# (e.g. service.planner.close_road(...)), the graph version no longer matches the pool's and the pool is started again with the new
+# graph before the next batch. At most 'max_pending' searches are queued: when the queue is full the service stops reading from the
+# connections until there is room again, so a client that sends too much is slowed down instead of filling the memory.
+class RoutingService:
+    methods = ("request_route", "reachable_locations", "battery_level", "maintenance_dates", "trips", "location", "stats")
+
+    def __init__(self, roads=None, processes=None, batch_size=64, batch_delay=0.002, max_pending=1024, max_in_flight=32,
+                 max_vehicles=10000):
+        roads = data.graph if roads is None else roads
+        self.compiled_graph = roads if isinstance(roads, CompiledGraph) else CompiledGraph(roads)
+        self.planner = RoutePlanner(self.compiled_graph)
+        self.processes = os.cpu_count() if processes is None else processes
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_pending = max_pending
+        # Requests handled at the same time for one connection.
+        self.max_in_flight = max_in_flight
+        self.max_vehicles = max_vehicles
+        # The vehicles in order of their last request, the most recent last.
+        self.vehicles = OrderedDict()
+        self.pool = None
+        # The graph version the workers of the pool were started with.
+        self.pool_version = None
+        self.pool_restarts = 0
+        self.server = None
+        self.batchers = []
+        # Open connections (task and writer), which are closed by "close()".
+        self.connections = {}
+        self.requests = 0
+        self.batches = 0
+
+    def get_vehicle(self, vehicle_id):
+        vehicle = self.vehicles.get(vehicle_id)
+        if vehicle is None:
+            vehicle = AppContext(roads=self.compiled_graph, planner=self.planner)
+            self.vehicles[vehicle_id] = vehicle
+            if len(self.vehicles) > self.max_vehicles:
+                self.vehicles.popitem(last=False)
+        else:
+            self.vehicles.move_to_end(vehicle_id)
+        return vehicle
+
+    async def start(self, host="127.0.0.1", port=8765):
+        if self.processes > 0:
+            self.start_pool()
+        # Running batches at the same time: enough to keep every worker busy while the next batch is being collected.
+        self.slots = asyncio.Semaphore(2 * max(1, self.processes))
+        self.route_queue = asyncio.Queue(self.max_pending)
+        self.charging_queue = asyncio.Queue(self.max_pending)
+        self.batchers = [asyncio.create_task(self.run_batches(self.route_queue, worker_shortest_paths, self.local_shortest_paths)),
+                         asyncio.create_task(self.run_batches(self.charging_queue, worker_plan_charging, self.local_plan_charging))]
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+        for writer in list(self.connections.values()):
+            writer.close()
+        if self.connections:
+            await asyncio.gather(*self.connections, return_exceptions=True)
+        if self.server is not None:
+            await self.server.wait_closed()
+        for batcher in self.batchers:
+            batcher.cancel()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def start_pool(self):
+        self.pool = ProcessPoolExecutor(self.processes, initializer=init_worker,
+                                        initargs=(self.compiled_graph, self.planner.energy_router))
+        self.pool_version = self.compiled_graph.version
+
+    # Returns the pool, started again if a road has changed since its workers received the graph. Batches already sent to the
+    # old pool still finish there.
+    def current_pool(self):
+        if self.pool_version != self.compiled_graph.version:
+            self.pool.shutdown(wait=False)
+            self.start_pool()
+            self.pool_restarts += 1
+        return self.pool
+
+    # --- Batching ---
+    def local_shortest_paths(self, pairs):
+        return self.planner.engine.shortest_paths(pairs)
+
+    def local_plan_charging(self, jobs):
+        return [self.planner.energy_router.plan(origin, destination, battery_level) for origin, destination, battery_level in jobs]
+
+    # Submits a search to one of the queues and waits for its result.
+    async def submit(self, queue, job):
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((job, future))
+        return await future
+
+    async def run_batches(self, queue, worker_function, local_function):
+        while True:
+            jobs = [await queue.get()]
+            if queue.qsize() < self.batch_size - 1:
+                await asyncio.sleep(self.batch_delay)
+            while len(jobs) < self.batch_size and not queue.empty():
+                jobs.append(queue.get_nowait())
+            await self.slots.acquire()
+            asyncio.create_task(self.run_batch(jobs, worker_function, local_function))
+
+    async def run_batch(self, jobs, worker_function, local_function):
+        try:
+            if self.pool is None:
+                results = local_function([job for job, future in jobs])
+            else:
+                results = await asyncio.get_running_loop().run_in_executor(self.current_pool(), worker_function, [job for job, future in jobs])
+            for (job, future), result in zip(jobs, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as error:
+            for job, future in jobs:
+                if not future.done():
+                    future.set_exception(error)
+        finally:
+            self.batches += 1
+            self.slots.release()
+
+    # --- Connections ---
+    async def handle_connection(self, reader, writer):
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+        self.connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await in_flight.acquire()
+                task = asyncio.create_task(self.handle_line(line, writer, in_flight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            del self.connections[asyncio.current_task()]
+            writer.close()
+
+    # Every line gets a response, even when it is not a valid request or the request fails, and its place in 'in_flight' is
+    # always given back, so one bad request can never stop the connection.
+    async def handle_line(self, line, writer, in_flight):
+        request_id = None
+        try:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("A request must be a JSON object.")
+                request_id = request.get("id")
+                response = await self.handle_request(request)
+            except (ValueError, KeyError, TypeError) as error:
+                response = {"error": str(error)}
+            except Exception as error:
+                response = {"error": "{}: {}".format(type(error).__name__, error)}
+            response["id"] = request_id
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            in_flight.release()
+
+    async def handle_request(self, request):
+        self.requests += 1
+        method = request.get("method")
+        if method not in self.methods:
+            return {"error": "Unknown method: {}".format(method)}
+        vehicle = self.get_vehicle(str(request.get("vehicle", "default")))
+        output = io.StringIO()
+        result = await getattr(self, method)(vehicle, output, **request.get("params", {}))
+        response = {"result": result}
+        if output.getvalue():
+            response["messages"] = output.getvalue().splitlines()
+        return response
+
+    # --- Methods ---
+    # Same as UserInterface.request_route. The origin defaults to the current location of the car; with 'drive' the car
+    # also moves to the destination (like UserInterface.begin_driving).
+    async def request_route(self, vehicle, output, destination, origin=None, plan_charging=False, drive=False):
+        if origin is None:
+            origin = vehicle.car.get_current_location()
+        if destination not in self.compiled_graph or origin not in self.compiled_graph:
+            return {"error": "Your car is unable to travel to this location."}
+        planner = vehicle.route_planner
+        # Output is only captured around code that never waits, as other requests would otherwise print into this one's messages.
+        if plan_charging:
+            distance, route, charging_stops = await self.submit(self.charging_queue, (origin, destination, vehicle.battery.get_current_level()))
+            with contextlib.redirect_stdout(output):
+                result = planner.complete_charging_route(origin, destination, distance, route, charging_stops)
+            approved = result is not None
+        else:
+            distance, route = await self.submit(self.route_queue, (origin, destination))
+            with contextlib.redirect_stdout(output):
+                result = planner.complete_route(origin, destination, distance, route)
+            approved = result is not None and result[2]
+        if result is None:
+            return {"distance": None, "route": None}
+        if drive and approved:
+            vehicle.car.set_current_location(destination)
+        # The distance of the result, which is an integer on a map with whole-number distances (see CompiledGraph.present_distance).
+        if plan_charging:
+            return {"distance": result[0], "route": route, "charging_stops": result[2]}
+        return {"distance": result[0], "route": route, "approved": approved}
+
+    # Every location the vehicle can reach from 'origin' (default: where it is) without charging, as
+    # {name: [distance, battery level left]}. Nothing is recorded, so this can be asked as often as needed.
+    async def reachable_locations(self, vehicle, output, origin=None):
+        if origin is None:
+            origin = vehicle.car.get_current_location()
+        return dict(vehicle.route_planner.reachable_locations(origin))
+
+    async def battery_level(self, vehicle, output):
+        return vehicle.energy_monitor.calculate_battery_level(vehicle.battery)
+
+    async def maintenance_dates(self, vehicle, output):
+        with contextlib.redirect_stdout(output):
+            return vehicle.ui.display_maintenance_date()
+
+    async def trips(self, vehicle, output):
+        return dict(vehicle.route_planner.get_trips())
+
+    async def location(self, vehicle, output):
+        return vehicle.car.get_current_location()
+
+    # Numbers about the whole service, not about one vehicle. The latencies and search counters are only filled in when the
+    # instrumentation is switched on (serve --instrument), and only cover the searches run in the service itself (0 processes).
+    async def stats(self, vehicle, output):
+        return {"requests": self.requests, "batches": self.batches, "vehicles": len(self.vehicles), "pool_restarts": self.pool_restarts,
+                "instrumentation": instrumentation.snapshot()}
+
+
+# --- Load test ---
+# Nearest-rank percentile of a sorted list.
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+# Opens 'connections' connections and sends 'requests' route requests in total (random origins and destinations from data.py)
+# for 'vehicles' different vehicles. Every connection keeps up to 'window' requests in flight. Returns the number of requests,
+# the errors, the throughput (requests per second) and the 50th and 99th percentile latency in milliseconds.
+async def load_test(host="127.0.0.1", port=8765, connections=20, requests=2000, window=4, vehicles=100, seed=1):
+    rng = random.Random(seed)
+    names = list(data.graph)
+    jobs = [{"id": number, "vehicle": "car-{}".format(rng.randrange(vehicles)), "method": "request_route",
+             "params": {"origin": rng.choice(names), "destination": rng.choice(names)}} for number in range(requests)]
+    latencies = []
+    errors = 0
+
+    async def run_connection(connection_jobs):
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(host, port)
+        sent = {}
+        slots = asyncio.Semaphore(window)
+
+        async def read_responses():
+            nonlocal errors
+            for _ in connection_jobs:
+                response = json.loads(await reader.readline())
+                latencies.append(time.perf_counter() - sent.pop(response["id"]))
+                if "error" in response or "error" in (response.get("result") or {}):
+                    errors += 1
+                slots.release()
+
+        responses = asyncio.create_task(read_responses())
+        for job in connection_jobs:
+            await slots.acquire()
+            sent[job["id"]] = time.perf_counter()
+            writer.write(json.dumps(job).encode() + b"\n")
+            await writer.drain()
+        await responses
+        writer.close()
+        await writer.wait_closed()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_connection(jobs[number::connections]) for number in range(connections)))
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return {"requests": len(latencies), "errors": errors, "throughput": len(latencies) / seconds,
+            "p50_ms": percentile(latencies, 0.5) * 1000, "p99_ms": percentile(latencies, 0.99) * 1000}
+
+
+async def serve(host, port, processes, batch_size, batch_delay, max_pending, instrument=False):
+    if instrument:
+        instrumentation.enable()
+    service = RoutingService(processes=processes, batch_size=batch_size, batch_delay=batch_delay, max_pending=max_pending)
+    port = await service.start(host, port)
+    print("Routing service listening on {}:{} with {} worker processes.".format(host, port, service.processes))
+    try:
+        await service.server.serve_forever()
+    finally:
+        await service.close()
+
+
+# python routingservice.py serve --port 8765
+# python routingservice.py loadtest --port 8765 --connections 20 --requests 2000
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Routing service for many vehicles.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Start the routing service.")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    serve_parser.add_argument("--batch-size", type=int, default=64)
+    serve_parser.add_argument("--batch-delay", type=float, default=0.002)
+    serve_parser.add_argument("--max-pending", type=int, default=1024)
+    serve_parser.add_argument("--instrument", action="store_true", help="Collect latencies and counters, see the 'stats' method.")
+    load_parser = subparsers.add_parser("loadtest", help="Send route requests to a running service and report the latency.")
+    load_parser.add_argument("--host", default="127.0.0.1")
+    load_parser.add_argument("--port", type=int, default=8765)
+    load_parser.add_argument("--connections", type=int, default=20)
+    load_parser.add_argument("--requests", type=int, default=2000)
+    load_parser.add_argument("--window", type=int, default=4)
+    load_parser.add_argument("--vehicles", type=int, default=100)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        asyncio.run(serve(args.host, args.port, args.processes, args.batch_size, args.batch_delay, args.max_pending, args.instrument))
+    else:
+        report = asyncio.run(load_test(args.host, args.port, args.connections, args.requests, args.window, args.vehicles))
+        print("{requests} requests, {errors} errors, {throughput:.0f} requests/s, p50 {p50_ms:.2f} ms, p99 {p99_ms:.2f} ms".format(**report))
@@ -0,0 +1,443 @@
+import argparse
+import heapq
+import os
+from array import array
+from collections import deque
+
+import data
+from alternativeroutes import ReverseTree
+from compiledgraph import CompiledGraph, is_fractional
+from routecache import RouteCache
+from routingengine import SearchTree
+
+# This file splits a map into regions ("shards") that are each served by their own worker process, so that a map too large for one
+# process (or one machine) can still be routed, and the searches of one query run on several cores at once.
+# - "partition_graph()" divides the locations into regions of the same size with few roads between them.
+# - Every region is sent to a worker (ShardWorker), which only holds the roads inside its region. Locations with a road to or
+#   from another region are its "boundary" locations.
+# - The coordinator (ShardedRouter) only holds the "overlay": for every region, the shortest distance between each pair of its
+#   boundary locations inside the region (the "shortcuts", calculated once by the worker), plus the roads between regions.
+#   Any route is made of pieces inside one region joined by roads between regions, so the shortest route is found by one search
+#   over the overlay, from the distances between the origin and the boundary of its region to the distances between the
+#   boundary of the destination's region and the destination. The shortcuts on the route are then replaced by the real roads,
+#   which the workers look up in parallel.
+# The workers are connected with multiprocessing.connection, so they can run on this machine (started by the ShardedRouter) or
+# on other machines:
+#   python shardedrouting.py worker --port 6001 --authkey secret              (on every machine)
+#   router = ShardedRouter(roads, addresses=[("10.0.0.2", 6001), ("10.0.0.3", 6001)], authkey=b"secret")
+#   print(router.shortest_path("N1", "N99999"))
+
+
+# Returns the neighbours of a location id, following the roads in both directions.
+def undirected_neighbours(compiled_graph, node):
+    for edge in range(compiled_graph.offsets[node], compiled_graph.offsets[node + 1]):
+        yield compiled_graph.targets[edge]
+    for index in range(compiled_graph.reverse_offsets[node], compiled_graph.reverse_offsets[node + 1]):
+        yield compiled_graph.reverse_sources[index]
+
+
+# Divides the locations into 'count' regions and returns the region of every location id. The locations are split in two again
+# and again: a breadth-first search is started from a location at the edge of the part (the last one reached from any location),
+# and the first locations it reaches form one half. The halves are connected and round, like the neighbourhoods of a city, so
+# only a few roads cross from one region to another. Each region gets (almost) the same number of locations.
+def partition_graph(compiled_graph, count):
+    region = array("q", [0]) * len(compiled_graph)
+    parts = [(list(range(len(compiled_graph))), 0, count)]
+    while parts:
+        nodes, first_region, region_count = parts.pop()
+        if region_count == 1:
+            for node in nodes:
+                region[node] = first_region
+            continue
+        order = breadth_first_order(compiled_graph, nodes, breadth_first_order(compiled_graph, nodes, nodes[0])[-1] if nodes else None)
+        left_count = region_count // 2
+        cut = len(order) * left_count // region_count
+        parts.append((order[:cut], first_region, left_count))
+        parts.append((order[cut:], first_region + left_count, region_count - left_count))
+    return region
+
+
+# Returns all 'nodes' in breadth-first order from 'start', using only roads between them. Parts that cannot be reached are added
+# afterwards, each in breadth-first order as well.
+def breadth_first_order(compiled_graph, nodes, start):
+    allowed = set(nodes)
+    order = []
+    seen = set()
+    for root in ([start] if start is not None else []) + nodes:
+        if root in seen:
+            continue
+        seen.add(root)
+        queue = deque([root])
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for neighbour in undirected_neighbours(compiled_graph, node):
+                if neighbour in allowed and neighbour not in seen:
+                    seen.add(neighbour)
+                    queue.append(neighbour)
+    return order
+
+
+# Splits the map by region. Returns, for every region, the roads inside it (a graph dictionary) and its boundary locations,
+# and the list of roads between regions as (origin, destination, distance).
+def split_graph(compiled_graph, region, count):
+    names, offsets, targets, weights = compiled_graph.names, compiled_graph.offsets, compiled_graph.targets, compiled_graph.weights
+    roads = [{} for _ in range(count)]
+    boundaries = [set() for _ in range(count)]
+    cut_roads = []
+    for node in range(len(compiled_graph)):
+        roads[region[node]].setdefault(names[node], {})
+        for edge in range(offsets[node], offsets[node + 1]):
+            target = targets[edge]
+            if region[target] == region[node]:
+                roads[region[node]][names[node]][names[target]] = weights[edge]
+            else:
+                boundaries[region[node]].add(names[node])
+                boundaries[region[target]].add(names[target])
+                cut_roads.append((names[node], names[target], weights[edge]))
+    return [(shard_roads, sorted(boundary)) for shard_roads, boundary in zip(roads, boundaries)], cut_roads
+
+
+# A ShardWorker holds the roads of one region and answers the coordinator's questions about them. Locations are sent as names.
+class ShardWorker:
+    methods = ("shortcuts", "query", "routes", "update_road")
+
+    def __init__(self, roads, boundary, cache_size=64):
+        self.graph = CompiledGraph(roads)
+        self.boundary = [self.graph.node_id(name) for name in boundary]
+        self.route_cache = RouteCache(self.graph, cache_size)
+        # The search trees of the last batch of queries, kept until its routes have been sent (see "routes()").
+        self.batch_trees = {}
+        self.batch_reverse_trees = {}
+
+    # Returns the shortest distance between every pair of boundary locations inside the region, as a list of
+    # (origin, destination, distance). A pair is left out when its shortest route passes another boundary location, as the
+    # coordinator can then combine two shorter shortcuts, which keeps the overlay small.
+    def shortcuts(self):
+        names = self.graph.names
+        boundary = set(self.boundary)
+        shortcuts = []
+        for source in self.boundary:
+            tree = SearchTree(self.graph, source)
+            distances = tree.distances_to(self.boundary)
+            for target, distance in zip(self.boundary, distances):
+                if target == source or distance == float("inf"):
+                    continue
+                node = tree.path[target]
+                while node != source and node not in boundary:
+                    node = tree.path[node]
+                if node == source:
+                    shortcuts.append((names[source], names[target], distance))
+        return shortcuts
+
+    # Answers the first step of a batch of queries: the distances from every origin to the boundary, from the boundary to every
+    # destination, and between the (origin, destination) pairs that are both in this region.
+    def query(self, origins, destinations, pairs):
+        ids = self.graph.ids
+        self.batch_trees = {ids[origin]: self.route_cache.get_tree(ids[origin]) for origin in origins}
+        self.batch_reverse_trees = {ids[destination]: ReverseTree(self.graph, ids[destination]) for destination in destinations}
+        from_boundary = [self.batch_trees[ids[origin]].distances_to(self.boundary) for origin in origins]
+        to_boundary = [array("d", (tree.distance(node) for node in self.boundary)) for tree in self.batch_reverse_trees.values()]
+        direct = [self.batch_trees[ids[origin]].distances_to([ids[destination]])[0] for origin, destination in pairs]
+        return from_boundary, to_boundary, direct
+
+    # Returns the route inside the region, as a list of names, for every (origin, destination) pair. Routes to a destination or
+    # from an origin of the last batch of queries are read from its search trees, which already reach the boundary.
+    def routes(self, pairs):
+        ids, names = self.graph.ids, self.graph.names
+        routes = []
+        for origin, destination in pairs:
+            source, target = ids[origin], ids[destination]
+            if target in self.batch_reverse_trees:
+                routes.append([names[node] for node in self.batch_reverse_trees[target].route_from(source)])
+            elif source in self.batch_trees:
+                routes.append(self.batch_trees[source].route_to(target)[1])
+            else:
+                routes.append(self.route_cache.shortest_path(origin, destination)[1])
+        return routes
+
+    # Changes the distance of a road inside the region (see RoutePlanner.update_road). Returns the old distance and the new shortcuts.
+    def update_road(self, origin, destination, distance):
+        old_distance = self.graph.set_weight(origin, destination, distance)
+        self.route_cache.update_edge(self.graph.node_id(origin), self.graph.node_id(destination), old_distance, distance)
+        self.batch_trees = {}
+        self.batch_reverse_trees = {}
+        return old_distance, self.shortcuts()
+
+
+# Runs a ShardWorker behind a connection until the coordinator sends "close" or disconnects. The first request must be
+# ("load", roads, boundary); every other request is (method, arguments...) and is answered with ("ok", result) or
+# ("error", message).
+def serve_shard(connection, cache_size=64):
+    worker = None
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+        method, arguments = request[0], request[1:]
+        if method == "close":
+            break
+        try:
+            if method == "load":
+                worker = ShardWorker(*arguments, cache_size=cache_size)
+                result = worker.shortcuts()
+            elif worker is not None and method in ShardWorker.methods:
+                result = getattr(worker, method)(*arguments)
+            else:
+                raise ValueError("Unknown request: {}".format(method))
+            connection.send(("ok", result))
+        except Exception as error:
+            connection.send(("error", "{}: {}".format(type(error).__name__, error)))
+    connection.close()
+
+
+# Serves shards on a TCP port, one coordinator at a time, e.g. on another machine: see the top of this file.
+def run_worker(host, port, authkey, cache_size=64):
+    from multiprocessing.connection import Listener
+    with Listener((host, port), authkey=authkey) as listener:
+        print("Shard worker listening on {}:{}.".format(host, port))
+        while True:
+            with listener.accept() as connection:
+                serve_shard(connection, cache_size)
+
+
+# The ShardedRouter divides the map into 'shard_count' regions (by default one per core) and starts a worker process for every
+# region, connected with a pipe. With 'addresses', it connects to workers that are already running instead, one region per
+# address. Once the workers are loaded, the coordinator no longer needs the map: it keeps only the region of every location and
+# the overlay.
+# Routes have the same format as RoutePlanner.find_route: (distance, list of names), or (infinity, None) if there is no route.
+class ShardedRouter:
+    infinity = float("inf")
+
+    def __init__(self, roads=None, shard_count=None, addresses=None, authkey=None, cache_size=64):
+        roads = data.graph if roads is None else roads
+        compiled_graph = roads if isinstance(roads, CompiledGraph) else CompiledGraph(roads)
+        if addresses is not None:
+            shard_count = len(addresses)
+        elif shard_count is None:
+            shard_count = os.cpu_count() or 1
+        self.shard_count = max(1, min(shard_count, len(compiled_graph)))
+
+        region = partition_graph(compiled_graph, self.shard_count)
+        shards, cut_roads = split_graph(compiled_graph, region, self.shard_count)
+        self.region = {name: region[node] for node, name in enumerate(compiled_graph.names)}
+        # The distances are added up as floats; on a map with whole-number distances they are returned as integers, like the
+        # distances of the RoutingEngine. Like in the CompiledGraph, closed roads do not count, and the roads changed to a distance
+        # with a fraction are counted, so the distances are integers again once those roads are back to whole numbers.
+        self.whole_numbers = compiled_graph.whole_numbers
+        self.fractional_roads = compiled_graph.fractional_roads
+        # The version of the graph the workers have, which goes up with every "update_road()" like CompiledGraph.version. When the
+        # graph is changed without the router (e.g. by another planner), the versions differ and the RoutePlanner stops using it.
+        self.version = compiled_graph.version
+        self.boundaries = [boundary for shard_roads, boundary in shards]
+        # The overlay: the shortcuts of every region, and the roads between regions, as {origin: {destination: distance}}.
+        self.shortcuts = [None] * self.shard_count
+        self.cut_roads = {}
+        for origin, destination, distance in cut_roads:
+            self.cut_roads.setdefault(origin, {})[destination] = distance
+
+        self.processes = []
+        self.connections = []
+        # Imported here, like in RoutePlanner.distance_matrix, as the multiprocessing modules are slow to load.
+        if addresses is None:
+            from multiprocessing import Pipe, Process
+            for shard in range(self.shard_count):
+                connection, worker_connection = Pipe()
+                process = Process(target=serve_shard, args=(worker_connection, cache_size), daemon=True)
+                process.start()
+                worker_connection.close()
+                self.processes.append(process)
+                self.connections.append(connection)
+        else:
+            from multiprocessing.connection import Client
+            self.connections = [Client(tuple(address), authkey=authkey) for address in addresses]
+
+        # Every worker calculates its shortcuts at the same time.
+        for connection, (shard_roads, boundary) in zip(self.connections, shards):
+            connection.send(("load", shard_roads, boundary))
+        for shard, shortcuts in enumerate(self.receive_all(range(self.shard_count))):
+            self.set_shortcuts(shard, shortcuts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    # Stops the workers started by the router; workers on other machines keep running and wait for the next coordinator.
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(("close",))
+            except OSError:
+                pass
+            connection.close()
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+
+    # Sends one request to each of the given shards first, so that they all work at the same time, and then collects the results
+    # in the same order.
+    def request_all(self, requests):
+        for shard, request in requests.items():
+            self.connections[shard].send(request)
+        return dict(zip(requests, self.receive_all(requests)))
+
+    # Every answer is read before an error is raised, so the next request does not receive an old answer.
+    def receive_all(self, shards):
+        answers = [(shard, self.connections[shard].recv()) for shard in shards]
+        for shard, (status, result) in answers:
+            if status != "ok":
+                raise RuntimeError("Shard {} failed: {}".format(shard, result))
+        return [result for shard, (status, result) in answers]
+
+    def set_shortcuts(self, shard, shortcuts):
+        overlay = {}
+        for origin, destination, distance in shortcuts:
+            overlay.setdefault(origin, {})[destination] = distance
+        self.shortcuts[shard] = overlay
+
+    # Returns the number of boundary locations and the number of roads in the overlay (shortcuts and roads between regions).
+    def overlay_size(self):
+        shortcuts = sum(len(roads) for overlay in self.shortcuts for roads in overlay.values())
+        return sum(len(boundary) for boundary in self.boundaries), shortcuts + sum(len(roads) for roads in self.cut_roads.values())
+
+    def shortest_path(self, origin, destination):
+        return self.shortest_paths([(origin, destination)])[0]
+
+    # Batch version of "shortest_path()" for a list of (origin, destination) pairs: every worker receives one request per step
+    # for the whole batch.
+    def shortest_paths(self, pairs):
+        region = self.region
+        known = [origin in region and destination in region for origin, destination in pairs]
+        origins = [dict() for _ in range(self.shard_count)]
+        destinations = [dict() for _ in range(self.shard_count)]
+        direct_pairs = [dict() for _ in range(self.shard_count)]
+        for (origin, destination), valid in zip(pairs, known):
+            if valid:
+                origins[region[origin]].setdefault(origin, len(origins[region[origin]]))
+                destinations[region[destination]].setdefault(destination, len(destinations[region[destination]]))
+                if region[origin] == region[destination]:
+                    direct_pairs[region[origin]].setdefault((origin, destination), len(direct_pairs[region[origin]]))
+        answers = self.request_all({shard: ("query", list(origins[shard]), list(destinations[shard]), list(direct_pairs[shard]))
+                                    for shard in range(self.shard_count) if origins[shard] or destinations[shard]})
+
+        plans = []
+        for (origin, destination), valid in zip(pairs, known):
+            if not valid or origin == destination:
+                plans.append((self.infinity, None) if not valid else (0, [(None, origin, destination)]))
+                continue
+            origin_shard, destination_shard = region[origin], region[destination]
+            from_boundary = answers[origin_shard][0][origins[origin_shard][origin]]
+            to_boundary = answers[destination_shard][1][destinations[destination_shard][destination]]
+            direct = self.infinity
+            if origin_shard == destination_shard:
+                direct = answers[origin_shard][2][direct_pairs[origin_shard][(origin, destination)]]
+            plans.append(self.search_overlay(origin, destination, from_boundary, to_boundary, direct))
+
+        # Every shortcut and every piece at the start or the end of a route is replaced by the roads inside its region.
+        pieces = [dict() for _ in range(self.shard_count)]
+        for distance, plan in plans:
+            for shard, start, end in plan or []:
+                if shard is not None:
+                    pieces[shard].setdefault((start, end), len(pieces[shard]))
+        routes = self.request_all({shard: ("routes", list(pieces[shard])) for shard in range(self.shard_count) if pieces[shard]})
+
+        results = []
+        for distance, plan in plans:
+            if plan is None:
+                results.append((self.infinity, None))
+                continue
+            route = [plan[0][1]]
+            for shard, start, end in plan:
+                if shard is None:
+                    if end != start:
+                        route.append(end)
+                else:
+                    route.extend(routes[shard][pieces[shard][(start, end)]][1:])
+            results.append((int(distance) if self.whole_numbers and self.fractional_roads == 0 else distance, route))
+        return results
+
+    # Dijkstra's algorithm over the overlay, starting at the boundary of the origin's region. Returns the distance and the pieces of
+    # the route as (region, start, end): a piece inside a region, or a road between regions when the region is None.
+    def search_overlay(self, origin, destination, from_boundary, to_boundary, direct):
+        region = self.region
+        origin_shard, destination_shard = region[origin], region[destination]
+        best, best_exit = direct, None
+        exits = {name: distance for name, distance in zip(self.boundaries[destination_shard], to_boundary) if distance != self.infinity}
+        distances = {}
+        path = {}
+        visited = set()
+        queue = []
+        for name, distance in zip(self.boundaries[origin_shard], from_boundary):
+            if distance < distances.get(name, self.infinity):
+                distances[name] = distance
+                path[name] = (origin_shard, origin)
+                queue.append((distance, name))
+        heapq.heapify(queue)
+        while queue:
+            distance, node = heapq.heappop(queue)
+            if distance >= best:
+                break
+            if node in visited:
+                continue
+            visited.add(node)
+            if node in exits and distance + exits[node] < best:
+                best, best_exit = distance + exits[node], node
+            shard = region[node]
+            for roads, road_shard in ((self.shortcuts[shard].get(node), shard), (self.cut_roads.get(node), None)):
+                if not roads:
+                    continue
+                for neighbour, road_distance in roads.items():
+                    new_distance = distance + road_distance
+                    if new_distance < distances.get(neighbour, self.infinity):
+                        distances[neighbour] = new_distance
+                        path[neighbour] = (road_shard, node)
+                        heapq.heappush(queue, (new_distance, neighbour))
+
+        if best == self.infinity:
+            return self.infinity, None
+        if best_exit is None:
+            return best, [(origin_shard, origin, destination)]
+        plan = [(destination_shard, best_exit, destination)]
+        node = best_exit
+        while node != origin:
+            shard, previous = path[node]
+            # Pieces in a row inside the same region are joined into one: the part of a shortest route inside a region is a
+            # shortest route in that region as well, so the worker only has to search once.
+            if shard is not None and plan[-1][0] == shard:
+                plan[-1] = (shard, previous, plan[-1][2])
+            else:
+                plan.append((shard, previous, node))
+            node = previous
+        plan.reverse()
+        return best, plan
+
+    # Changes the distance of a road at runtime. A road inside a region is changed by its worker, which sends back the new
+    # shortcuts of the region; a road between regions only changes the overlay. Returns the old distance.
+    def update_road(self, origin, destination, distance):
+        shard = self.region[origin]
+        if self.region[destination] != shard:
+            old_distance = self.cut_roads[origin][destination]
+            self.cut_roads[origin][destination] = distance
+        else:
+            old_distance, shortcuts = self.request_all({shard: ("update_road", origin, destination, distance)})[shard]
+            self.set_shortcuts(shard, shortcuts)
+        self.fractional_roads += is_fractional(distance) - is_fractional(old_distance)
+        self.version += 1
+        return old_distance
+
+
+# python shardedrouting.py worker --port 6001 --authkey secret
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded routing: serve one region of the map to a ShardedRouter.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    worker_parser = subparsers.add_parser("worker", help="Serve shards to a coordinator on another machine.")
+    worker_parser.add_argument("--host", default="0.0.0.0")
+    worker_parser.add_argument("--port", type=int, default=6001)
+    worker_parser.add_argument("--authkey", required=True)
+    worker_parser.add_argument("--cache-size", type=int, default=64)
+    args = parser.parse_args()
+    run_worker(args.host, args.port, args.authkey.encode(), args.cache_size)
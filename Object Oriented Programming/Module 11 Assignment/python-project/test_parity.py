@@ -0,0 +1,258 @@
+import contextlib
+import datetime
+import io
+import os
+import random
+import tempfile
+
+from alternativeroutes import KShortestPaths
+from benchmark import generate_geo_graph, generate_graph
+from compiledgraph import CompiledGraph
+from contraction import ContractionHierarchy
+from energymonitor import Battery, EnergyMonitor, FleetBattery
+from graphloader import load_edge_csv, validate_graph
+from maintenancemonitor import MaintenanceMonitor, PartRegistry
+from neareststation import NearestStationTable
+from routecache import RouteCache
+from routeplanner import RoutePlanner
+from routingengine import RoutingEngine
+from triplog import TripLog
+
+# These checks compare the faster parts of the project with the simple version they replace, on random road networks.
+# Run them with "python -m pytest test_parity.py", or with "python test_parity.py" when pytest is not installed.
+
+
+def random_pairs(names, count, seed):
+    rng = random.Random(seed)
+    return [(rng.choice(names), rng.choice(names)) for _ in range(count)]
+
+
+# Distances found by different searches are added up in a different order, so they can differ in the last digits.
+def same_distance(a, b):
+    return a == b or abs(a - b) < 1e-9
+
+
+# A*, the contraction hierarchy, the first of the k shortest routes and the route cache must all find routes as short as
+# Dijkstra's algorithm (user-001, user-006, user-007, user-022).
+def test_searches_match_dijkstra():
+    roads, locations = generate_geo_graph(400, "road", seed=3)
+    compiled_graph = CompiledGraph(roads)
+    compiled_graph.set_coordinates(locations)
+    engine = RoutingEngine(compiled_graph)
+    hierarchy = ContractionHierarchy.build(compiled_graph)
+    cache = RouteCache(compiled_graph, 16)
+    for origin, destination in random_pairs(compiled_graph.names, 60, seed=4):
+        distance, route = engine.shortest_path(origin, destination)
+        assert same_distance(engine.astar_path(origin, destination)[0], distance)
+        assert same_distance(hierarchy.shortest_path(origin, destination)[0], distance)
+        assert same_distance(cache.shortest_path(origin, destination)[0], distance)
+        if route is not None:
+            routes = KShortestPaths(compiled_graph, compiled_graph.ids[origin], compiled_graph.ids[destination]).shortest_routes(2)
+            assert same_distance(routes[0][0], distance)
+            assert len(routes) < 2 or routes[1][0] > routes[0][0] - 1e-9
+
+
+# After roads are changed, closed and reopened, the repaired route cache and station table must give the same distances as a
+# new search and a new table (user-004, user-005, user-018).
+def test_repairs_match_new_searches():
+    roads = generate_graph(400, seed=5)
+    stations = ["N0", "N150", "N399"]
+    planner = RoutePlanner(roads, stations=stations, locations={})
+    compiled_graph = planner.compiled_graph
+    names = compiled_graph.names
+    rng = random.Random(6)
+    origins = rng.sample(names, 8)
+    for step in range(40):
+        node = rng.randrange(len(names))
+        edge = rng.randrange(compiled_graph.offsets[node], compiled_graph.offsets[node + 1])
+        origin, destination = names[node], names[compiled_graph.targets[edge]]
+        if step % 3 == 0:
+            planner.close_road(origin, destination)
+        else:
+            planner.update_road(origin, destination, rng.randint(1, 30))
+        if step % 7 == 6 and planner.closed_roads:
+            planner.reopen_road(*next(iter(planner.closed_roads)))
+
+        engine = RoutingEngine(compiled_graph)
+        table = NearestStationTable(compiled_graph, stations)
+        for source in origins:
+            for target in rng.sample(names, 5):
+                assert planner.find_route(source, target)[0] == engine.shortest_path(source, target)[0]
+        for name in names:
+            expected = table.lookup(name)
+            found = planner.station_table.lookup(name)
+            assert (found and found[1]) == (expected and expected[1])
+
+
+# Two planners built on one compiled graph: a road changed through one of them must also change the nearest station the other
+# one finds, as its station table is built again for the new version of the graph (user-004).
+def test_station_table_follows_shared_graph():
+    roads = generate_graph(100, seed=9)
+    stations = ["N0", "N99"]
+    first = RoutePlanner(roads, stations=stations, locations={})
+    second = RoutePlanner(first.compiled_graph, stations=stations, locations={})
+    compiled_graph = first.compiled_graph
+    rng = random.Random(10)
+    for step in range(20):
+        node = rng.randrange(len(compiled_graph))
+        edge = rng.randrange(compiled_graph.offsets[node], compiled_graph.offsets[node + 1])
+        first.update_road(compiled_graph.names[node], compiled_graph.names[compiled_graph.targets[edge]], rng.randint(1, 40))
+        table = NearestStationTable(compiled_graph, stations)
+        for name in compiled_graph.names:
+            expected = table.lookup(name)
+            found = second.station_table.lookup(name)
+            assert (found and found[1]) == (expected and expected[1])
+            found = first.station_table.lookup(name)
+            assert (found and found[1]) == (expected and expected[1])
+    # The first planner repaired its own table after every change; only the second one had to build it again.
+    assert first.station_table.rebuilds == 0
+
+
+# Roads changed through one planner must reach every planner on the same graph: a sibling made with "for_vehicle()" and a planner
+# built separately on the same compiled graph must both suggest the nearest charging station of the changed map (user-018).
+def test_sibling_planners_see_road_changes():
+    roads = generate_graph(100, seed=11)
+    stations = ["N0", "N55", "N99"]
+    planner = RoutePlanner(roads, stations=stations, locations={})
+    compiled_graph = planner.compiled_graph
+    siblings = [planner.for_vehicle(), RoutePlanner(compiled_graph, stations=stations, locations={})]
+    names = [name for name in compiled_graph.names if name not in stations]
+    rng = random.Random(12)
+    for step in range(30):
+        node = rng.randrange(len(compiled_graph))
+        edge = rng.randrange(compiled_graph.offsets[node], compiled_graph.offsets[node + 1])
+        origin, destination = compiled_graph.names[node], compiled_graph.names[compiled_graph.targets[edge]]
+        if step % 4 == 0:
+            planner.close_road(origin, destination)
+        elif step % 4 == 1 and planner.closed_roads:
+            planner.reopen_road(*next(iter(planner.closed_roads)))
+        else:
+            planner.update_road(origin, destination, rng.randint(1, 40))
+
+        table = NearestStationTable(compiled_graph, stations)
+        for name in rng.sample(names, 10):
+            expected = table.lookup(name)
+            for sibling in siblings:
+                sibling.battery.set_current_level(Battery.total_capacity)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    message = sibling.suggest_charging(None, name)
+                if expected is None:
+                    assert "no station is reachable" in message
+                else:
+                    assert message.endswith("which is {} km away from here.".format(compiled_graph.present_distance(expected[1])))
+
+
+# A CSV map with one-way roads is accepted when every location can still be left and reached, and a location that can be reached
+# but never left again is reported (user-014).
+def test_one_way_roads_are_validated():
+    graph = load_edge_csv(os.path.join(os.path.dirname(os.path.abspath(__file__)), "maps", "oneway_roads.csv"))
+    assert graph["Landmark Mall"] == {"The Pearl": 13, "City Center": 11}
+    assert graph["City Center"] == {"The Pearl": 9}
+
+    dead_end = {"A": {"B": 1, "C": 2}, "B": {"A": 1}, "C": {}}
+    problems = validate_graph(dead_end, {("A", "C")})
+    assert len(problems) == 1 and "cannot reach A, e.g. C" in problems[0]
+
+
+# Monitors of two vehicles that share a PartRegistry only see their own parts, and the 'parts' view cannot be changed (user-023).
+def test_shared_registry_keeps_parts_apart():
+    planner = RoutePlanner(generate_graph(4), stations=["N0"], locations={})
+    fleet = PartRegistry(2)
+    first = MaintenanceMonitor(planner, fleet, 0)
+    second = MaintenanceMonitor(planner, fleet, 1)
+    first.add_part("Heat Pump", 99.0, 100.0, 50.0)
+    second.add_part("Battery", 80.0, 100.0, 50.0)
+    assert first.list_parts() == ["Heat Pump"] and second.list_parts() == ["Battery"]
+    second.get_part("Battery").set_current(60.0)
+    assert first.get_average_condition() == 99.0 and second.get_average_condition() == 60.0
+    assert dict(second.parts) == {"Battery": {"condition": 60.0, "max": 100.0, "min": 50.0}}
+    try:
+        second.parts["Heat Pump"] = {"condition": 1.0, "max": 100.0, "min": 50.0}
+        assert False, "the parts view must be read-only"
+    except TypeError:
+        pass
+
+
+# When a later leg of a route with charging stops cannot be driven, nothing is recorded and the battery is set back to the level it
+# had before the first leg (user-009).
+def test_failed_charging_route_is_rolled_back():
+    roads = {"A": {"B": 100}, "B": {"A": 100, "C": 500}, "C": {"B": 500}}
+    planner = RoutePlanner(roads, stations=["B"], locations={})
+    planner.battery.set_current_level(50.0)
+    trips = len(planner.trips_taken)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert planner.complete_charging_route("A", "C", 600, ["A", "B", "C"], ["B"]) is None
+    assert planner.battery.get_current_level() == 50.0
+    assert len(planner.trips_taken) == trips
+
+
+# "route_approval_batch()" must approve the same trips and leave the same battery levels as "route_approval()" on one Battery
+# per vehicle (user-010).
+def test_batch_approval_matches_scalar():
+    monitor = EnergyMonitor()
+    rng = random.Random(7)
+    start_levels = [rng.uniform(0, Battery.total_capacity) for _ in range(200)]
+    distances = [rng.uniform(0, 300) for _ in range(200)]
+
+    batteries = [Battery(level) for level in start_levels]
+    # The scalar method prints a message for every rejected trip.
+    with contextlib.redirect_stdout(io.StringIO()):
+        scalar = [bool(monitor.route_approval(battery, distance)) for battery, distance in zip(batteries, distances)]
+    fleet = FleetBattery(200)
+    for vehicle, level in enumerate(start_levels):
+        fleet.set_current_level(vehicle, level)
+    batch = monitor.route_approval_batch(fleet, distances)
+
+    assert [bool(approved) for approved in batch] == scalar
+    assert list(fleet.levels) == [battery.get_current_level() for battery in batteries]
+
+    # Several trips of the same vehicles, in a random order: each trip starts from the level the previous one left.
+    vehicles = [rng.randrange(20) for _ in range(200)]
+    batteries = [Battery(level) for level in start_levels[:20]]
+    with contextlib.redirect_stdout(io.StringIO()):
+        scalar = [bool(monitor.route_approval(batteries[vehicle], distance)) for vehicle, distance in zip(vehicles, distances)]
+    fleet = FleetBattery(20)
+    for vehicle, level in enumerate(start_levels[:20]):
+        fleet.set_current_level(vehicle, level)
+    batch = monitor.route_approval_batch(fleet, distances, vehicles)
+
+    assert [bool(approved) for approved in batch] == scalar
+    assert list(fleet.levels) == [battery.get_current_level() for battery in batteries]
+
+
+# A TripLog stored in a journal file must give back the same trips after it is closed and opened again (user-013).
+def test_journal_reopen():
+    path = os.path.join(tempfile.mkdtemp(), "trips.journal")
+    trip_log = TripLog(path)
+    rng = random.Random(8)
+    trips = [(rng.randint(1, 50), "N{}".format(rng.randrange(10)), "N{}".format(rng.randrange(10)),
+              datetime.date(2023, 1, 1) + datetime.timedelta(days=number // 3)) for number in range(100)]
+    for trip in trips[:60]:
+        trip_log.append(*trip)
+    trip_log.close()
+
+    trip_log = TripLog(path)
+    assert len(trip_log) == 60
+    for trip in trips[60:]:
+        trip_log.append(*trip)
+    expected = dict(trip_log)
+    total_km = trip_log.total_km()
+    trip_log.close()
+
+    trip_log = TripLog(path)
+    assert dict(trip_log) == expected
+    assert trip_log.total_km() == total_km == sum(trip[0] for trip in trips)
+    assert [trip_log.location_names[origin] for origin in trip_log.origin] == [trip[1] for trip in trips]
+    trip_log.close()
+    try:
+        trip_log.total_km()
+        assert False, "a closed journal must not be read"
+    except ValueError as error:
+        assert str(error) == "journal is closed"
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print("{} passed".format(name))
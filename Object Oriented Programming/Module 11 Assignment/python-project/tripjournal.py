@@ -0,0 +1,182 @@
+import atexit
+import mmap
+import os
+import struct
+from array import array
+
+# Both trip stores below are used by the TripLog. They hold the same four columns (km, day, origin, destination) and the
+# names of the locations the origin and destination ids refer to.
+
+
+# Keeps the trips in memory only. This is the default, and everything is lost when the program stops.
+class MemoryTripStore:
+
+    def __init__(self):
+        self.km = array("d")
+        self.day = array("q")
+        self.origin = array("q")
+        self.destination = array("q")
+        self.location_names = []
+        self.in_date_order = True
+
+    def __len__(self):
+        return len(self.km)
+
+    def add_location(self, name):
+        self.location_names.append(name)
+
+    def append(self, km, day, origin, destination):
+        if self.day and day < self.day[-1]:
+            self.in_date_order = False
+        self.km.append(km)
+        self.day.append(day)
+        self.origin.append(origin)
+        self.destination.append(destination)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# The TripJournal stores the trips in an append-only binary file, so the history survives a restart.
+# Every trip is a fixed-width record of 32 bytes (km as a double, then day, origin and destination as 64-bit integers), after a
+# 32-byte header. Because every field is 8 bytes wide, the file can be memory-mapped and each column read directly as a strided
+# memoryview, without copying or parsing anything when the program starts.
+# New records are written straight away, but only forced to disk (fsync) every 'sync_every' records, or when "flush()" is called.
+# Location names are kept in a separate text file next to the journal, one per line.
+class TripJournal:
+    magic = b"TRIPJRNL"
+    header = struct.Struct("<8sIII12x")
+    record = struct.Struct("<dqqq")
+    version = 1
+    out_of_order_flag = 1
+
+    def __init__(self, path, sync_every=64):
+        self.path = path
+        self.sync_every = sync_every
+        self.pending = 0
+        self.file = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = os.fstat(self.file).st_size
+        if size < self.header.size:
+            os.write(self.file, self.header.pack(self.magic, self.version, self.record.size, 0))
+            os.fsync(self.file)
+            size = self.header.size
+        magic, version, record_size, self.flags = self.header.unpack(os.pread(self.file, self.header.size, 0))
+        if magic != self.magic or version != self.version or record_size != self.record.size:
+            raise ValueError("{} is not a trip journal.".format(path))
+        # A record that was only partly written when the program stopped is removed.
+        self.count = (size - self.header.size) // self.record.size
+        if size != self.header.size + self.count * self.record.size:
+            os.ftruncate(self.file, self.header.size + self.count * self.record.size)
+        os.lseek(self.file, 0, os.SEEK_END)
+
+        self.names_path = path + ".names"
+        with open(self.names_path, "a+", encoding="utf-8") as names_file:
+            names_file.seek(0)
+            self.location_names = names_file.read().splitlines()
+        self.names_file = open(self.names_path, "a", encoding="utf-8")
+
+        # The memory map of the file, its length, and the columns read from it (see "refresh()").
+        self.mapping = None
+        self.mapped_length = None
+        self.views = []
+        self.columns = None
+        self.last_day = None
+        # The journal is closed when the program stops, unless "close()" was called first.
+        atexit.register(self.close)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def in_date_order(self):
+        return not self.flags & self.out_of_order_flag
+
+    # New location names are forced to disk straight away, so that a stored record never refers to a missing name.
+    def add_location(self, name):
+        self.location_names.append(name)
+        self.names_file.write(name + "\n")
+        self.names_file.flush()
+        os.fsync(self.names_file.fileno())
+
+    def append(self, km, day, origin, destination):
+        if self.last_day is None and self.count:
+            self.last_day = self.day[-1]
+        if self.last_day is not None and day < self.last_day and self.in_date_order:
+            self.flags |= self.out_of_order_flag
+            os.pwrite(self.file, self.header.pack(self.magic, self.version, self.record.size, self.flags), 0)
+        self.last_day = day
+        os.write(self.file, self.record.pack(km, day, origin, destination))
+        self.count += 1
+        self.pending += 1
+        if self.pending >= self.sync_every:
+            self.flush()
+
+    def flush(self):
+        if self.pending and self.file is not None:
+            os.fsync(self.file)
+            self.pending = 0
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.unmap()
+            os.close(self.file)
+            self.names_file.close()
+            self.file = None
+            atexit.unregister(self.close)
+
+    # Maps the file into memory again, but only if its length changed (records were added) since the columns were last read.
+    # The old map is closed first.
+    def refresh(self):
+        if self.file is None:
+            raise ValueError("journal is closed")
+        length = self.header.size + self.count * self.record.size
+        if self.mapped_length == length:
+            return
+        self.unmap()
+        self.mapping = mmap.mmap(self.file, length, access=mmap.ACCESS_READ)
+        whole = memoryview(self.mapping)
+        data = whole[self.header.size:]
+        doubles = data.cast("d")
+        integers = data.cast("q")
+        self.columns = doubles[0::4], integers[1::4], integers[2::4], integers[3::4]
+        self.views = [whole, data, doubles, integers, *self.columns]
+        self.mapped_length = length
+
+    # Releases the columns and closes the memory map. A map cannot be closed while a slice of a column is still used somewhere
+    # else (e.g. one returned by "TripLog.slice_by_date()"); it is then closed by Python once the last slice is gone.
+    def unmap(self):
+        for view in self.views:
+            view.release()
+        self.views = []
+        self.columns = None
+        self.mapped_length = None
+        if self.mapping is not None:
+            try:
+                self.mapping.close()
+            except BufferError:
+                pass
+            self.mapping = None
+
+    @property
+    def km(self):
+        self.refresh()
+        return self.columns[0]
+
+    @property
+    def day(self):
+        self.refresh()
+        return self.columns[1]
+
+    @property
+    def origin(self):
+        self.refresh()
+        return self.columns[2]
+
+    @property
+    def destination(self):
+        self.refresh()
+        return self.columns[3]
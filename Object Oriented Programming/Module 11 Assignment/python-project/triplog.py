@@ -0,0 +1,155 @@
+import bisect
+import datetime
+from collections import Counter
+from collections.abc import Mapping
+
+from tripjournal import MemoryTripStore, TripJournal
+
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def to_epoch_day(date):
+    return (date - EPOCH).days
+
+
+def from_epoch_day(day):
+    return EPOCH + datetime.timedelta(days=day)
+
+
+# Every trip taken by the car is stored as an instance of the class below.
+class Trip:
+
+    def __init__(self, name, distance, date, origin=None, destination=None):
+        self.name = name
+        self.distance = distance
+        self.date = date
+        self.origin = origin
+        self.destination = destination
+
+
+# The TripLog class stores every trip taken by the car. Instead of one dictionary per trip, it keeps one array per column
+# (distance, date as a day number since 1970, origin and destination as location ids), so adding a trip is O(1) and the history
+# takes very little memory. Trips are numbered by a counter, so a new trip name never has to be searched for.
+# For existing code, the TripLog also behaves like the old 'trips_taken' dictionary: log["Trip1"] returns {'km': ..., 'date': ...}.
+# By default the trips are only kept in memory. When a 'path' is given, they are stored in a TripJournal file instead, which keeps
+# the history across restarts ('sync_every' sets how many trips are written before they are forced to disk).
+class TripLog(Mapping):
+    date_format = "%d/%m/%Y"
+
+    def __init__(self, path=None, sync_every=64):
+        if path is None:
+            self.store = MemoryTripStore()
+        else:
+            self.store = TripJournal(path, sync_every)
+        self.location_ids = {name: location_id for location_id, name in enumerate(self.store.location_names)}
+        self.subscribers = []
+
+    # The columns are read from the store. For a TripJournal they are memoryviews of the memory-mapped file.
+    @property
+    def km(self):
+        return self.store.km
+
+    @property
+    def day(self):
+        return self.store.day
+
+    @property
+    def origin(self):
+        return self.store.origin
+
+    @property
+    def destination(self):
+        return self.store.destination
+
+    @property
+    def location_names(self):
+        return self.store.location_names
+
+    # Trips are normally added in date order, which allows date ranges to be found with a binary search.
+    @property
+    def in_date_order(self):
+        return self.store.in_date_order
+
+    def location_id(self, name):
+        if name not in self.location_ids:
+            self.location_ids[name] = len(self.store.location_names)
+            self.store.add_location(name)
+        return self.location_ids[name]
+
+    # Forces all trips to disk (only needed with a journal).
+    def flush(self):
+        self.store.flush()
+
+    def close(self):
+        self.store.close()
+
+    # Totals over the whole history, read straight from the columns. Like in "__getitem__()", a whole number is returned as an integer.
+    def total_km(self):
+        total = sum(self.km)
+        return int(total) if float(total).is_integer() else total
+
+    # Number of trips per date, with dates in the same "dd/mm/YYYY" format as the Trip objects.
+    def trips_per_day(self):
+        return {from_epoch_day(day).strftime(self.date_format): count for day, count in Counter(self.day).items()}
+
+    # Adds a trip and passes it on to every subscriber. Returns the Trip object.
+    def append(self, distance, origin, destination, date=None):
+        if date is None:
+            date = datetime.date.today()
+        self.store.append(distance, to_epoch_day(date), self.location_id(origin), self.location_id(destination))
+
+        trip = Trip("Trip{}".format(len(self.store)), distance, date.strftime(self.date_format), origin, destination)
+        for subscriber in self.subscribers:
+            subscriber(trip)
+        return trip
+
+    # Registers a function that is called with every new Trip.
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+
+    # Returns the positions (first, end) of the trips between two dates, both included.
+    def date_range(self, start_date, end_date):
+        start_day, end_day = to_epoch_day(start_date), to_epoch_day(end_date)
+        if self.in_date_order:
+            return bisect.bisect_left(self.day, start_day), bisect.bisect_right(self.day, end_day)
+        positions = [index for index, day in enumerate(self.day) if start_day <= day <= end_day]
+        return (positions[0], positions[-1] + 1) if positions else (0, 0)
+
+    # Returns the columns of the trips between two dates as slices (array slices in memory, memoryview slices for a journal).
+    def slice_by_date(self, start_date, end_date):
+        first, end = self.date_range(start_date, end_date)
+        columns = {"km": self.km[first:end], "day": self.day[first:end],
+                   "origin": self.origin[first:end], "destination": self.destination[first:end]}
+        if not self.in_date_order:
+            start_day, end_day = to_epoch_day(start_date), to_epoch_day(end_date)
+            keep = [start_day <= day <= end_day for day in columns["day"]]
+            columns = {name: [value for value, kept in zip(column, keep) if kept] for name, column in columns.items()}
+        return columns
+
+    # --- Compatibility with the old 'trips_taken' dictionary ---
+    def trip_number(self, name):
+        if isinstance(name, str) and name.startswith("Trip") and name[4:].isdigit():
+            number = int(name[4:])
+            if 1 <= number <= len(self.store):
+                return number
+        return None
+
+    def __getitem__(self, name):
+        number = self.trip_number(name)
+        if number is None:
+            raise KeyError(name)
+        km = self.km[number - 1]
+        # Distances are stored as floats; whole numbers are returned as integers, like they were in the dictionary.
+        return {'km': int(km) if km.is_integer() else km, 'date': from_epoch_day(self.day[number - 1]).strftime(self.date_format)}
+
+    def __contains__(self, name):
+        return self.trip_number(name) is not None
+
+    def __iter__(self):
+        return ("Trip{}".format(number) for number in range(1, len(self.store) + 1))
+
+    def __len__(self):
+        return len(self.store)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
@@ -1,7 +1,7 @@
-from energymonitor import EnergyMonitor, main_battery
+import data
+from energymonitor import EnergyMonitor
 from maintenancemonitor import MaintenanceMonitor, Part
-from routeplanner import RoutePlanner, graph, Trip, Location
-from data import charging_stations
+from routeplanner import RoutePlanner, Trip, TripLog, Location
 
 # User Interface is the brain of the car. It controls all of the cars systems, which is why it is initialized with the classes of the three main operations.
 class UserInterface:
@@ -20,13 +20,16 @@ class UserInterface:
     # This method relies on the current location of the car, as well as user input for the destination.
     # For ease of testing and use, both 'origin' and 'destination' can be directly defined within the method arguments.
     # The method has an inbuilt test to catch user input that does not match the graph dictionary.
-    def request_route(self, graph, origin=None, destination=None):
+    # With 'plan_charging' set to True, the route includes any charging stops the car needs to reach the destination.
+    def request_route(self, graph, origin=None, destination=None, plan_charging=False):
         if origin is None:
-            origin = car.get_current_location()
+            origin = self.car.get_current_location()
         while True:
             if destination is None:
                 destination = self.get_user_input()
             if destination in graph:
+                if plan_charging:
+                    return self.route_planner.calculate_route_with_charging(graph, origin, destination)
                 return self.route_planner.calculate_route(graph, origin, destination)
             else:
                 print("Error - Your car is unable to travel to this location. Please select a different location to proceed.")
@@ -37,28 +40,27 @@ class UserInterface:
     
     # This method is effectively useless, besides simulating navigation to the destination. It also updates the current location of the car.
     def begin_driving(self, destination):
-        car.start_moving()
-        car.stop_moving()
-        car.set_current_location(destination)
+        self.car.start_moving()
+        self.car.stop_moving()
+        self.car.set_current_location(destination)
         return "You have reached your destination."
 
     def display_battery_level(self, battery):
         return self.energy_monitor.calculate_battery_level(battery)
 
+    # Lists the locations the car can reach from where it is now without charging, with the battery level left on arrival.
+    def display_range(self):
+        reachable = self.route_planner.reachable_locations(self.car.get_current_location())
+        return ["{} ({} km, {:.1f} left)".format(name, distance, level) for name, (distance, level) in reachable.items()]
+
     def display_maintenance_date(self):
         return self.maintenance_monitor.calc_maintenance()
 
     def display_car_condition(self):
-        total_condition = 0
-        parts_count = len(maintenance_monitor.parts)
-
-        for part in maintenance_monitor.parts.values():
-            total_condition += part["condition"]
-
-        return total_condition / parts_count
+        return self.maintenance_monitor.get_average_condition()
 
     def display_emergency(self):
-        if maintenance_monitor.car_emergency == True:
+        if self.maintenance_monitor.car_emergency == True:
             return "ALERT: CAR REQUIRES MAINTENANCE IMMEDIATELY. CALL ROADSIDE ASSISTANCE!"
         else:
             pass
@@ -78,7 +80,7 @@ class UserInterface:
 
             if choice == '1':
                 print("--- Battery Level ---")
-                print(self.display_battery_level(main_battery))
+                print(self.display_battery_level(self.route_planner.battery))
                 print("---------------------\n")
             elif choice == '2':
                 print("--- Days until Maintenance ---")
@@ -89,15 +91,15 @@ class UserInterface:
                 print(self.display_car_condition())
                 print("------------------------------\n")
             elif choice == "4":
-                location = car.get_current_location()
+                location = self.car.get_current_location()
                 print("You are currently at {}.".format(location))
                 destination = input("Where would you like to go:\n")
-                self.request_route(graph, location, destination)
-                ui.begin_driving(destination)
+                self.request_route(data.graph, location, destination)
+                self.begin_driving(destination)
                 print("You are now at {}.".format(destination))
             elif choice == "5":
                 print("--- Trips ---")
-                print(ui.route_planner.trips_taken)
+                print(self.route_planner.trips_taken)
                 print("-------------\n")
             elif choice == "6":
                 print("Exiting...")
@@ -132,23 +134,29 @@ class SelfDrivingCar:
 
 
 # --- INSTANCES ---
-# The below objects, methods, and print statements were used to test the code and demonstrate its effectiveness.
-route_planner = RoutePlanner(graph)
-energy_monitor = EnergyMonitor()
-maintenance_monitor = MaintenanceMonitor()
-car = SelfDrivingCar(145, "The Pearl")
-ui = UserInterface(route_planner, energy_monitor, maintenance_monitor, car)
+# The objects below (route planner, monitors, car and user interface) are built by the AppContext in app.py, which also registers
+# the parts of the car. They are only created when one of them is first used, e.g. "from userinterface import ui".
+# Every object comes from the default context, so that 'ui.route_planner' and 'route_planner' are the same planner.
+instance_names = {"route_planner": "route_planner", "energy_monitor": "energy_monitor", "maintenance_monitor": "maintenance_monitor",
+                  "car": "car", "ui": "ui", "main_battery": "battery"}
+
+# "from userinterface import *" still provides the instances and the data used in the tests below.
+__all__ = ["UserInterface", "SelfDrivingCar", "EnergyMonitor", "MaintenanceMonitor", "Part", "RoutePlanner", "Trip",
+           "TripLog", "Location", "graph", "charging_stations"] + list(instance_names)
 
 
-ui.maintenance_monitor.add_part("Heat Pump", 99.0, 100.0, 50.0)
-ui.maintenance_monitor.add_part("Front Motor", 100.0, 100.0, 60.0)
-ui.maintenance_monitor.add_part("Battery", 100.0, 100.0, 50.0)
-ui.maintenance_monitor.add_part("Rear Motor", 100.0, 100.0, 60.0)
-ui.maintenance_monitor.add_part("Charge Port", 100.0, 100.0, 30.0)
+def __getattr__(name):
+    if name in instance_names:
+        from app import default_context
+        return getattr(default_context(), instance_names[name])
+    if name in ("graph", "charging_stations"):
+        return getattr(data, name)
+    raise AttributeError("module 'userinterface' has no attribute '{}'".format(name))
 
 
 if __name__ == "__main__":
-    ui.car_ui()
+    from app import default_context
+    default_context().ui.car_ui()
         
 
 
@@ -215,7 +223,7 @@ if __name__ == "__main__":
 # main_battery.set_current_level(75)
 # assert route_planner.suggest_charging(graph, "Corniche", charging_stations) == "Your car needs to be charged and will be travelling to The Pearl, which is 13 km away from here." # PASSED
 # assert route_planner.check_battery(20) == True, "Should return 'True'" # PASSED
-# assert isinstance(route_planner.get_trips(), dict), "'get_trips' should be a dictionary" # PASSED
+# assert isinstance(route_planner.get_trips(), TripLog), "'get_trips' should be a TripLog" # PASSED
 
 # --- PART TEST ---
 # part = Part("Headlight Fluid", 79.0, 100.0, 10.0)